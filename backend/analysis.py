@@ -0,0 +1,306 @@
+"""
+Forgery analysis of one stored upload: decode, ELA, ROI detection, QR
+validation and CNN inference, each on its executor stage.
+
+Kept separate from the HTTP route so cached, background and batch callers
+run exactly the same pipeline.
+"""
+import asyncio
+import functools
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+from executors import get_executors
+from ml.document import DocumentImage
+from ml.ela import ELA_BLOCK_SIZE, ELA_QUALITIES, ELAResult, run_ela
+from ml.qr import QRResult, detect_qr
+from ml.roi import (
+    FACE_DETECT_MAX_SIDE,
+    FACE_MAX_FRACTION,
+    FACE_MIN_FRACTION,
+    ROI_BUDGETS,
+    TEXT_MERGE_PAD,
+    ROIResult,
+    detect_and_select_rois,
+    read_roi_manifest,
+    write_manifest_entries,
+)
+
+
+STORAGE_DIR = Path(os.getenv("STORAGE_DIR", "storage/uploads"))
+# eager: write crops during ROI detection; background: after the response
+# is sent; lazy: only when a client requests the crop file.
+ROI_PERSIST_MODE = os.getenv("ROI_PERSIST_MODE", "background").lower()
+# Batch analysis: uploads per CNN batch, and decoded uploads held at once
+BATCH_GROUP_SIZE = int(os.getenv("PREDICTION_BATCH_GROUP_SIZE", "8"))
+BATCH_MAX_IN_FLIGHT = int(os.getenv("PREDICTION_BATCH_MAX_IN_FLIGHT", "16"))
+
+# progress(stage, state) with state "started" / "completed"; may be called
+# from executor threads (the inference pipeline reports "heatmaps").
+ProgressFn = Callable[[str, str], None]
+T = TypeVar("T")
+
+
+def pipeline_config(pipeline: Any = None) -> Dict[str, Any]:
+    """
+    Settings that change prediction output; part of the cache key.
+    ``pipeline`` (once warmed up) contributes the scoring backend it actually
+    loaded, which may have fallen back to eager, and the runtime profile
+    warm-up settled on.
+    """
+    from ml.inference import INFERENCE_BACKEND, INFERENCE_LETTERBOX, INPUT_SIZES
+
+    backend = getattr(pipeline, "backend", None)
+    runtime = getattr(pipeline, "runtime", None)
+    return {
+        "inputSizes": INPUT_SIZES,
+        "letterbox": INFERENCE_LETTERBOX,
+        "inferenceBackend": getattr(backend, "name", INFERENCE_BACKEND),
+        # int8 may serve only the models that passed the accuracy gate
+        "quantizedModels": getattr(backend, "quantized", None),
+        "runtimeProfile": getattr(runtime, "name", None),
+        "elaQualities": list(ELA_QUALITIES),
+        "elaBlockSize": ELA_BLOCK_SIZE,
+        "faceDetectMaxSide": FACE_DETECT_MAX_SIDE,
+        "faceSizeFractions": [FACE_MIN_FRACTION, FACE_MAX_FRACTION],
+        "textMergePad": TEXT_MERGE_PAD,
+        "roiBudgets": ROI_BUDGETS,
+    }
+
+
+@dataclass
+class AnalysisResult:
+    ela: ELAResult
+    rois: List[ROIResult]
+    rois_detected: int
+    qr_data: Optional[str]
+    qr_valid: bool
+    inference: Any  # InferenceResult (real or mock pipeline)
+
+    def payload(self) -> Dict[str, Any]:
+        """JSON-serialisable prediction fields (everything but uploadId/createdAt)."""
+        result = self.inference
+        energy = self.ela.energy
+        return {
+            "densenetScore": float(result.full_image_scores.densenet),
+            "mobilenetScore": float(result.full_image_scores.mobilenet),
+            "ensembleScore": float(result.full_image_scores.ensemble),
+            "severity": result.severity,
+            "tamperedRatio": float(result.tampered_ratio),
+            "elaPath": str(self.ela.path),
+            "elaEnergy": float(energy.mean()),
+            "elaPeakEnergy": float(energy.max()),
+            "roiCrops": [
+                {"kind": r.kind, "path": r.path, "bbox": list(r.bbox)} for r in self.rois
+            ],
+            "heatmapFull": result.full_image_heatmap,
+            "roiHeatmaps": [
+                {"kind": r.kind, "path": r.heatmap_path} for r in result.roi_results
+            ],
+            "qrData": self.qr_data,
+            "qrValid": bool(self.qr_valid),
+            "roiDetected": self.rois_detected,
+            "roiEvaluated": len(self.rois),
+        }
+
+
+def link_roi_manifest(upload_id: str, payload: Dict[str, Any]) -> None:
+    """
+    Give a reused payload (cache hit or precompute of identical bytes) an
+    ROI manifest under ``upload_id``, so crops can be served for this
+    upload. Entries keep the original crop paths; the image bytes are the
+    same, so a crop materialised from either upload is identical.
+    """
+    roi_dir = STORAGE_DIR / "rois" / upload_id
+    if read_roi_manifest(roi_dir):
+        return
+    write_manifest_entries(payload.get("roiCrops", []), roi_dir)
+
+
+def heatmap_paths(payload: Dict[str, Any]) -> List[str]:
+    return [payload["heatmapFull"]] + [h["path"] for h in payload["roiHeatmaps"]]
+
+
+async def _stage(progress: Optional[ProgressFn], name: str, work: Awaitable[T]) -> T:
+    if progress is not None:
+        progress(name, "started")
+    result = await work
+    if progress is not None:
+        progress(name, "completed")
+    return result
+
+
+@dataclass
+class PreparedUpload:
+    """Everything ahead of CNN inference for one upload."""
+
+    upload_id: str
+    document: DocumentImage
+    ela: ELAResult
+    qr: QRResult
+    rois: List[ROIResult]
+    rois_detected: int
+
+    def inference_request(self) -> Dict[str, Any]:
+        return {
+            "full_image": self.document,
+            "roi_paths": [
+                {"kind": r.kind, "path": r.path, "image": r.document} for r in self.rois
+            ],
+            "upload_id": self.upload_id,
+        }
+
+    def result(self, inference: Any) -> AnalysisResult:
+        return AnalysisResult(
+            ela=self.ela,
+            rois=self.rois,
+            rois_detected=self.rois_detected,
+            qr_data=self.qr.data,
+            qr_valid=self.qr.is_valid,
+            inference=inference,
+        )
+
+
+async def prepare_upload(
+    upload_id: str,
+    image_path: str,
+    document: Optional[DocumentImage] = None,
+    progress: Optional[ProgressFn] = None,
+) -> PreparedUpload:
+    # CPU-bound stages run on their executor pools so the event loop stays
+    # responsive for other requests.
+    executors = get_executors()
+
+    # Decode the upload once; every stage below shares this object.
+    if document is None:
+        document = await executors.run("decode", DocumentImage.from_path, image_path)
+
+    # ELA and the single QR detect+decode pass are independent
+    ela_dir = STORAGE_DIR / "ela" / upload_id
+    ela_dir.mkdir(parents=True, exist_ok=True)
+    ela, qr = await asyncio.gather(
+        _stage(progress, "ela", executors.run("ela", run_ela, document, str(ela_dir / "ela.jpg"))),
+        _stage(progress, "qr", executors.run("qr", detect_qr, document)),
+    )
+
+    # ROI detection (reuses the QR bbox from the QR stage; ranks and caps
+    # ROIs using the ELA energy grid so CNN cost per upload is bounded)
+    roi_dir = STORAGE_DIR / "rois" / upload_id
+    rois, rois_detected = await _stage(
+        progress,
+        "roi",
+        executors.run(
+            "roi",
+            detect_and_select_rois,
+            document,
+            str(roi_dir),
+            persist=ROI_PERSIST_MODE == "eager",
+            qr=qr,
+            ela=ela,
+        ),
+    )
+    return PreparedUpload(upload_id, document, ela, qr, rois, rois_detected)
+
+
+async def run_inference(
+    pipeline: Any, requests: List[Dict[str, Any]], progress: Optional[ProgressFn] = None
+) -> List[Any]:
+    """
+    CNN inference for ``inference_request()`` dicts. Pipelines with
+    ``arun_batch`` preprocess and render on the inference stage but await
+    the micro-batcher on the event loop instead of holding a thread.
+    """
+    executors = get_executors()
+    if hasattr(pipeline, "arun_batch"):
+        return await pipeline.arun_batch(
+            requests, progress, offload=functools.partial(executors.run, "inference")
+        )
+    return await executors.run("inference", pipeline.run_batch, requests, progress)
+
+
+async def analyze_upload(
+    upload_id: str,
+    image_path: str,
+    pipeline: Any,
+    document: Optional[DocumentImage] = None,
+    progress: Optional[ProgressFn] = None,
+) -> AnalysisResult:
+    prepared = await prepare_upload(upload_id, image_path, document, progress)
+
+    # Inference (the pipeline reports its own "heatmaps" sub-stage)
+    results = await _stage(
+        progress, "inference", run_inference(pipeline, [prepared.inference_request()], progress)
+    )
+    return prepared.result(results[0])
+
+
+async def analyze_uploads(
+    uploads: List[Tuple[str, str]],
+    pipeline: Any,
+    group_size: int = BATCH_GROUP_SIZE,
+    max_in_flight: int = BATCH_MAX_IN_FLIGHT,
+) -> AsyncIterator[Tuple[str, Union[AnalysisResult, Exception]]]:
+    """
+    Analyse many (upload_id, image_path) pairs, yielding results as they
+    complete.
+
+    The pre-inference stages of all uploads run concurrently on the stage
+    executors. Whatever uploads are ready when the inference stage frees
+    up, up to ``group_size``, go through the CNNs as one tensor batch via
+    ``run_inference``. At most ``max_in_flight`` decoded uploads are
+    held in memory at once.
+    """
+    slots = asyncio.Semaphore(max(1, max_in_flight))
+    ready: "asyncio.Queue[Tuple[str, Union[PreparedUpload, Exception]]]" = asyncio.Queue()
+
+    async def prepare(upload_id: str, image_path: str) -> None:
+        await slots.acquire()
+        try:
+            prepared = await prepare_upload(upload_id, image_path)
+        except Exception as e:
+            slots.release()
+            ready.put_nowait((upload_id, e))
+            return
+        ready.put_nowait((upload_id, prepared))
+
+    tasks = [asyncio.create_task(prepare(u, p)) for u, p in uploads]
+    try:
+        remaining = len(uploads)
+        while remaining:
+            group = [await ready.get()]
+            while len(group) < group_size and not ready.empty():
+                group.append(ready.get_nowait())
+            remaining -= len(group)
+
+            prepared = [item for _, item in group if isinstance(item, PreparedUpload)]
+            for upload_id, item in group:
+                if isinstance(item, Exception):
+                    yield upload_id, item
+            if not prepared:
+                continue
+
+            try:
+                results = await run_inference(pipeline, [p.inference_request() for p in prepared])
+            except Exception as e:
+                results = [e] * len(prepared)
+            finally:
+                for _ in prepared:
+                    slots.release()
+            for p, result in zip(prepared, results):
+                yield p.upload_id, result if isinstance(result, Exception) else p.result(result)
+    finally:
+        for task in tasks:
+            task.cancel()
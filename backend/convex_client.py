@@ -1,5 +1,10 @@
+import asyncio
+import copy
+import importlib.util
+import json
 import os
-from typing import Any, Dict, Optional
+import time
+from typing import Any, Dict, Optional, Tuple
 
 import httpx
 from dotenv import load_dotenv
@@ -9,6 +14,139 @@ load_dotenv()
 # Try to use real ConvexClient, fall back to mock if needed
 USE_MOCK_CONVEX = os.getenv("USE_MOCK_CONVEX", "false").lower() == "true"
 
+# Connection pool / transport tuning for the app-scoped client
+CONVEX_TIMEOUT_SECONDS = float(os.getenv("CONVEX_TIMEOUT_SECONDS", "10"))
+CONVEX_CONNECT_TIMEOUT_SECONDS = float(os.getenv("CONVEX_CONNECT_TIMEOUT_SECONDS", "5"))
+CONVEX_MAX_CONNECTIONS = int(os.getenv("CONVEX_MAX_CONNECTIONS", "100"))
+CONVEX_MAX_KEEPALIVE = int(os.getenv("CONVEX_MAX_KEEPALIVE", "20"))
+CONVEX_KEEPALIVE_EXPIRY = float(os.getenv("CONVEX_KEEPALIVE_EXPIRY", "30"))
+CONVEX_HTTP2 = os.getenv("CONVEX_HTTP2", "false").lower() == "true"
+
+# Per-query TTLs (seconds) for the read cache, e.g.
+# CONVEX_QUERY_CACHE_TTLS="users:getUserById=30,uploads:getUploadById=60".
+# Queries not listed are never cached (but are still coalesced in flight).
+DEFAULT_QUERY_CACHE_TTLS = (
+    "users:getUserById=30,users:getUserByEmail=30,"
+    "uploads:getUploadById=60,models:getModelMetrics=10"
+)
+CONVEX_QUERY_CACHE_ENABLED = os.getenv("CONVEX_QUERY_CACHE_ENABLED", "true").lower() == "true"
+
+
+def _parse_ttls(spec: str) -> Dict[str, float]:
+    ttls: Dict[str, float] = {}
+    for item in spec.split(","):
+        path, sep, ttl = item.strip().partition("=")
+        if sep and path:
+            ttls[path.strip()] = float(ttl)
+    return ttls
+
+
+QUERY_CACHE_TTLS = _parse_ttls(os.getenv("CONVEX_QUERY_CACHE_TTLS", DEFAULT_QUERY_CACHE_TTLS))
+
+
+def _http2_available() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def _namespace(path: str) -> str:
+    # "users:createUser" -> "users"; a mutation invalidates its module's queries
+    return path.split(":", 1)[0]
+
+
+class QueryCache:
+    """
+    Read-through layer for Convex queries.
+
+    Concurrent identical queries (same path and args) share one in-flight
+    request, and paths with a configured TTL keep their result until it
+    expires or a mutation in the same module (``users:*``, ``uploads:*``,
+    ...) is sent through the client. Empty results are not cached so a
+    "not found" never outlives the write that creates the document.
+    """
+
+    def __init__(self, ttls: Dict[str, float], enabled: bool = True) -> None:
+        self.ttls = ttls
+        self.enabled = enabled
+        self._entries: Dict[Tuple[str, str], Tuple[float, Any]] = {}
+        self._inflight: Dict[Tuple[str, str], "asyncio.Task[Any]"] = {}
+        self._waiters: Dict[Tuple[str, str], int] = {}
+        # Bumped on invalidation so a query that started before a mutation
+        # does not repopulate the cache with a pre-mutation result.
+        self._generation: Dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get(self, path: str, args: Dict[str, Any], fetch) -> Any:
+        key = (path, json.dumps(args, sort_keys=True, default=str))
+        ttl = self.ttls.get(path) if self.enabled else None
+
+        if ttl:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.hits += 1
+                    return copy.deepcopy(entry[1])
+                del self._entries[key]
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._fetch(key, path, ttl, fetch))
+            # Mark retrieved so a failure nobody awaits does not log a warning
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight[key] = task
+            self._waiters[key] = 0
+
+        # The fetch runs in its own task: a caller that is cancelled (e.g. the
+        # client disconnected) leaves it running for the other waiters, and it
+        # is only cancelled once nobody is waiting for it any more.
+        self._waiters[key] += 1
+        try:
+            return copy.deepcopy(await asyncio.shield(task))
+        finally:
+            if not task.done():
+                self._waiters[key] -= 1
+                if self._waiters[key] == 0:
+                    task.cancel()
+
+    async def _fetch(self, key: Tuple[str, str], path: str, ttl: Optional[float], fetch) -> Any:
+        namespace = _namespace(path)
+        generation = self._generation.get(namespace, 0)
+        try:
+            value = await fetch()
+            if ttl and value and self._generation.get(namespace, 0) == generation:
+                self._entries[key] = (time.monotonic() + ttl, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+            self._waiters.pop(key, None)
+
+    def invalidate(self, namespace: str) -> None:
+        self._generation[namespace] = self._generation.get(namespace, 0) + 1
+        stale = [k for k in self._entries if _namespace(k[0]) == namespace]
+        for k in stale:
+            del self._entries[k]
+        self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "inflight": len(self._inflight),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hitRate": ((self.hits + self.coalesced) / lookups) if lookups else 0.0,
+            "ttls": self.ttls,
+        }
+
 
 class ConvexClient:
     """
@@ -28,6 +166,8 @@ class ConvexClient:
         self,
         deployment_url: Optional[str] = None,
         api_key: Optional[str] = None,
+        timeout: float = CONVEX_TIMEOUT_SECONDS,
+        http2: bool = CONVEX_HTTP2,
     ) -> None:
         # Prefer the Convex URL written by `npx convex dev` into env
         self.deployment_url = deployment_url or os.getenv("CONVEX_URL")
@@ -35,51 +175,79 @@ class ConvexClient:
         if not self.deployment_url:
             raise RuntimeError("CONVEX_URL is not configured in backend/.env")
 
-        self._client = httpx.AsyncClient(timeout=10.0)
-
-    @property
-    def _headers(self) -> Dict[str, str]:
-        headers: Dict[str, str] = {
+        # Request constants are built once, not per call.
+        base_url = self.deployment_url.rstrip("/")
+        self._query_url = f"{base_url}/api/query"
+        self._mutation_url = f"{base_url}/api/mutation"
+        self._headers: Dict[str, str] = {
             "Content-Type": "application/json",
         }
         # Only send admin key if configured.
         if self.api_key:
-            headers["Authorization"] = f"Convex {self.api_key}"
-        return headers
+            self._headers["Authorization"] = f"Convex {self.api_key}"
+
+        if http2 and not _http2_available():
+            print("[CONVEX] CONVEX_HTTP2 requested but the 'h2' package is missing; using HTTP/1.1")
+            http2 = False
 
-    async def query(self, path: str, args: Dict[str, Any]) -> Any:
-        url = f"{self.deployment_url.rstrip('/')}/api/query"
+        self._client = httpx.AsyncClient(
+            http2=http2,
+            headers=self._headers,
+            timeout=httpx.Timeout(timeout, connect=CONVEX_CONNECT_TIMEOUT_SECONDS),
+            limits=httpx.Limits(
+                max_connections=CONVEX_MAX_CONNECTIONS,
+                max_keepalive_connections=CONVEX_MAX_KEEPALIVE,
+                keepalive_expiry=CONVEX_KEEPALIVE_EXPIRY,
+            ),
+        )
+        self.cache = QueryCache(QUERY_CACHE_TTLS, enabled=CONVEX_QUERY_CACHE_ENABLED)
+
+    async def _call(
+        self, url: str, kind: str, path: str, args: Dict[str, Any], timeout: Optional[float]
+    ) -> Any:
         payload = {"path": path, "args": args, "format": "json"}
-        resp = await self._client.post(url, headers=self._headers, json=payload)
+        kwargs: Dict[str, Any] = {"json": payload}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        resp = await self._client.post(url, **kwargs)
         resp.raise_for_status()
         data = resp.json()
         if data.get("status") != "success":
             # Surface Convex error to FastAPI instead of generic 500
-            error_msg = data.get("errorMessage", "Unknown Convex query error")
-            raise RuntimeError(f"Convex query error for {path}: {error_msg}")
+            error_msg = data.get("errorMessage", f"Unknown Convex {kind} error")
+            raise RuntimeError(f"Convex {kind} error for {path}: {error_msg}")
         return data.get("value")
 
-    async def mutation(self, path: str, args: Dict[str, Any]) -> Any:
-        url = f"{self.deployment_url.rstrip('/')}/api/mutation"
-        payload = {"path": path, "args": args, "format": "json"}
-        resp = await self._client.post(url, headers=self._headers, json=payload)
-        resp.raise_for_status()
-        data = resp.json()
-        if data.get("status") != "success":
-            error_msg = data.get("errorMessage", "Unknown Convex mutation error")
-            raise RuntimeError(f"Convex mutation error for {path}: {error_msg}")
-        return data.get("value")
+    async def query(self, path: str, args: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        return await self.cache.get(
+            path, args, lambda: self._call(self._query_url, "query", path, args, timeout)
+        )
 
+    async def mutation(
+        self, path: str, args: Dict[str, Any], timeout: Optional[float] = None
+    ) -> Any:
+        try:
+            return await self._call(self._mutation_url, "mutation", path, args, timeout)
+        finally:
+            # Invalidate even on failure: the write may have been applied
+            # before the response was lost.
+            self.cache.invalidate(_namespace(path))
 
-async def get_convex_client() -> ConvexClient:
-    """
-    FastAPI dependency to lazily construct the Convex client.
-    Falls back to mock if real backend is unavailable.
-    """
+    def stats(self) -> Dict[str, Any]:
+        return {"queryCache": self.cache.stats()}
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+_client: Optional[Any] = None
+
+
+def _build_client() -> Any:
     if USE_MOCK_CONVEX:
         from mock_convex import MockConvexClient
         return MockConvexClient()
-    
+
     try:
         return ConvexClient()
     except Exception as e:
@@ -89,3 +257,29 @@ async def get_convex_client() -> ConvexClient:
         return MockConvexClient()
 
 
+def init_convex_client() -> Any:
+    """Create the application-scoped client (called from the app lifespan)."""
+    global _client
+    if _client is None:
+        _client = _build_client()
+    return _client
+
+
+async def close_convex_client() -> None:
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def convex_stats() -> Optional[Dict[str, Any]]:
+    stats = getattr(_client, "stats", None)
+    return stats() if stats is not None else None
+
+
+async def get_convex_client() -> ConvexClient:
+    """
+    FastAPI dependency returning the shared, pooled Convex client.
+    Falls back to mock if real backend is unavailable.
+    """
+    return init_convex_client()
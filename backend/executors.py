@@ -0,0 +1,185 @@
+"""
+Executor layer for the CPU-bound prediction stages.
+
+The prediction route is ``async``; running ELA, ROI detection, QR decoding or
+CNN inference inline would freeze the event loop (and with it /health and the
+auth endpoints) for the whole pipeline. Each stage instead runs on its own
+bounded pool:
+
+  - ``thread`` mode: a per-stage ThreadPoolExecutor. Torch and OpenCV release
+    the GIL in their hot loops, so threads scale for them.
+  - ``process`` mode: a shared ProcessPoolExecutor for pure-Python / GIL-bound
+    work. Arguments and results must be picklable. Inference always runs on
+    threads because the models live in this process.
+
+The ``cache`` stage carries prediction-cache file I/O and, like inference,
+is always threaded since the cache lives in this process.
+
+Configuration (per stage, ``<STAGE>`` in DECODE, ELA, ROI, QR, INFERENCE, CACHE):
+  STAGE_EXECUTOR_<STAGE>     thread | process   (default thread)
+  STAGE_CONCURRENCY_<STAGE>  max concurrent calls for the stage
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Set
+
+
+DEFAULT_CONCURRENCY = {"decode": 4, "ela": 4, "roi": 4, "qr": 4, "inference": 2, "cache": 4}
+THREAD_ONLY_STAGES = {"inference", "cache"}
+
+
+@dataclass
+class StageConfig:
+    name: str
+    mode: str
+    concurrency: int
+
+
+def load_stage_configs() -> Dict[str, StageConfig]:
+    configs: Dict[str, StageConfig] = {}
+    for stage, default_limit in DEFAULT_CONCURRENCY.items():
+        key = stage.upper()
+        mode = os.getenv(f"STAGE_EXECUTOR_{key}", "thread").lower()
+        if mode not in ("thread", "process") or stage in THREAD_ONLY_STAGES:
+            mode = "thread"
+        limit = max(1, int(os.getenv(f"STAGE_CONCURRENCY_{key}", str(default_limit))))
+        configs[stage] = StageConfig(name=stage, mode=mode, concurrency=limit)
+    return configs
+
+
+class _StageStats:
+    def __init__(self) -> None:
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_seconds = 0.0
+
+
+class StageExecutors:
+    def __init__(self, configs: Optional[Dict[str, StageConfig]] = None):
+        self.configs = configs or load_stage_configs()
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self._stats: Dict[str, _StageStats] = {}
+        self._threads: Dict[str, ThreadPoolExecutor] = {}
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._background: Set[asyncio.Task] = set()
+
+        process_workers = 0
+        for stage, cfg in self.configs.items():
+            self._semaphores[stage] = asyncio.Semaphore(cfg.concurrency)
+            self._stats[stage] = _StageStats()
+            if cfg.mode == "thread":
+                self._threads[stage] = ThreadPoolExecutor(
+                    max_workers=cfg.concurrency, thread_name_prefix=f"stage-{stage}"
+                )
+            else:
+                process_workers += cfg.concurrency
+
+        if process_workers:
+            # spawn: forking a process that already holds torch/OpenCV thread
+            # pools is not safe.
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def _executor_for(self, stage: str) -> Executor:
+        if stage in self._threads:
+            return self._threads[stage]
+        return self._process_pool
+
+    async def run(self, stage: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run ``fn(*args, **kwargs)`` on ``stage``'s pool, honouring its concurrency limit."""
+        if stage not in self.configs:
+            raise KeyError(f"Unknown pipeline stage: {stage}")
+        stats = self._stats[stage]
+        call = functools.partial(fn, *args, **kwargs)
+        loop = asyncio.get_running_loop()
+
+        semaphore = self._semaphores[stage]
+        stats.waiting += 1
+        try:
+            await semaphore.acquire()
+        finally:
+            # Also when cancelled while waiting (client gone, job cancelled)
+            stats.waiting -= 1
+        try:
+            stats.active += 1
+            start = time.perf_counter()
+            try:
+                result = await loop.run_in_executor(self._executor_for(stage), call)
+            except BaseException:
+                stats.failed += 1
+                raise
+            finally:
+                stats.active -= 1
+                stats.total_seconds += time.perf_counter() - start
+            stats.completed += 1
+            return result
+        finally:
+            semaphore.release()
+
+    def spawn(self, stage: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> asyncio.Task:
+        """Fire-and-forget ``run`` for work that must not delay a response."""
+        task = asyncio.create_task(self.run(stage, fn, *args, **kwargs))
+        self._background.add(task)
+
+        def _done(t: asyncio.Task) -> None:
+            self._background.discard(t)
+            if not t.cancelled() and t.exception() is not None:
+                print(f"[EXECUTORS] Background {stage} task failed: {t.exception()}")
+
+        task.add_done_callback(_done)
+        return task
+
+    def shutdown(self) -> None:
+        for pool in self._threads.values():
+            pool.shutdown(wait=False, cancel_futures=True)
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {}
+        for stage, cfg in self.configs.items():
+            st = self._stats[stage]
+            finished = st.completed + st.failed
+            out[stage] = {
+                "mode": cfg.mode,
+                "concurrency": cfg.concurrency,
+                "active": st.active,
+                "waiting": st.waiting,
+                "completed": st.completed,
+                "failed": st.failed,
+                "meanSeconds": (st.total_seconds / finished) if finished else 0.0,
+            }
+        return out
+
+
+_executors: Optional[StageExecutors] = None
+
+
+def init_executors() -> StageExecutors:
+    global _executors
+    _executors = StageExecutors()
+    return _executors
+
+
+def get_executors() -> StageExecutors:
+    global _executors
+    if _executors is None:
+        # Routers used outside the app lifespan (scripts, tests) still work.
+        _executors = StageExecutors()
+    return _executors
+
+
+def shutdown_executors() -> None:
+    global _executors
+    if _executors is not None:
+        _executors.shutdown()
+        _executors = None
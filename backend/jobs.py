@@ -0,0 +1,254 @@
+"""
+Asynchronous prediction jobs.
+
+A job is queued and run by a fixed pool of asyncio workers, so a long CPU
+inference no longer holds an HTTP connection open. Clients poll the job or
+subscribe to its event stream. Each event is an SSE message. ``stage``
+events carry per-stage progress (ela, qr, roi, inference, heatmaps).
+``status`` events carry lifecycle changes (queued, running, succeeded,
+failed, cancelled).
+
+Cancelling a running job cancels its coroutine; a pipeline stage already
+executing on a worker thread finishes in the background and its result is
+discarded.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+
+JOB_WORKERS = int(os.getenv("PREDICTION_JOB_WORKERS", "2"))
+JOB_QUEUE_SIZE = int(os.getenv("PREDICTION_JOB_QUEUE_SIZE", "64"))
+JOB_RETENTION_SECONDS = float(os.getenv("PREDICTION_JOB_RETENTION_SECONDS", "3600"))
+SSE_KEEPALIVE_SECONDS = 15.0
+
+TERMINAL_STATES = ("succeeded", "failed", "cancelled")
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, upload_id: str, user_id: str):
+        self.id = uuid.uuid4().hex
+        self.upload_id = upload_id
+        self.user_id = user_id
+        self.status = "queued"
+        self.stage: Optional[str] = None
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        self.events: List[Dict[str, Any]] = []
+        self._subscribers: List["asyncio.Queue[Dict[str, Any]]"] = []
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def done(self) -> bool:
+        return self.status in TERMINAL_STATES
+
+    def publish(self, event: str, data: Dict[str, Any]) -> None:
+        """Record an event and fan it out (event-loop thread only)."""
+        message = {"event": event, "data": data}
+        self.events.append(message)
+        for queue in self._subscribers:
+            queue.put_nowait(message)
+
+    def set_status(self, status: str) -> None:
+        self.status = status
+        if status == "running":
+            self.started_at = time.time()
+        elif status in TERMINAL_STATES:
+            self.finished_at = time.time()
+        self.publish("status", {"status": status})
+
+    def progress(self, stage: str, state: str) -> None:
+        if state == "started":
+            self.stage = stage
+        self.publish("stage", {"stage": stage, "state": state})
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "jobId": self.id,
+            "uploadId": self.upload_id,
+            "status": self.status,
+            "stage": self.stage,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "result": self.result,
+            "error": self.error,
+        }
+
+    async def stream(self) -> AsyncIterator[str]:
+        """Server-Sent Events: replay past events, then follow until done."""
+        queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+        backlog = list(self.events)
+        self._subscribers.append(queue)
+        try:
+            for message in backlog:
+                yield _sse(message)
+            finished = self.done
+            while not finished:
+                try:
+                    message = await asyncio.wait_for(queue.get(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield _sse(message)
+                finished = message["event"] == "status" and message["data"]["status"] in TERMINAL_STATES
+        finally:
+            self._subscribers.remove(queue)
+
+
+def _sse(message: Dict[str, Any]) -> str:
+    return f"event: {message['event']}\ndata: {json.dumps(message['data'])}\n\n"
+
+
+# progress(stage, state) callback handed to the job's runner
+ProgressFn = Callable[[str, str], None]
+Runner = Callable[[Job, ProgressFn], Awaitable[Dict[str, Any]]]
+
+
+class JobManager:
+    def __init__(
+        self,
+        workers: int = JOB_WORKERS,
+        queue_size: int = JOB_QUEUE_SIZE,
+        retention_seconds: float = JOB_RETENTION_SECONDS,
+    ):
+        self.workers = max(1, workers)
+        self.retention_seconds = retention_seconds
+        self._queue: "asyncio.Queue[tuple]" = asyncio.Queue(maxsize=max(1, queue_size))
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._tasks: List[asyncio.Task] = []
+
+        self.submitted = 0
+        self.rejected = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.cancelled = 0
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for job in self._jobs.values():
+            if not job.done:
+                self.cancel(job)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def _prune(self) -> None:
+        cutoff = time.time() - self.retention_seconds
+        expired = [
+            job_id
+            for job_id, job in self._jobs.items()
+            if job.done and job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def submit(self, upload_id: str, user_id: str, runner: Runner) -> Job:
+        self._prune()
+        job = Job(upload_id, user_id)
+        try:
+            self._queue.put_nowait((job, runner))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise JobQueueFull(f"{self._queue.maxsize} prediction jobs already queued")
+        self._jobs[job.id] = job
+        self.submitted += 1
+        job.set_status("queued")
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job: Job) -> None:
+        if job.done:
+            return
+        if job._task is not None:
+            job._task.cancel()  # the worker records the cancellation
+            return
+        job.set_status("cancelled")  # still queued: the worker skips it
+        self.cancelled += 1
+
+    async def _worker(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            job, runner = await self._queue.get()
+            if job.done:
+                continue
+
+            def progress(stage: str, state: str, job: Job = job) -> None:
+                # Called from the event loop and from executor threads alike
+                loop.call_soon_threadsafe(job.progress, stage, state)
+
+            job.set_status("running")
+            job._task = asyncio.create_task(runner(job, progress))
+            try:
+                job.result = await asyncio.shield(job._task)
+            except asyncio.CancelledError:
+                if not job._task.cancelled():
+                    # The worker itself is being stopped
+                    job._task.cancel()
+                    raise
+                job.set_status("cancelled")
+                self.cancelled += 1
+            except Exception as e:
+                job.error = str(e) or type(e).__name__
+                job.publish("error", {"detail": job.error})
+                job.set_status("failed")
+                self.failed += 1
+            else:
+                job.publish("result", job.result)
+                job.set_status("succeeded")
+                self.succeeded += 1
+            finally:
+                job._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        states: Dict[str, int] = {}
+        for job in self._jobs.values():
+            states[job.status] = states.get(job.status, 0) + 1
+        return {
+            "queued": self._queue.qsize(),
+            "states": states,
+            "submitted": self.submitted,
+            "rejected": self.rejected,
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "config": {"workers": self.workers, "queueSize": self._queue.maxsize},
+        }
+
+
+_manager: Optional[JobManager] = None
+
+
+def init_job_manager() -> JobManager:
+    global _manager
+    _manager = JobManager()
+    _manager.start()
+    return _manager
+
+
+async def stop_job_manager() -> None:
+    global _manager
+    if _manager is not None:
+        await _manager.stop()
+        _manager = None
+
+
+def get_job_manager() -> Optional[JobManager]:
+    return _manager
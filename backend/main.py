@@ -1,10 +1,21 @@
+import asyncio
 import os
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-
+from fastapi.responses import JSONResponse
+
+from convex_client import close_convex_client, convex_stats, init_convex_client
+from executors import get_executors, init_executors, shutdown_executors
+from jobs import get_job_manager, init_job_manager, stop_job_manager
+from ml.detectors import detector_metrics
+from ml.registry import get_registry, init_registry
+from precompute import get_precomputer, init_precomputer, stop_precomputer
+from prediction_cache import get_prediction_cache, init_prediction_cache
+from prediction_writer import close_prediction_writer, get_prediction_writer, init_prediction_writer
 from routers import auth, uploads, predictions, admin
 
 
@@ -12,11 +23,48 @@ load_dotenv()
 
 STORAGE_DIR = Path(os.getenv("STORAGE_DIR", "storage/uploads"))
 STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+CHECKPOINT_DIR = os.getenv("MODEL_CHECKPOINT_DIR", "ml/checkpoints")
+WARMUP_ITERATIONS = int(os.getenv("MODEL_WARMUP_ITERATIONS", "1"))
+
+
+async def _initialize_models(registry) -> None:
+    try:
+        await asyncio.to_thread(registry.initialize)
+    except Exception:
+        # Error is recorded on the registry and surfaced by /ready.
+        pass
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Models load in the background so /health answers immediately;
+    # /ready flips once checkpoints are restored and warmed up.
+    init_convex_client()
+    init_executors()
+    init_prediction_cache(str(STORAGE_DIR))
+    await init_prediction_writer(str(STORAGE_DIR))
+    init_precomputer()
+    init_job_manager()
+    registry = init_registry(CHECKPOINT_DIR, str(STORAGE_DIR), WARMUP_ITERATIONS)
+    init_task = asyncio.create_task(_initialize_models(registry))
+    yield
+    # Cancelling does not stop a load already running in its worker thread;
+    # registry.shutdown() below keeps it from starting anything afterwards.
+    init_task.cancel()
+    await stop_job_manager()
+    await stop_precomputer()
+    registry.shutdown()
+    shutdown_executors()
+    # Flush queued prediction writes before the Convex client goes away
+    await close_prediction_writer()
+    await close_convex_client()
+
 
 app = FastAPI(
     title="Aadhaar Forgery Detection API",
     description="FastAPI backend for AI-powered Aadhaar document & image forgery detection.",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
 origins = os.getenv("CORS_ORIGINS", "http://localhost:3000").split(",")
@@ -29,6 +77,11 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Enforces MAX_UPLOAD_BYTES on the raw body, before the multipart parser
+# spools it (declared Content-Length and chunked bodies alike).
+app.add_middleware(uploads.UploadSizeLimitMiddleware)
+
+
 app.include_router(auth.router)
 app.include_router(uploads.router)
 app.include_router(predictions.router)
@@ -40,6 +93,29 @@ async def health():
     return {"status": "ok", "message": "Backend is running"}
 
 
+@app.get("/ready")
+async def ready():
+    registry = get_registry()
+    if registry is None:
+        return JSONResponse(status_code=503, content={"ready": False, "loaded": False, "warm": False})
+    body = registry.status()
+    return JSONResponse(status_code=200 if registry.ready else 503, content=body)
+
+
+@app.get("/stats")
+async def stats():
+    registry = get_registry()
+    return {
+        "models": registry.status() if registry is not None else None,
+        "executors": get_executors().stats(),
+        "detectors": detector_metrics(),
+        "predictionCache": get_prediction_cache().stats() if get_prediction_cache() else None,
+        "convex": convex_stats(),
+        "jobs": get_job_manager().stats() if get_job_manager() else None,
+        "precompute": get_precomputer().stats() if get_precomputer() else None,
+        "predictionWriter": get_prediction_writer().stats() if get_prediction_writer() else None,
+    }
+
 
 
 if __name__ == "__main__":
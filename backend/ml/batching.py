@@ -0,0 +1,206 @@
+"""
+Cross-request dynamic micro-batching for the CNN ensemble.
+
+Concurrent predictions each produce a small (N, C, H, W) stack of inputs.
+``MicroBatcher`` collects those stacks until ``max_batch_size`` samples are
+queued or the oldest one has waited ``max_wait_ms``, runs a single batched
+forward on a dedicated worker thread, and scatters the per-sample outputs
+back to the callers' futures. Async callers ``await asubmit(...)`` so the
+event loop, not a blocked executor thread, waits for the batch to fill.
+"""
+import asyncio
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+
+@dataclass
+class _Pending:
+    batch: torch.Tensor
+    future: Future
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+    @property
+    def size(self) -> int:
+        return int(self.batch.shape[0])
+
+
+class MicroBatcher:
+    """
+    ``fn`` takes a stacked (N, ...) tensor and returns a tuple of per-sample
+    sequences (anything sliceable along the first axis). Each caller receives
+    the same tuple structure sliced to its own samples.
+
+    Only requests whose tensors share a shape are merged; mixed shapes are
+    served in separate batches.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[torch.Tensor], Tuple[Sequence, ...]],
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+        name: str = "model",
+    ):
+        self.fn = fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.name = name
+
+        self._queue: Deque[_Pending] = deque()
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+
+        # Statistics (guarded by _cond)
+        self._batches = 0
+        self._samples = 0
+        self._requests = 0
+        self._max_batch_seen = 0
+        self._wait_seconds = 0.0
+        self._batch_sizes: Counter = Counter()
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self) -> None:
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._loop, name=f"microbatch-{self.name}", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        # Fail anything that was still queued rather than leaving callers hanging
+        with self._cond:
+            while self._queue:
+                item = self._queue.popleft()
+                if item.future.set_running_or_notify_cancel():
+                    item.future.set_exception(RuntimeError("Micro-batcher stopped"))
+
+    def submit(self, batch: torch.Tensor) -> Future:
+        """Thread-safe submit; returns a concurrent.futures.Future."""
+        future: Future = Future()
+        with self._cond:
+            if not self._running:
+                raise RuntimeError("Micro-batcher is not running")
+            self._queue.append(_Pending(batch=batch, future=future))
+            self._cond.notify()
+        return future
+
+    async def asubmit(self, batch: torch.Tensor) -> Tuple[Sequence, ...]:
+        """
+        Asyncio front-end: await the scattered result for ``batch``.
+        Cancelling the awaiting task cancels the request if it is still queued.
+        """
+        return await asyncio.wrap_future(self.submit(batch))
+
+    def _take_batch(self) -> List[_Pending]:
+        """Pop the oldest request plus every queued one with the same shape, up to the cap."""
+        first = self._queue.popleft()
+        taken = [first]
+        total = first.size
+        shape = first.batch.shape[1:]
+        remaining: Deque[_Pending] = deque()
+        while self._queue:
+            item = self._queue.popleft()
+            if item.batch.shape[1:] == shape and total + item.size <= self.max_batch_size:
+                taken.append(item)
+                total += item.size
+            else:
+                remaining.append(item)
+        self._queue = remaining
+        return taken
+
+    def _queued_samples(self) -> int:
+        return sum(item.size for item in self._queue)
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while self._running and not self._queue:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                # Hold the batch open until it is full or the oldest entry times out
+                deadline = self._queue[0].enqueued_at + self.max_wait
+                while self._running and self._queued_samples() < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(timeout=remaining)
+                if not self._queue:
+                    continue
+                items = self._take_batch()
+            # Drop callers that cancelled while queued; the rest can no
+            # longer be cancelled once marked running.
+            items = [i for i in items if i.future.set_running_or_notify_cancel()]
+            if not items:
+                continue
+            try:
+                self._run(items)
+            except Exception as e:
+                # Never let the worker thread die with _running still set
+                print(f"[MICROBATCH] {self.name} batch failed: {e}")
+                self._fail(items, e)
+
+    @staticmethod
+    def _fail(items: List[_Pending], error: BaseException) -> None:
+        for item in items:
+            if not item.future.done():
+                item.future.set_exception(error)
+
+    def _run(self, items: List[_Pending]) -> None:
+        started = time.perf_counter()
+        try:
+            batch = items[0].batch if len(items) == 1 else torch.cat([i.batch for i in items], dim=0)
+            outputs = self.fn(batch)
+        except Exception as e:
+            self._fail(items, e)
+            return
+
+        offset = 0
+        for item in items:
+            n = item.size
+            if not item.future.done():
+                item.future.set_result(tuple(out[offset : offset + n] for out in outputs))
+            offset += n
+
+        with self._cond:
+            self._batches += 1
+            self._requests += len(items)
+            self._samples += offset
+            self._max_batch_seen = max(self._max_batch_seen, offset)
+            self._batch_sizes[offset] += 1
+            self._wait_seconds += sum(started - i.enqueued_at for i in items)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "running": self._running,
+                "queueDepthRequests": len(self._queue),
+                "queueDepthSamples": self._queued_samples(),
+                "batches": self._batches,
+                "requests": self._requests,
+                "samples": self._samples,
+                "meanBatchSize": (self._samples / self._batches) if self._batches else 0.0,
+                "maxBatchSize": self._max_batch_seen,
+                "meanQueueWaitMs": (1000.0 * self._wait_seconds / self._requests) if self._requests else 0.0,
+                "batchSizeHistogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+                "config": {"maxBatchSize": self.max_batch_size, "maxWaitMs": self.max_wait * 1000.0},
+            }
@@ -0,0 +1,343 @@
+"""
+Offline bulk scoring of a directory of document images.
+
+    python -m ml.bulk_score /data/archive --output scores.jsonl
+
+A process pool decodes each image and runs ELA, QR and ROI detection. It
+also preprocesses the full image and the selected ROI crops into
+model-input arrays. Meanwhile the main process scores prepared images in
+batches with ForgeryInferencePipeline. Results are appended to the output
+after every batch: JSONL by default, CSV if the output ends in ``.csv``.
+The relative path of each scored image goes into a checkpoint file, so
+re-running the same command after an interruption skips work already
+done. Delivery is at-least-once, so a crash between the two appends can
+repeat a row. Images that failed to prepare get an error row but are not
+checkpointed, so the next run retries them. A crashed worker process
+(``BrokenProcessPool``) aborts the run instead of failing every image
+still in flight.
+
+ELA and heatmap images are not written. The Grad-CAM maps are still computed,
+because the tampered-area ratio and severity need them. ``--no_heatmaps``
+skips Grad-CAM entirely and scores on the configured ``INFERENCE_BACKEND``
+only; ``tamperedRatio`` is then null and severity uses the score alone.
+"""
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
+
+import torch
+
+from .document import DocumentImage
+from .ela import run_ela
+from .inference import (
+    MAX_BATCH_SIZE,
+    ForgeryInferencePipeline,
+    _compute_tampered_ratio,
+    classify_severity,
+    model_input,
+)
+from .qr import detect_qr
+from .registry import checkpoint_version
+from .roi import detect_and_select_rois
+
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+FIELDS = [
+    "path",
+    "densenetScore",
+    "mobilenetScore",
+    "ensembleScore",
+    "severity",
+    "tamperedRatio",
+    "elaEnergy",
+    "elaPeakEnergy",
+    "qrData",
+    "qrValid",
+    "roiDetected",
+    "roiEvaluated",
+    "roiScores",
+    "modelVersion",
+    "error",
+]
+
+
+def find_images(input_dir: Path, extensions=IMAGE_EXTENSIONS) -> List[Path]:
+    return sorted(
+        p for p in input_dir.rglob("*") if p.is_file() and p.suffix.lower() in extensions
+    )
+
+
+def prepare_image(path: str, rel_path: str, work_dir: str) -> Dict[str, Any]:
+    """
+    Worker-side stages for one image: decode, ELA, QR, ROI selection and
+    model preprocessing. Returns plain arrays and metadata (picklable).
+    """
+    doc = DocumentImage.from_path(path)
+    key = hashlib.sha1(rel_path.encode("utf-8")).hexdigest()[:16]
+    ela = run_ela(doc, None)  # only the energy grid is used
+    qr = detect_qr(doc)
+    rois, detected = detect_and_select_rois(
+        doc, os.path.join(work_dir, "rois", key), qr=qr, ela=ela
+    )
+    images = [doc] + [roi.document for roi in rois]
+    kinds = ["full"] + [roi.kind for roi in rois]
+    energy = ela.energy
+    return {
+        "path": rel_path,
+        # Per-kind input sizes: one (3, S, S) array per image
+        "inputs": [model_input(image.rgb, kind) for image, kind in zip(images, kinds)],
+        "sizes": [image.size for image in images],
+        "roiKinds": [roi.kind for roi in rois],
+        "roiBboxes": [list(roi.bbox) for roi in rois],
+        "elaEnergy": float(energy.mean()),
+        "elaPeakEnergy": float(energy.max()),
+        "qrData": qr.data,
+        "qrValid": bool(qr.is_valid),
+        "roiDetected": detected,
+    }
+
+
+class ResultWriter:
+    """Append-only JSONL / CSV output plus the resume checkpoint."""
+
+    def __init__(self, output: Path, checkpoint: Path):
+        self.output = output
+        self.checkpoint = checkpoint
+        self.csv = output.suffix.lower() == ".csv"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        new_file = not output.exists() or output.stat().st_size == 0
+        self._out = open(output, "a", encoding="utf-8", newline="")
+        self._done = open(checkpoint, "a", encoding="utf-8")
+        self._csv_writer = None
+        if self.csv:
+            self._csv_writer = csv.DictWriter(self._out, fieldnames=FIELDS)
+            if new_file:
+                self._csv_writer.writeheader()
+
+    @staticmethod
+    def completed(checkpoint: Path) -> Set[str]:
+        if not checkpoint.exists():
+            return set()
+        with open(checkpoint, encoding="utf-8") as f:
+            return {line.rstrip("\n") for line in f if line.strip()}
+
+    def write(self, rows: List[Dict[str, Any]], checkpoint: bool = True) -> None:
+        for row in rows:
+            if self._csv_writer is not None:
+                self._csv_writer.writerow(
+                    {**row, "roiScores": json.dumps(row.get("roiScores", []))}
+                )
+            else:
+                self._out.write(json.dumps(row) + "\n")
+        # Results must be on disk before the checkpoint says they are done.
+        self._out.flush()
+        os.fsync(self._out.fileno())
+        if not checkpoint:
+            return
+        for row in rows:
+            self._done.write(row["path"] + "\n")
+        self._done.flush()
+
+    def close(self) -> None:
+        self._out.close()
+        self._done.close()
+
+
+def _score_group(
+    pipeline: ForgeryInferencePipeline,
+    group: List[Dict[str, Any]],
+    model_version: str,
+    heatmaps_enabled: bool = True,
+) -> List[Dict[str, Any]]:
+    inputs, kinds, sizes = [], [], []
+    for item in group:
+        inputs.extend(torch.from_numpy(array).unsqueeze(0) for array in item["inputs"])
+        kinds.extend(["full"] + item["roiKinds"])
+        sizes.extend(item["sizes"])
+    outputs = pipeline.score_inputs(inputs, kinds, sizes, heatmaps=heatmaps_enabled)
+    scores = [score for score, _ in outputs]
+
+    rows = []
+    start = 0
+    for item in group:
+        end = start + len(item["inputs"])
+        full = scores[start]
+        tampered_ratio = (
+            _compute_tampered_ratio([heatmap for _, heatmap in outputs[start:end]])
+            if heatmaps_enabled
+            else None
+        )
+        rows.append(
+            {
+                "path": item["path"],
+                "densenetScore": float(full.densenet),
+                "mobilenetScore": float(full.mobilenet),
+                "ensembleScore": float(full.ensemble),
+                "severity": classify_severity(full.ensemble, tampered_ratio or 0.0),
+                "tamperedRatio": float(tampered_ratio) if tampered_ratio is not None else None,
+                "elaEnergy": item["elaEnergy"],
+                "elaPeakEnergy": item["elaPeakEnergy"],
+                "qrData": item["qrData"],
+                "qrValid": item["qrValid"],
+                "roiDetected": item["roiDetected"],
+                "roiEvaluated": len(item["roiKinds"]),
+                "roiScores": [
+                    {"kind": kind, "bbox": bbox, "ensembleScore": float(s.ensemble)}
+                    for kind, bbox, s in zip(
+                        item["roiKinds"], item["roiBboxes"], scores[start + 1 : end]
+                    )
+                ],
+                "modelVersion": model_version,
+                "error": None,
+            }
+        )
+        start = end
+    return rows
+
+
+def bulk_score(
+    input_dir: str,
+    output: str,
+    checkpoint_dir: str = "ml/checkpoints",
+    workers: int = max(1, (os.cpu_count() or 2) - 1),
+    batch_size: int = MAX_BATCH_SIZE,
+    resume_file: Optional[str] = None,
+    work_dir: Optional[str] = None,
+    report_every: float = 10.0,
+    heatmaps: bool = True,
+) -> Dict[str, Any]:
+    """
+    Score every image under ``input_dir``; ``batch_size`` is the target
+    number of model inputs (full images plus ROI crops) per CNN batch.
+    """
+    root = Path(input_dir)
+    output_path = Path(output)
+    checkpoint_path = Path(resume_file or f"{output}.done")
+    work_path = Path(work_dir or f"{output}.work")
+
+    done = ResultWriter.completed(checkpoint_path)
+    todo = [p for p in find_images(root) if str(p.relative_to(root)) not in done]
+    print(f"[BULK] {len(todo)} image(s) to score, {len(done)} already done")
+    if not todo:
+        return {"scored": 0, "failed": 0, "seconds": 0.0, "imagesPerSecond": 0.0}
+
+    pipeline = ForgeryInferencePipeline(checkpoint_dir, str(work_path), max_batch_size=batch_size)
+    pipeline.warm_up()  # also settles the runtime profile
+    model_version = checkpoint_version(checkpoint_dir)
+    writer = ResultWriter(output_path, checkpoint_path)
+
+    scored = failed = 0
+    start = last_report = time.perf_counter()
+    pending: Set[Future] = set()
+    rel_paths: Dict[Future, str] = {}
+    ready: List[Dict[str, Any]] = []
+    queue = iter(todo)
+    # Enough prepared images in flight to keep the models fed without
+    # holding the whole archive's tensors in memory.
+    prefetch = workers * 2
+
+    def report(final: bool = False) -> None:
+        elapsed = time.perf_counter() - start
+        rate = scored / elapsed if elapsed > 0 else 0.0
+        label = "Done" if final else "Progress"
+        print(
+            f"[BULK] {label}: {scored + failed}/{len(todo)} images "
+            f"({failed} failed), {rate:.2f} images/sec"
+        )
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+        ) as pool:
+            while True:
+                while len(pending) < prefetch:
+                    path = next(queue, None)
+                    if path is None:
+                        break
+                    rel = str(path.relative_to(root))
+                    future = pool.submit(prepare_image, str(path), rel, str(work_path))
+                    rel_paths[future] = rel
+                    pending.add(future)
+                if not pending and not ready:
+                    break
+
+                if pending:
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    errors = []
+                    for future in finished:
+                        rel = rel_paths.pop(future)
+                        try:
+                            ready.append(future.result())
+                        except BrokenProcessPool:
+                            raise  # not this image's fault; nothing to record
+                        except Exception as e:
+                            errors.append({"path": rel, "error": str(e)})
+                    if errors:
+                        # Retried on the next run (the failure may be transient)
+                        writer.write(errors, checkpoint=False)
+                        failed += len(errors)
+
+                # Score once a full batch is ready, or whatever is left at the end
+                n_inputs = sum(len(item["inputs"]) for item in ready)
+                if ready and (n_inputs >= batch_size or not pending):
+                    rows = _score_group(pipeline, ready, model_version, heatmaps)
+                    writer.write(rows)
+                    scored += len(rows)
+                    ready = []
+
+                if time.perf_counter() - last_report >= report_every:
+                    report()
+                    last_report = time.perf_counter()
+    finally:
+        writer.close()
+
+    report(final=True)
+    elapsed = time.perf_counter() - start
+    return {
+        "scored": scored,
+        "failed": failed,
+        "seconds": elapsed,
+        "imagesPerSecond": scored / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Bulk-score a directory of document images")
+    parser.add_argument("input_dir", type=str, help="Directory searched recursively for images")
+    parser.add_argument("--output", type=str, required=True, help="Results file (.jsonl or .csv)")
+    parser.add_argument("--checkpoint_dir", type=str, default="ml/checkpoints")
+    parser.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1))
+    parser.add_argument(
+        "--batch_size", type=int, default=MAX_BATCH_SIZE, help="Model inputs per CNN batch"
+    )
+    parser.add_argument(
+        "--resume_file", type=str, default=None, help="Checkpoint of finished images (default: <output>.done)"
+    )
+    parser.add_argument(
+        "--work_dir", type=str, default=None, help="ROI manifest artifacts (default: <output>.work)"
+    )
+    parser.add_argument(
+        "--no_heatmaps", action="store_true", help="Skip Grad-CAM (no tamperedRatio)"
+    )
+    args = parser.parse_args()
+
+    bulk_score(
+        args.input_dir,
+        args.output,
+        checkpoint_dir=args.checkpoint_dir,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        resume_file=args.resume_file,
+        work_dir=args.work_dir,
+        heatmaps=not args.no_heatmaps,
+    )
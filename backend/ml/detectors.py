@@ -0,0 +1,81 @@
+"""
+Per-thread pool of pre-initialised OpenCV detectors.
+
+Building a ``cv2.CascadeClassifier`` parses the Haar XML from disk, and
+OpenCV detector objects are not safe to share between threads. Each worker
+thread (see executors.py) therefore lazily creates one instance of each
+detector and reuses it for every subsequent call.
+
+Load and per-call detection timings are aggregated process-wide; with
+process-pool stages each worker process keeps its own counters.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+import cv2
+
+
+FACE_CASCADE_PATH = Path(cv2.data.haarcascades) / "haarcascade_frontalface_default.xml"
+
+_local = threading.local()
+_metrics_lock = threading.Lock()
+_loads: Dict[str, Dict[str, float]] = {}
+_calls: Dict[str, Dict[str, float]] = {}
+
+
+def _record(table: Dict[str, Dict[str, float]], name: str, seconds: float) -> None:
+    with _metrics_lock:
+        entry = table.setdefault(name, {"count": 0, "totalSeconds": 0.0, "maxSeconds": 0.0})
+        entry["count"] += 1
+        entry["totalSeconds"] += seconds
+        entry["maxSeconds"] = max(entry["maxSeconds"], seconds)
+
+
+def get_face_cascade() -> cv2.CascadeClassifier:
+    cascade = getattr(_local, "face_cascade", None)
+    if cascade is None:
+        start = time.perf_counter()
+        cascade = cv2.CascadeClassifier(str(FACE_CASCADE_PATH))
+        if cascade.empty():
+            raise RuntimeError(f"Failed to load Haar cascade from {FACE_CASCADE_PATH}")
+        _record(_loads, "face_cascade", time.perf_counter() - start)
+        _local.face_cascade = cascade
+    return cascade
+
+
+def get_qr_detector() -> cv2.QRCodeDetector:
+    detector = getattr(_local, "qr_detector", None)
+    if detector is None:
+        start = time.perf_counter()
+        detector = cv2.QRCodeDetector()
+        _record(_loads, "qr_detector", time.perf_counter() - start)
+        _local.qr_detector = detector
+    return detector
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Record the wall time of one detection call under ``name``."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(_calls, name, time.perf_counter() - start)
+
+
+def detector_metrics() -> Dict[str, Any]:
+    def summarise(table: Dict[str, Dict[str, float]]) -> Dict[str, Any]:
+        return {
+            name: {
+                "count": int(e["count"]),
+                "meanMs": 1000.0 * e["totalSeconds"] / e["count"] if e["count"] else 0.0,
+                "maxMs": 1000.0 * e["maxSeconds"],
+            }
+            for name, e in table.items()
+        }
+
+    with _metrics_lock:
+        return {"loads": summarise(_loads), "calls": summarise(_calls)}
@@ -0,0 +1,106 @@
+"""
+Decode-once document image shared by every pipeline stage.
+
+A single prediction used to decode the same upload five times (ELA, ROI,
+QR, inference and heatmap overlay, with a mix of PIL and OpenCV). A
+``DocumentImage`` decodes the file once into a BGR array and derives the
+other views lazily, caching each one:
+
+  - ``bgr``    decoded uint8 (H, W, 3) array (OpenCV layout)
+  - ``rgb``    contiguous RGB array
+  - ``pil``    PIL image backed by ``rgb``'s buffer (no extra copy)
+  - ``gray``   uint8 (H, W) grayscale
+  - ``tensor`` normalized (1, 3, S, S) model input; ``model_input(kind)``
+               for the input size of an ROI kind
+
+Stage functions accept either a path or a ``DocumentImage``; use
+``DocumentImage.coerce`` to normalise.
+"""
+from functools import cached_property
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple, Union
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+class DocumentImage:
+    def __init__(self, bgr: np.ndarray, path: Optional[str] = None):
+        if bgr is None or bgr.ndim != 3 or bgr.shape[2] != 3:
+            raise ValueError(f"Expected a decoded (H, W, 3) image for {path}")
+        self.bgr = bgr
+        self.path = str(path) if path is not None else None
+
+    @classmethod
+    def from_path(cls, image_path: Union[str, Path]) -> "DocumentImage":
+        img = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"Failed to read image at {image_path}")
+        return cls(img, path=str(image_path))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, path: Optional[str] = None) -> "DocumentImage":
+        buf = np.frombuffer(data, dtype=np.uint8)
+        img = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+        if img is None:
+            raise ValueError(f"Failed to decode image bytes for {path or '<memory>'}")
+        return cls(img, path=path)
+
+    @classmethod
+    def coerce(cls, source: Union[str, Path, "DocumentImage"]) -> "DocumentImage":
+        if isinstance(source, DocumentImage):
+            return source
+        return cls.from_path(source)
+
+    @property
+    def height(self) -> int:
+        return int(self.bgr.shape[0])
+
+    @property
+    def width(self) -> int:
+        return int(self.bgr.shape[1])
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height), matching PIL's convention."""
+        return self.width, self.height
+
+    @cached_property
+    def rgb(self) -> np.ndarray:
+        return cv2.cvtColor(self.bgr, cv2.COLOR_BGR2RGB)
+
+    @cached_property
+    def pil(self) -> Image.Image:
+        return Image.fromarray(self.rgb)
+
+    @cached_property
+    def gray(self) -> np.ndarray:
+        return cv2.cvtColor(self.bgr, cv2.COLOR_BGR2GRAY)
+
+    @property
+    def tensor(self):
+        return self.model_input("full")
+
+    def model_input(self, kind: str = "full"):
+        # Imported lazily so ELA / ROI / QR workers never need torch.
+        from .inference import preprocess
+
+        inputs = self.__dict__.setdefault("_inputs", {})
+        if kind not in inputs:
+            inputs[kind] = preprocess(self, kind)
+        return inputs[kind]
+
+    def crop(self, bbox: Tuple[int, int, int, int]) -> np.ndarray:
+        """Zero-copy BGR view of ``bbox`` (x, y, w, h)."""
+        x, y, w, h = bbox
+        return self.bgr[y : y + h, x : x + w]
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Only ship the decoded pixels across process boundaries; derived
+        # views are cheap to rebuild and would multiply the payload.
+        return {"bgr": self.bgr, "path": self.path}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.bgr = state["bgr"]
+        self.path = state["path"]
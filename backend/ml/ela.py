@@ -1,42 +1,122 @@
+import os
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Sequence, Tuple, Union
 
-from PIL import Image, ImageChops, ImageEnhance
+import cv2
+import numpy as np
+from PIL import Image
 
+from .document import DocumentImage
 
-def compute_ela(
-    image_path: str, output_path: str, quality: int = 90
-) -> Tuple[str, Image.Image]:
+
+# First quality drives the visual ELA image; all of them feed the block grid.
+ELA_QUALITIES = tuple(
+    int(q) for q in os.getenv("ELA_QUALITIES", "90,80,70").split(",") if q.strip()
+)
+ELA_BLOCK_SIZE = int(os.getenv("ELA_BLOCK_SIZE", "16"))
+
+
+@dataclass
+class ELAResult:
+    path: Optional[str]  # None when the ELA image was not written to disk
+    image: Image.Image
+    qualities: Tuple[int, ...]
+    block_size: int
+    # Mean absolute recompression error per block, shape (Q, H // B, W // B)
+    block_energy: np.ndarray
+
+    @property
+    def energy(self) -> np.ndarray:
+        """Per-block energy averaged over quality levels, shape (H // B, W // B)."""
+        return self.block_energy.mean(axis=0)
+
+    def bbox_energy(self, bbox: Tuple[int, int, int, int]) -> float:
+        """Mean block energy covered by an (x, y, w, h) pixel box."""
+        x, y, w, h = bbox
+        b = self.block_size
+        region = self.energy[y // b : -(-(y + h) // b), x // b : -(-(x + w) // b)]
+        return float(region.mean()) if region.size else 0.0
+
+
+def _recompress(bgr: np.ndarray, quality: int) -> np.ndarray:
+    """JPEG round-trip entirely in memory."""
+    ok, buf = cv2.imencode(".jpg", bgr, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        raise ValueError(f"JPEG encode failed at quality {quality}")
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def _block_energy(diff: np.ndarray, block_size: int) -> np.ndarray:
+    """
+    diff: (Q, H, W, 3) uint8 absolute differences.
+    Returns float32 (Q, H // B, W // B) mean error per block (edge
+    remainders that do not fill a block are dropped).
     """
-    Perform Error Level Analysis (ELA) on a JPEG image.
+    q, h, w, c = diff.shape
+    hb, wb = h // block_size, w // block_size
+    if hb == 0 or wb == 0:
+        return np.zeros((q, max(hb, 1), max(wb, 1)), dtype=np.float32)
+    blocks = diff[:, : hb * block_size, : wb * block_size].reshape(
+        q, hb, block_size, wb, block_size, c
+    )
+    sums = blocks.sum(axis=(2, 4, 5), dtype=np.uint32)
+    return (sums / float(block_size * block_size * c)).astype(np.float32)
 
-    1. Re-save the image at a given JPEG quality.
-    2. Compute pixel-wise difference between original and recompressed.
-    3. Enhance the difference to highlight tampering artifacts.
 
-    Returns the output path and the enhanced ELA PIL image.
+def run_ela(
+    image: Union[str, DocumentImage],
+    output_path: Optional[str],
+    qualities: Sequence[int] = ELA_QUALITIES,
+    block_size: int = ELA_BLOCK_SIZE,
+) -> ELAResult:
     """
-    image_path = str(image_path)
-    original = Image.open(image_path).convert("RGB")
+    Multi-quality Error Level Analysis without disk round-trips.
 
-    tmp_path = Path(output_path).with_suffix(".ela_tmp.jpg")
-    tmp_path.parent.mkdir(parents=True, exist_ok=True)
+    1. Re-compress the image in memory at each JPEG quality.
+    2. Compute |original - recompressed| per quality with cv2.absdiff
+       into one preallocated (Q, H, W, 3) uint8 stack.
+    3. Reduce to a per-block energy grid and render the visual ELA image
+       for the first quality (difference stretched to the full 0-255 range).
+
+    With ``output_path=None`` the visual image is kept in memory only.
+    """
+    qualities = tuple(qualities) or (90,)
+    original = DocumentImage.coerce(image).bgr
 
-    original.save(tmp_path, "JPEG", quality=quality)
-    recompressed = Image.open(tmp_path).convert("RGB")
+    # One uint8 buffer for all qualities; each recompressed copy is freed
+    # as soon as its difference is written.
+    diff = np.empty((len(qualities),) + original.shape, dtype=np.uint8)
+    for i, q in enumerate(qualities):
+        cv2.absdiff(_recompress(original, q), original, dst=diff[i])
 
-    diff = ImageChops.difference(original, recompressed)
+    visual = diff[0]
+    max_diff = int(visual.max()) or 1
+    ela_bgr = cv2.convertScaleAbs(visual, alpha=255.0 / max_diff)
 
-    extrema = diff.getextrema()
-    max_diff = max([ex[1] for ex in extrema]) or 1
-    scale = 255.0 / max_diff
+    path = None
+    if output_path is not None:
+        output_file = Path(output_path)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        cv2.imwrite(str(output_file), ela_bgr)
+        path = str(output_file)
 
-    ela_image = ImageEnhance.Brightness(diff).enhance(scale)
+    return ELAResult(
+        path=path,
+        image=Image.fromarray(cv2.cvtColor(ela_bgr, cv2.COLOR_BGR2RGB)),
+        qualities=qualities,
+        block_size=block_size,
+        block_energy=_block_energy(diff, block_size),
+    )
 
-    output_file = Path(output_path)
-    output_file.parent.mkdir(parents=True, exist_ok=True)
-    ela_image.save(output_file, "JPEG")
 
-    tmp_path.unlink(missing_ok=True)
-    return str(output_file), ela_image
+def compute_ela(
+    image: Union[str, DocumentImage], output_path: str, quality: int = 90
+) -> Tuple[str, Image.Image]:
+    """
+    Perform Error Level Analysis (ELA) on a JPEG image at a single quality.
 
+    Returns the output path and the enhanced ELA PIL image.
+    """
+    result = run_ela(image, output_path, qualities=(quality,))
+    return result.path, result.image
@@ -0,0 +1,172 @@
+"""
+Export the serving checkpoints to ONNX and/or TorchScript.
+
+    python -m ml.export --checkpoint_dir ml/checkpoints --format all
+
+Writes, next to the checkpoints (or into ``--output_dir``):
+
+  densenet121_aadhaar.onnx / mobilenetv2_aadhaar.onnx
+  densenet121_aadhaar.torchscript.pt / mobilenetv2_aadhaar.torchscript.pt
+  export.json   (checkpoint version, formats exported, eager-vs-export check)
+
+The serving pipeline loads these with ``INFERENCE_BACKEND=onnx`` or
+``torchscript`` (see ml/inference.py) and refuses artifacts whose recorded
+checkpoint version no longer matches the ``.pt`` files, so a retrain
+without a re-export falls back to eager PyTorch (with a warning) instead of
+serving stale weights.
+"""
+import json
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+import torch
+
+from .densenet import load_densenet_checkpoint
+from .inference import INPUT_SIZE, INPUT_SIZES
+from .mobilenet import load_mobilenet_checkpoint
+from .registry import checkpoint_version
+
+
+MANIFEST_NAME = "export.json"
+FORMATS = ("onnx", "torchscript")
+ONNX_OPSET = 17
+
+
+def artifact_path(export_dir: str, model_name: str, fmt: str) -> Path:
+    suffix = ".onnx" if fmt == "onnx" else ".torchscript.pt"
+    return Path(export_dir) / f"{model_name}{suffix}"
+
+
+def read_manifest(export_dir: str) -> Optional[Dict[str, Any]]:
+    path = Path(export_dir) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def check_exports(export_dir: str, checkpoint_dir: str, fmt: str) -> None:
+    """Raise if ``fmt`` artifacts are missing or built from other checkpoints."""
+    manifest = read_manifest(export_dir)
+    if manifest is None or fmt not in manifest.get("formats", []):
+        raise RuntimeError(
+            f"No {fmt} export in {export_dir}; run `python -m ml.export --format {fmt}`"
+        )
+    current = checkpoint_version(checkpoint_dir)
+    if manifest.get("checkpointVersion") != current:
+        raise RuntimeError(
+            f"{fmt} export in {export_dir} was built from checkpoint version "
+            f"{manifest.get('checkpointVersion')}, current is {current}; re-run ml.export"
+        )
+    if not manifest.get("dynamicSpatialAxes"):
+        # Inputs vary in size per ROI kind; older exports fixed H x W
+        raise RuntimeError(f"{fmt} export in {export_dir} has a fixed input size; re-run ml.export")
+
+
+def _export_onnx(model: torch.nn.Module, dummy: torch.Tensor, path: Path, opset: int) -> None:
+    torch.onnx.export(
+        model,
+        dummy,
+        str(path),
+        input_names=["input"],
+        output_names=["logit"],
+        dynamic_axes={"input": {0: "batch", 2: "height", 3: "width"}, "logit": {0: "batch"}},
+        opset_version=opset,
+        # TorchScript-based exporter: no onnxscript dependency and a graph
+        # ONNX Runtime optimizes well for these CNNs.
+        dynamo=False,
+    )
+
+
+def _export_torchscript(model: torch.nn.Module, dummy: torch.Tensor, path: Path) -> None:
+    traced = torch.jit.trace(model, dummy)
+    traced = torch.jit.freeze(traced)
+    traced.save(str(path))
+
+
+def _verify(model: torch.nn.Module, path: Path, fmt: str) -> float:
+    """Max |eager - exported| logit difference on random batches of every input size."""
+    if fmt == "onnx":
+        import onnxruntime as ort
+
+        session = ort.InferenceSession(str(path), providers=["CPUExecutionProvider"])
+
+        def run(batch: torch.Tensor) -> torch.Tensor:
+            return torch.from_numpy(session.run(None, {"input": batch.numpy()})[0])
+    else:
+        run = torch.jit.load(str(path))
+
+    diff = 0.0
+    for size in sorted(set(INPUT_SIZES.values())):
+        batch = torch.randn(3, 3, size, size)
+        with torch.no_grad():
+            diff = max(diff, float((model(batch) - run(batch)).abs().max()))
+    return diff
+
+
+def export_models(
+    checkpoint_dir: str,
+    output_dir: Optional[str] = None,
+    formats: Iterable[str] = FORMATS,
+    opset: int = ONNX_OPSET,
+    verify: bool = True,
+) -> Dict[str, Any]:
+    output_dir = output_dir or checkpoint_dir
+    Path(output_dir).mkdir(parents=True, exist_ok=True)
+    formats = [f for f in FORMATS if f in set(formats)]
+    cpu = torch.device("cpu")
+
+    models = {
+        "densenet121_aadhaar": load_densenet_checkpoint(checkpoint_dir, cpu),
+        "mobilenetv2_aadhaar": load_mobilenet_checkpoint(checkpoint_dir, cpu),
+    }
+    dummy = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+
+    max_diff: Dict[str, float] = {}
+    for name, model in models.items():
+        model.eval()
+        for fmt in formats:
+            path = artifact_path(output_dir, name, fmt)
+            if fmt == "onnx":
+                _export_onnx(model, dummy, path, opset)
+            else:
+                _export_torchscript(model, dummy, path)
+            print(f"[EXPORT] Wrote {path}")
+            if verify:
+                max_diff[f"{name}.{fmt}"] = _verify(model, path, fmt)
+                print(f"[EXPORT] {name} {fmt}: max |logit diff| vs eager = {max_diff[f'{name}.{fmt}']:.2e}")
+
+    # Formats exported earlier from the same checkpoints stay valid
+    previous = read_manifest(output_dir) or {}
+    version = checkpoint_version(checkpoint_dir)
+    if previous.get("checkpointVersion") != version:
+        previous = {}
+    manifest = {
+        "checkpointVersion": version,
+        "inputSize": INPUT_SIZE,
+        "dynamicSpatialAxes": True,
+        "onnxOpset": opset,
+        "formats": sorted(set(previous.get("formats", [])) | set(formats)),
+        "maxLogitDiff": {**previous.get("maxLogitDiff", {}), **max_diff},
+    }
+    (Path(output_dir) / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export serving checkpoints to ONNX / TorchScript")
+    parser.add_argument("--checkpoint_dir", type=str, default="ml/checkpoints")
+    parser.add_argument("--output_dir", type=str, default=None, help="Default: the checkpoint dir")
+    parser.add_argument("--format", type=str, default="all", choices=["onnx", "torchscript", "all"])
+    parser.add_argument("--opset", type=int, default=ONNX_OPSET)
+    parser.add_argument("--no_verify", action="store_true", help="Skip the eager-vs-export check")
+    args = parser.parse_args()
+
+    export_models(
+        args.checkpoint_dir,
+        args.output_dir,
+        formats=FORMATS if args.format == "all" else (args.format,),
+        opset=args.opset,
+        verify=not args.no_verify,
+    )
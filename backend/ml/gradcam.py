@@ -1,5 +1,6 @@
+import threading
 from pathlib import Path
-from typing import Tuple
+from typing import Tuple, Union
 
 import cv2
 import numpy as np
@@ -7,65 +8,100 @@ import torch
 import torch.nn.functional as F
 from PIL import Image
 
+from .document import DocumentImage
+
 
 class GradCAM:
     """
     Generic Grad-CAM for torchvision-style CNNs.
     Assumes a final conv feature map followed by pooling + classifier.
+
+    ``model`` is the full classifier (producing logits), so a single
+    autograd forward yields the logits *and* the target-layer activations,
+    and one backward from the logits yields the gradients. The Grad-CAM
+    target is therefore the class logit, not a feature-map channel.
     """
 
     def __init__(self, model: torch.nn.Module, target_layer: torch.nn.Module):
         self.model = model
         self.target_layer = target_layer
-        self.gradients = None
-        self.activations = None
+        # Per-thread capture so concurrent callers on a thread pool do not
+        # read each other's activations.
+        self._local = threading.local()
         self._hook()
 
+    @property
+    def activations(self):
+        return getattr(self._local, "activations", None)
+
+    @activations.setter
+    def activations(self, value):
+        self._local.activations = value
+
     def _hook(self):
         def forward_hook(module, inp, out):
-            self.activations = out.detach()
-
-        def backward_hook(module, grad_in, grad_out):
-            self.gradients = grad_out[0].detach()
+            if not torch.is_grad_enabled():
+                return None
+            # Re-root the graph at the target activations: with frozen
+            # parameters nothing below this layer is recorded, and the
+            # backward pass only walks pooling + classifier. The clone keeps
+            # in-place ops downstream (e.g. DenseNet's relu) off the leaf.
+            leaf = out.detach().requires_grad_(True)
+            self.activations = leaf
+            return leaf.clone()
 
         self.target_layer.register_forward_hook(forward_hook)
-        self.target_layer.register_backward_hook(backward_hook)
 
-    def generate(self, input_tensor: torch.Tensor) -> np.ndarray:
+    def forward(self, input_tensor: torch.Tensor) -> Tuple[torch.Tensor, np.ndarray]:
         """
-        input_tensor: (1, C, H, W)
-        Returns heatmap normalized to [0, 1] as numpy array (H, W).
+        input_tensor: (N, C, H, W)
+        Returns (logits (N,), heatmaps (N, H', W') normalized to [0, 1]).
         """
-        self.model.zero_grad()
-        output = self.model(input_tensor)
-        if output.ndim == 1:
-            target = output
-        else:
-            target = output[:, 0]
-
-        target.backward(retain_graph=True)
+        with torch.enable_grad():
+            output = self.model(input_tensor)
+            if output.ndim == 1:
+                target = output
+            else:
+                target = output[:, 0]
+            # Samples are independent (eval-mode BN), so the gradient of the
+            # sum w.r.t. each sample's activations is that sample's gradient.
+            target.sum().backward()
+
+        activations = self.activations.detach()
+        gradients = self.activations.grad  # (N, C, H', W')
+        self.activations = None
 
-        gradients = self.gradients  # (N, C, H', W')
-        activations = self.activations
         weights = gradients.mean(dim=(2, 3), keepdim=True)
-        cam = (weights * activations).sum(dim=1, keepdim=True)  # (N,1,H',W')
+        cam = (weights * activations).sum(dim=1)  # (N,H',W')
         cam = F.relu(cam)
 
-        cam = cam[0, 0].cpu().numpy()
-        cam -= cam.min()
-        if cam.max() > 0:
-            cam /= cam.max()
-        return cam
+        cams = cam.float().cpu().numpy()
+        cams -= cams.min(axis=(1, 2), keepdims=True)
+        peak = cams.max(axis=(1, 2), keepdims=True)
+        np.divide(cams, peak, out=cams, where=peak > 0)
+        return output.detach(), cams
+
+    __call__ = forward
+
+    def generate(self, input_tensor: torch.Tensor) -> np.ndarray:
+        """
+        input_tensor: (1, C, H, W)
+        Returns heatmap normalized to [0, 1] as numpy array (H, W).
+        """
+        _, cams = self.forward(input_tensor)
+        return cams[0]
 
 
 def overlay_heatmap_on_image(
-    image_path: str, heatmap: np.ndarray, output_path: str, alpha: float = 0.5
+    image: Union[str, DocumentImage],
+    heatmap: np.ndarray,
+    output_path: str,
+    alpha: float = 0.5,
 ) -> str:
     """
     Overlay a heatmap (H, W) in [0,1] over the original image and save it.
     """
-    img = Image.open(image_path).convert("RGB")
-    img_np = np.array(img)
+    img_np = DocumentImage.coerce(image).rgb
     h, w = img_np.shape[:2]
 
     heatmap_resized = cv2.resize(heatmap, (w, h))
@@ -1,32 +1,68 @@
+import asyncio
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
 
+import cv2
 import numpy as np
 import torch
 from PIL import Image
-from torchvision import transforms
 
+from .document import DocumentImage
 from .densenet import DenseNet121Binary, load_densenet_checkpoint
 from .mobilenet import MobileNetV2Binary, load_mobilenet_checkpoint
 from .ensemble import EnsembleScores, compute_ensemble
 from .gradcam import GradCAM, overlay_heatmap_on_image
+from .runtime import (
+    FP32,
+    INFERENCE_RUNTIME_PROFILE,
+    RuntimeProfile,
+    candidate_profiles,
+    configure_threads,
+    resolve_profile,
+    select_profile,
+)
 
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-
-transform = transforms.Compose(
-    [
-        transforms.Resize((384, 384)),
-        transforms.ToTensor(),
-        transforms.Normalize(
-            mean=[0.485, 0.456, 0.406],
-            std=[0.229, 0.224, 0.225],
-        ),
-    ]
-)
+def _parse_sizes(spec: str) -> Dict[str, int]:
+    sizes = {}
+    for item in spec.split(","):
+        kind, _, size = item.partition("=")
+        if kind.strip() and size.strip():
+            sizes[kind.strip()] = int(size)
+    return sizes
+
+
+# Square model input side per ROI kind ("full" is the whole card). The
+# shipped checkpoints were trained on 384x384 stretched images (see
+# ml.train.FitInput); smaller ROI sizes and letterboxing need checkpoints
+# retrained with the same settings.
+INPUT_SIZES = {
+    "full": 384,
+    "face": 384,
+    "qr": 384,
+    "text": 384,
+    **_parse_sizes(os.getenv("INFERENCE_INPUT_SIZES", "")),
+}
+INPUT_SIZE = INPUT_SIZES["full"]
+# true: resize keeping the aspect ratio and pad; false: stretch to the square
+INFERENCE_LETTERBOX = os.getenv("INFERENCE_LETTERBOX", "false").lower() == "true"
+# Upper bound on samples per forward; larger ROI sets are chunked.
+MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "16"))
+# Scoring backend: eager | onnx | torchscript (artifacts from ml.export) |
+# int8 (published variants from ml.quantize).
+# Grad-CAM always runs on the eager DenseNet.
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager").lower()
+# Where ml.export wrote its artifacts (default: the checkpoint dir)
+INFERENCE_EXPORT_DIR = os.getenv("INFERENCE_EXPORT_DIR")
+
+_MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+_STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+# Letterbox padding at the normalisation mean, i.e. zeros in model input space
+_PAD_COLOR = tuple(int(round(c)) for c in _MEAN * 255)
 
 
 @dataclass
@@ -46,10 +82,221 @@ class InferenceResult:
     severity: str
 
 
-def _load_image_tensor(image_path: str) -> torch.Tensor:
-    img = Image.open(image_path).convert("RGB")
-    t = transform(img).unsqueeze(0)
-    return t.to(device)
+class EagerBackend:
+    """Scores with the in-process PyTorch modules."""
+
+    name = "eager"
+    # DenseNet logits from the eager Grad-CAM forward equal this backend's,
+    # so the heatmap path does not run DenseNet a second time.
+    shares_cam_logits = True
+
+    def __init__(self, densenet: torch.nn.Module, mobilenet: torch.nn.Module):
+        self._densenet = densenet
+        self._mobilenet = mobilenet
+        # Runtime profile (memory format / autocast); the pipeline switches
+        # it for the eager backend only, compiled graphs stay fp32.
+        self.profile: RuntimeProfile = FP32
+
+    def _run(self, model, batch: torch.Tensor) -> torch.Tensor:
+        with self.profile.scoring(batch.device.type):
+            return model(self.profile.prepare(batch)).float()
+
+    def densenet(self, batch: torch.Tensor) -> torch.Tensor:
+        return self._run(self._densenet, batch)
+
+    def mobilenet(self, batch: torch.Tensor) -> torch.Tensor:
+        return self._run(self._mobilenet, batch)
+
+
+class TorchScriptBackend(EagerBackend):
+    """Frozen, traced graphs written by ``python -m ml.export``."""
+
+    name = "torchscript"
+
+    def __init__(self, export_dir: str):
+        from .export import artifact_path
+
+        super().__init__(
+            torch.jit.load(str(artifact_path(export_dir, "densenet121_aadhaar", "torchscript")), map_location=device),
+            torch.jit.load(str(artifact_path(export_dir, "mobilenetv2_aadhaar", "torchscript")), map_location=device),
+        )
+
+
+class OnnxBackend:
+    """ONNX Runtime sessions with full graph optimization (CPU serving)."""
+
+    name = "onnx"
+    shares_cam_logits = True
+
+    def __init__(self, export_dir: str):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise RuntimeError("INFERENCE_BACKEND=onnx requires the onnxruntime package") from e
+        from .export import artifact_path
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        providers = ["CPUExecutionProvider"]
+        self._densenet = ort.InferenceSession(
+            str(artifact_path(export_dir, "densenet121_aadhaar", "onnx")), options, providers=providers
+        )
+        self._mobilenet = ort.InferenceSession(
+            str(artifact_path(export_dir, "mobilenetv2_aadhaar", "onnx")), options, providers=providers
+        )
+
+    @staticmethod
+    def _run(session, batch: torch.Tensor) -> torch.Tensor:
+        # channels_last runtime profiles hand over NHWC-strided tensors;
+        # ONNX Runtime reads the buffer as dense NCHW.
+        out = session.run(None, {"input": batch.detach().cpu().contiguous().numpy()})[0]
+        return torch.from_numpy(out)
+
+    def densenet(self, batch: torch.Tensor) -> torch.Tensor:
+        return self._run(self._densenet, batch)
+
+    def mobilenet(self, batch: torch.Tensor) -> torch.Tensor:
+        return self._run(self._mobilenet, batch)
+
+
+class _CpuModule(torch.nn.Module):
+    """Runs a CPU-only module on inputs from any device."""
+
+    def __init__(self, model: torch.nn.Module):
+        super().__init__()
+        self.model = model
+
+    def forward(self, batch: torch.Tensor) -> torch.Tensor:
+        return self.model(batch.cpu()).to(batch.device)
+
+
+class Int8Backend(EagerBackend):
+    """
+    int8 TorchScript variants published by ``python -m ml.quantize``.
+    Quantized kernels are CPU-only; a model that failed the accuracy gate
+    keeps scoring on its float module. Quantized logits differ from the
+    float ones, so with heatmaps DenseNet is scored here as well and the
+    eager float model is only used for the Grad-CAM pass.
+    """
+
+    name = "int8"
+
+    def __init__(self, checkpoint_dir: str, densenet: torch.nn.Module, mobilenet: torch.nn.Module):
+        from .quantize import published_models, select_engine
+
+        select_engine()
+        published = published_models(checkpoint_dir)
+        super().__init__(
+            self._load(published.get("densenet121_aadhaar"), densenet),
+            self._load(published.get("mobilenetv2_aadhaar"), mobilenet),
+        )
+        self.quantized = sorted(published)
+        self.shares_cam_logits = "densenet121_aadhaar" not in published
+
+    @staticmethod
+    def _load(path: Optional[Path], fallback: torch.nn.Module) -> torch.nn.Module:
+        if path is None:
+            return fallback
+        return _CpuModule(torch.jit.load(str(path), map_location="cpu"))
+
+
+def load_scoring_backend(
+    name: str,
+    checkpoint_dir: str,
+    densenet: torch.nn.Module,
+    mobilenet: torch.nn.Module,
+    export_dir: Optional[str] = None,
+):
+    """
+    Build the requested scoring backend, falling back to eager PyTorch if
+    the exported or quantized artifacts are missing, stale or cannot be
+    loaded.
+    """
+    eager = EagerBackend(densenet, mobilenet)
+    if name == "eager":
+        return eager
+    if name not in ("onnx", "torchscript", "int8"):
+        print(f"[INFERENCE] Unknown INFERENCE_BACKEND={name!r}; using eager")
+        return eager
+
+    from .export import check_exports
+
+    export_dir = export_dir or checkpoint_dir
+    try:
+        if name == "int8":
+            backend = Int8Backend(checkpoint_dir, densenet, mobilenet)
+        else:
+            check_exports(export_dir, checkpoint_dir, name)
+            backend = OnnxBackend(export_dir) if name == "onnx" else TorchScriptBackend(export_dir)
+    except Exception as e:
+        print(f"[INFERENCE] Cannot use {name} backend ({e}); using eager")
+        return eager
+    print(f"[INFERENCE] Scoring with the {name} backend")
+    return backend
+
+
+def input_size(kind: str) -> int:
+    return INPUT_SIZES.get(kind, INPUT_SIZE)
+
+
+def letterbox_box(width: int, height: int, size: int) -> Tuple[int, int, int, int]:
+    """(x, y, w, h) of the image content inside the ``size`` square input."""
+    if not INFERENCE_LETTERBOX:
+        return 0, 0, size, size
+    scale = size / max(width, height)
+    w = max(1, min(size, int(round(width * scale))))
+    h = max(1, min(size, int(round(height * scale))))
+    return (size - w) // 2, (size - h) // 2, w, h
+
+
+def fit_input(rgb: np.ndarray, kind: str = "full") -> np.ndarray:
+    """RGB array resized (stretched or letterboxed) to the (S, S, 3) input of ``kind``."""
+    size = input_size(kind)
+    height, width = rgb.shape[:2]
+    if not INFERENCE_LETTERBOX:
+        # PIL bilinear (antialiased), as torchvision's Resize in the pipeline
+        # the shipped checkpoints were trained with
+        return np.asarray(Image.fromarray(rgb).resize((size, size), Image.BILINEAR))
+    x, y, w, h = letterbox_box(width, height, size)
+    interpolation = cv2.INTER_AREA if w < width else cv2.INTER_LINEAR
+    resized = cv2.resize(rgb, (w, h), interpolation=interpolation)
+    if (w, h) != (size, size):
+        resized = cv2.copyMakeBorder(
+            resized, y, size - h - y, x, size - w - x, cv2.BORDER_CONSTANT, value=_PAD_COLOR
+        )
+    return resized
+
+
+def normalize_input(fitted: np.ndarray) -> np.ndarray:
+    """uint8 (S, S, 3) RGB -> normalised (3, S, S) float32 model input."""
+    arr = (fitted.astype(np.float32) / 255.0 - _MEAN) / _STD
+    return np.ascontiguousarray(arr.transpose(2, 0, 1))
+
+
+def model_input(rgb: np.ndarray, kind: str = "full") -> np.ndarray:
+    """Normalised (3, S, S) float32 input for an RGB array, S per ROI kind."""
+    return normalize_input(fit_input(rgb, kind))
+
+
+def preprocess(doc: DocumentImage, kind: str = "full") -> torch.Tensor:
+    """Model input (1, 3, S, S) for a decoded document or ROI crop."""
+    return torch.from_numpy(model_input(doc.rgb, kind)).unsqueeze(0).to(device)
+
+
+def crop_letterbox(heatmap: np.ndarray, image_size: Tuple[int, int], size: int) -> np.ndarray:
+    """
+    Cut the padding out of a Grad-CAM map computed on a letterboxed input,
+    keeping roughly the original grid resolution, so it lines up with the
+    image (overlay) and padding does not count towards the tampered area.
+    """
+    x, y, w, h = letterbox_box(image_size[0], image_size[1], size)
+    if (w, h) == (size, size):
+        return heatmap
+    stride = size / heatmap.shape[1]
+    full = cv2.resize(heatmap, (size, size), interpolation=cv2.INTER_LINEAR)
+    content = full[y : y + h, x : x + w]
+    grid = (max(1, int(round(w / stride))), max(1, int(round(h / stride))))
+    return cv2.resize(content, grid, interpolation=cv2.INTER_AREA)
 
 
 def _compute_tampered_ratio(heatmaps: List[np.ndarray], threshold: float = 0.5) -> float:
@@ -77,9 +324,20 @@ def classify_severity(ensemble_score: float, tampered_ratio: float) -> str:
 
 
 class ForgeryInferencePipeline:
-    def __init__(self, checkpoint_dir: str, storage_dir: str):
+    def __init__(
+        self,
+        checkpoint_dir: str,
+        storage_dir: str,
+        max_batch_size: int = MAX_BATCH_SIZE,
+        backend: Optional[str] = None,
+        runtime: Optional[str] = None,
+    ):
         self.checkpoint_dir = checkpoint_dir
         self.storage_dir = storage_dir
+        self.max_batch_size = max(1, max_batch_size)
+        # Optional cross-request MicroBatcher wrapping _forward_batch; set by
+        # the model registry in the serving app.
+        self.batcher = None
 
         self.densenet: DenseNet121Binary = load_densenet_checkpoint(
             checkpoint_dir, device
@@ -88,71 +346,264 @@ class ForgeryInferencePipeline:
             checkpoint_dir, device
         )
 
-        # Target layers for Grad-CAM
-        self.densenet_cam = GradCAM(
-            self.densenet.model.features, self.densenet.model.features[-1]
-        )
-        self.mobilenet_cam = GradCAM(
-            self.mobilenet.model.features, self.mobilenet.model.features[-1]
+        # Serving never updates weights; freezing them keeps autograd from
+        # recording the backbone during the Grad-CAM forward.
+        for model in (self.densenet, self.mobilenet):
+            for param in model.parameters():
+                param.requires_grad_(False)
+
+        # Target layers for Grad-CAM (hooked on the full classifier so the
+        # scoring forward doubles as the Grad-CAM forward)
+        self.densenet_cam = GradCAM(self.densenet, self.densenet.model.features[-1])
+        self.mobilenet_cam = GradCAM(self.mobilenet, self.mobilenet.model.features[-1])
+
+        # Logits come from the configured backend; when a heatmap is
+        # requested DenseNet still runs eagerly for Grad-CAM.
+        self.backend = load_scoring_backend(
+            backend or INFERENCE_BACKEND,
+            checkpoint_dir,
+            self.densenet,
+            self.mobilenet,
+            INFERENCE_EXPORT_DIR,
         )
 
-    def _infer_single(
-        self, image_path: str, heatmap_dir: str
-    ) -> (EnsembleScores, str, np.ndarray):
-        tensor = _load_image_tensor(image_path)
-
-        with torch.no_grad():
-            dn_logit = self.densenet(tensor).item()
-            mb_logit = self.mobilenet(tensor).item()
-
-        scores = compute_ensemble(dn_logit, mb_logit)
-
-        # Use DenseNet Grad-CAM as reference heatmap
-        heatmap = self.densenet_cam.generate(tensor)
-        heatmap_path = overlay_heatmap_on_image(
-            image_path, heatmap, os.path.join(heatmap_dir, "heatmap.jpg")
+        # Threads and runtime profile; ``auto`` is resolved by a benchmark
+        # in warm_up().
+        configure_threads()
+        self.runtime: RuntimeProfile = FP32
+        self.runtime_benchmark: Optional[Dict[str, Dict[str, float]]] = None
+        profile = resolve_profile(runtime or INFERENCE_RUNTIME_PROFILE, device)
+        self._tune_runtime = profile is None
+        self._apply_runtime(profile or FP32)
+
+    def _apply_runtime(self, profile: RuntimeProfile) -> None:
+        profile.apply([self.densenet, self.mobilenet])
+        self.runtime = profile
+        if self.backend.name == "eager":
+            self.backend.profile = profile
+
+    def tune_runtime(self) -> RuntimeProfile:
+        """Benchmark the supported runtime profiles and keep the fastest in tolerance."""
+        generator = torch.Generator().manual_seed(0)
+        batch = torch.randn(
+            min(2, self.max_batch_size), 3, INPUT_SIZE, INPUT_SIZE, generator=generator
+        ).to(device)
+        profile, self.runtime_benchmark = select_profile(
+            lambda _profile, b: self._forward_batch(b),
+            self._apply_runtime,
+            batch,
+            candidate_profiles(device),
         )
-
-        return scores, heatmap_path, heatmap
-
-    def run(
+        self._tune_runtime = False
+        print(f"[RUNTIME] Using the {profile.name} profile ({torch.get_num_threads()} threads)")
+        return profile
+
+    def runtime_stats(self) -> Dict[str, object]:
+        return {
+            "profile": self.runtime.name,
+            "backend": self.backend.name,
+            "threads": torch.get_num_threads(),
+            "benchmark": self.runtime_benchmark,
+        }
+
+    def warm_up(self, iterations: int = 1) -> None:
+        """
+        Run dummy forwards through both networks so allocator pools and
+        kernel selection are settled before the first real request.
+        """
+        if self._tune_runtime:
+            self.tune_runtime()
+        for size in sorted(set(INPUT_SIZES.values())):
+            dummy = torch.zeros(1, 3, size, size, device=device)
+            for _ in range(iterations):
+                self._forward_batch(dummy)
+                if self.backend.name != "eager":
+                    self.backend.densenet(dummy)
+
+    def _forward_batch(
+        self, batch: torch.Tensor
+    ) -> Tuple[List[float], List[float], np.ndarray]:
+        """
+        Score a stacked (N, C, H, W) batch in at most ``max_batch_size``
+        chunks. Returns per-sample DenseNet logits, MobileNet logits and
+        DenseNet Grad-CAM heatmaps (N, H', W').
+        """
+        dn_logits: List[float] = []
+        mb_logits: List[float] = []
+        heatmaps: List[np.ndarray] = []
+        for chunk in torch.split(batch, self.max_batch_size):
+            # Use DenseNet Grad-CAM as reference heatmap: one forward gives
+            # the logits and the activations, one backward the gradients.
+            chunk = self.runtime.prepare(chunk)
+            with self.runtime.autocast(chunk.device.type):
+                dn, cams = self.densenet_cam(chunk)
+            if not self.backend.shares_cam_logits:
+                dn = self.backend.densenet(chunk)
+            mb = self.backend.mobilenet(chunk)
+            dn_logits.extend(dn.float().tolist())
+            mb_logits.extend(mb.tolist())
+            heatmaps.append(cams)
+        return dn_logits, mb_logits, np.concatenate(heatmaps, axis=0)
+
+    def _forward_scores(self, batch: torch.Tensor) -> Tuple[List[float], List[float]]:
+        """Logits only (no heatmap): both networks on the scoring backend."""
+        dn_logits: List[float] = []
+        mb_logits: List[float] = []
+        for chunk in torch.split(batch, self.max_batch_size):
+            dn_logits.extend(self.backend.densenet(chunk).tolist())
+            mb_logits.extend(self.backend.mobilenet(chunk).tolist())
+        return dn_logits, mb_logits
+
+    def _score(self, batch: torch.Tensor) -> Tuple[List[float], List[float], np.ndarray]:
+        """Route through the shared micro-batcher when one is running."""
+        if self.batcher is not None and self.batcher.running:
+            return self.batcher.submit(batch).result()
+        return self._forward_batch(batch)
+
+    def score_batch(
+        self, batch: torch.Tensor, heatmaps: bool = True
+    ) -> Tuple[List[EnsembleScores], Optional[np.ndarray]]:
+        """
+        Ensemble scores and (if ``heatmaps``) Grad-CAM maps for an already
+        preprocessed (N, C, H, W) batch; used by offline tools that prepare
+        inputs themselves (see ml.bulk_score). Without heatmaps both
+        networks run on the scoring backend only.
+        """
+        batch = batch.to(device)
+        if heatmaps:
+            dn_logits, mb_logits, cams = self._score(batch)
+        else:
+            (dn_logits, mb_logits), cams = self._forward_scores(batch), None
+        return [compute_ensemble(d, m) for d, m in zip(dn_logits, mb_logits)], cams
+
+    def score_inputs(
         self,
-        full_image_path: str,
-        roi_paths: Optional[List[Dict]] = None,
-        upload_id: Optional[str] = None,
-    ) -> InferenceResult:
+        inputs: List[torch.Tensor],
+        kinds: List[str],
+        image_sizes: List[Tuple[int, int]],
+        heatmaps: bool = True,
+    ) -> List[Tuple[EnsembleScores, Optional[np.ndarray]]]:
         """
-        Run inference on full image and ROIs.
-        roi_paths: list of dicts with keys {kind, path}
+        Score (1, 3, S, S) inputs whose side S depends on their ROI kind.
+        Same-size inputs are stacked into one bucket per size; with the
+        micro-batcher running, all buckets are submitted before waiting so
+        each can merge with other requests' batches of that size. Heatmaps
+        are returned with the letterbox padding cropped off.
         """
+        stacked = self._bucket(inputs)
+        return self._unbucket(inputs, image_sizes, stacked, self._score_buckets(stacked, heatmaps))
+
+    @staticmethod
+    def _bucket(inputs: List[torch.Tensor]) -> List[Tuple[List[int], torch.Tensor]]:
+        """Stack same-size inputs: (input indices, (N, 3, S, S) batch) per size."""
+        buckets: Dict[Tuple[int, ...], List[int]] = {}
+        for i, tensor in enumerate(inputs):
+            buckets.setdefault(tuple(tensor.shape[1:]), []).append(i)
+        return [
+            (indices, torch.cat([inputs[i] for i in indices], dim=0).to(device))
+            for indices in buckets.values()
+        ]
+
+    def _score_buckets(
+        self, stacked: List[Tuple[List[int], torch.Tensor]], heatmaps: bool = True
+    ) -> List[Tuple[List[float], List[float], Optional[np.ndarray]]]:
+        if not heatmaps:
+            return [self._forward_scores(batch) + (None,) for _, batch in stacked]
+        if self.batcher is not None and self.batcher.running:
+            futures = [self.batcher.submit(batch) for _, batch in stacked]
+            return [future.result() for future in futures]
+        return [self._forward_batch(batch) for _, batch in stacked]
+
+    @staticmethod
+    def _unbucket(
+        inputs: List[torch.Tensor],
+        image_sizes: List[Tuple[int, int]],
+        stacked: List[Tuple[List[int], torch.Tensor]],
+        scored: List[Tuple[List[float], List[float], Optional[np.ndarray]]],
+    ) -> List[Tuple[EnsembleScores, Optional[np.ndarray]]]:
+        outputs: List[Tuple[EnsembleScores, Optional[np.ndarray]]] = [None] * len(inputs)
+        for (indices, _), (dn_logits, mb_logits, cams) in zip(stacked, scored):
+            for j, i in enumerate(indices):
+                heatmap = None
+                if cams is not None:
+                    heatmap = crop_letterbox(cams[j], image_sizes[i], int(inputs[i].shape[-1]))
+                outputs[i] = (compute_ensemble(dn_logits[j], mb_logits[j]), heatmap)
+        return outputs
+
+    @staticmethod
+    def _render(
+        docs: List[DocumentImage],
+        heatmap_dirs: List[str],
+        scored: List[Tuple[EnsembleScores, np.ndarray]],
+    ) -> List[Tuple[EnsembleScores, str, np.ndarray]]:
+        outputs = []
+        for doc, heatmap_dir, (scores, heatmap) in zip(docs, heatmap_dirs, scored):
+            heatmap_path = overlay_heatmap_on_image(
+                doc, heatmap, os.path.join(heatmap_dir, "heatmap.jpg")
+            )
+            outputs.append((scores, heatmap_path, heatmap))
+        return outputs
+
+    def _infer_batch(
+        self,
+        images: List[Union[str, DocumentImage]],
+        heatmap_dirs: List[str],
+        on_scored: Optional[Callable[[], None]] = None,
+        kinds: Optional[List[str]] = None,
+    ) -> List[Tuple[EnsembleScores, str, np.ndarray]]:
+        docs = [DocumentImage.coerce(image) for image in images]
+        kinds = kinds or ["full"] * len(docs)
+        scored = self.score_inputs(
+            [doc.model_input(kind) for doc, kind in zip(docs, kinds)],
+            kinds,
+            [doc.size for doc in docs],
+        )
+        if on_scored is not None:
+            on_scored()
+        return self._render(docs, heatmap_dirs, scored)
+
+    def _infer_single(
+        self, image: Union[str, DocumentImage], heatmap_dir: str
+    ) -> (EnsembleScores, str, np.ndarray):
+        return self._infer_batch([image], [heatmap_dir])[0]
+
+    def _heatmap_dirs(self, upload_id: Optional[str], n_rois: int) -> Tuple[str, List[str]]:
         base_heatmap_dir = Path(self.storage_dir) / "heatmaps"
         if upload_id:
             base_heatmap_dir = base_heatmap_dir / upload_id
         base_heatmap_dir.mkdir(parents=True, exist_ok=True)
-
-        full_scores, full_heatmap_path, full_heatmap = self._infer_single(
-            full_image_path, str(base_heatmap_dir / "full")
+        return (
+            str(base_heatmap_dir / "full"),
+            [str(base_heatmap_dir / f"roi_{i}") for i in range(n_rois)],
         )
 
+    @staticmethod
+    def _roi_images(roi_paths: List[Dict]) -> List[Union[str, DocumentImage]]:
+        # Prefer in-memory crops; fall back to reading the crop file.
+        return [
+            roi["image"] if roi.get("image") is not None else roi["path"] for roi in roi_paths
+        ]
+
+    @staticmethod
+    def _assemble(
+        roi_paths: List[Dict],
+        full_output: Tuple[EnsembleScores, str, np.ndarray],
+        roi_outputs: List[Tuple[EnsembleScores, str, np.ndarray]],
+    ) -> InferenceResult:
+        full_scores, full_heatmap_path, full_heatmap = full_output
         roi_results: List[ROIInferenceResult] = []
         roi_heatmaps: List[np.ndarray] = [full_heatmap]
 
-        if roi_paths:
-            for i, roi in enumerate(roi_paths):
-                kind = roi.get("kind", "roi")
-                path = roi["path"]
-                scores, heatmap_path, heatmap = self._infer_single(
-                    path, str(base_heatmap_dir / f"roi_{i}")
+        for roi, (scores, heatmap_path, heatmap) in zip(roi_paths, roi_outputs):
+            roi_results.append(
+                ROIInferenceResult(
+                    kind=roi.get("kind", "roi"),
+                    path=roi["path"],
+                    scores=scores,
+                    heatmap_path=heatmap_path,
                 )
-                roi_results.append(
-                    ROIInferenceResult(
-                        kind=kind,
-                        path=path,
-                        scores=scores,
-                        heatmap_path=heatmap_path,
-                    )
-                )
-                roi_heatmaps.append(heatmap)
+            )
+            roi_heatmaps.append(heatmap)
 
         tampered_ratio = _compute_tampered_ratio(roi_heatmaps)
         severity = classify_severity(full_scores.ensemble, tampered_ratio)
@@ -165,3 +616,131 @@ class ForgeryInferencePipeline:
             severity=severity,
         )
 
+    def run(
+        self,
+        full_image_path: Union[str, DocumentImage],
+        roi_paths: Optional[List[Dict]] = None,
+        upload_id: Optional[str] = None,
+        batch_full_image: bool = True,
+        progress: Optional[Callable[[str, str], None]] = None,
+    ) -> InferenceResult:
+        """
+        Run inference on full image and ROIs.
+        full_image_path: path or an already decoded DocumentImage
+        roi_paths: list of dicts with keys {kind, path} and optionally
+            {image}: an in-memory DocumentImage of the crop
+
+        All ROI crops (and the full image when ``batch_full_image`` is set)
+        are resized to the input size of their kind and scored together,
+        one batch per input size.
+        ``progress(stage, state)`` is told when heatmap rendering starts
+        and completes.
+        """
+        if batch_full_image:
+            request = {"full_image": full_image_path, "roi_paths": roi_paths, "upload_id": upload_id}
+            return self.run_batch([request], progress=progress)[0]
+
+        roi_paths = roi_paths or []
+        image_paths = self._roi_images(roi_paths)
+        full_dir, heatmap_dirs = self._heatmap_dirs(upload_id, len(roi_paths))
+
+        def heatmaps_started() -> None:
+            if progress is not None:
+                progress("heatmaps", "started")
+
+        full_output = self._infer_batch(
+            [full_image_path], [full_dir], on_scored=None if image_paths else heatmaps_started
+        )[0]
+        roi_outputs = (
+            self._infer_batch(
+                image_paths,
+                heatmap_dirs,
+                on_scored=heatmaps_started,
+                kinds=[roi.get("kind", "roi") for roi in roi_paths],
+            )
+            if image_paths
+            else []
+        )
+        result = self._assemble(roi_paths, full_output, roi_outputs)
+        if progress is not None:
+            progress("heatmaps", "completed")
+        return result
+
+    def run_batch(
+        self,
+        requests: List[Dict],
+        progress: Optional[Callable[[str, str], None]] = None,
+    ) -> List[InferenceResult]:
+        """
+        Score several uploads as one tensor batch.
+
+        Each request is a dict with keys {full_image, roi_paths, upload_id}
+        (as for ``run``). Full images and ROI crops of all requests are
+        scored together, bucketed by input size (split into
+        ``max_batch_size`` chunks) and the outputs sliced back per upload.
+        """
+        plan, stacked = self._plan_batch(requests)
+        return self._finish_batch(plan, stacked, self._score_buckets(stacked), progress)
+
+    async def arun_batch(
+        self,
+        requests: List[Dict],
+        progress: Optional[Callable[[str, str], None]] = None,
+        offload: Optional[Callable[..., Awaitable[Any]]] = None,
+    ) -> List[InferenceResult]:
+        """
+        ``run_batch`` for async callers. Preprocessing and heatmap rendering
+        run through ``offload(fn, *args)`` (default ``asyncio.to_thread``);
+        the CNN forward is awaited on the micro-batcher, so no thread is
+        blocked while a request waits for its batch to fill.
+        """
+        offload = offload or asyncio.to_thread
+        if self.batcher is None or not self.batcher.running:
+            return await offload(self.run_batch, requests, progress)
+        plan, stacked = await offload(self._plan_batch, requests)
+        scored = await asyncio.gather(*(self.batcher.asubmit(batch) for _, batch in stacked))
+        return await offload(self._finish_batch, plan, stacked, list(scored), progress)
+
+    def _plan_batch(self, requests: List[Dict]) -> Tuple[Tuple, List[Tuple[List[int], torch.Tensor]]]:
+        """Decode and preprocess every image of ``requests``; returns (plan, buckets)."""
+        images: List[Union[str, DocumentImage]] = []
+        kinds: List[str] = []
+        heatmap_dirs: List[str] = []
+        spans: List[Tuple[int, int, List[Dict]]] = []
+        for request in requests:
+            roi_paths = request.get("roi_paths") or []
+            full_dir, roi_dirs = self._heatmap_dirs(request.get("upload_id"), len(roi_paths))
+            start = len(images)
+            images.append(request["full_image"])
+            images.extend(self._roi_images(roi_paths))
+            kinds.append("full")
+            kinds.extend(roi.get("kind", "roi") for roi in roi_paths)
+            heatmap_dirs.append(full_dir)
+            heatmap_dirs.extend(roi_dirs)
+            spans.append((start, len(images), roi_paths))
+
+        docs = [DocumentImage.coerce(image) for image in images]
+        inputs = [doc.model_input(kind) for doc, kind in zip(docs, kinds)]
+        return (docs, inputs, heatmap_dirs, spans), self._bucket(inputs)
+
+    def _finish_batch(
+        self,
+        plan: Tuple,
+        stacked: List[Tuple[List[int], torch.Tensor]],
+        scored: List[Tuple[List[float], List[float], Optional[np.ndarray]]],
+        progress: Optional[Callable[[str, str], None]] = None,
+    ) -> List[InferenceResult]:
+        """Heatmap overlays and per-upload results from the scored buckets."""
+        docs, inputs, heatmap_dirs, spans = plan
+        if progress is not None:
+            progress("heatmaps", "started")
+        outputs = self._render(
+            docs, heatmap_dirs, self._unbucket(inputs, [doc.size for doc in docs], stacked, scored)
+        )
+        results = [
+            self._assemble(roi_paths, outputs[start], outputs[start + 1 : end])
+            for start, end, roi_paths in spans
+        ]
+        if progress is not None:
+            progress("heatmaps", "completed")
+        return results
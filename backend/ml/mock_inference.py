@@ -5,11 +5,13 @@ Returns realistic dummy predictions when actual models aren't available.
 import os
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 import random
 import numpy as np
 from PIL import Image, ImageDraw, ImageFilter
 
+from .document import DocumentImage
+
 
 @dataclass
 class EnsembleScores:
@@ -50,7 +52,10 @@ def create_mock_heatmap(image_path: str, heatmap_path: str, tampering_intensity:
     """Create a mock heatmap visualization."""
     try:
         # Open original image
-        img = Image.open(image_path).convert("RGB")
+        if isinstance(image_path, DocumentImage):
+            img = image_path.pil
+        else:
+            img = Image.open(image_path).convert("RGB")
         width, height = img.size
         
         # Create heatmap overlay
@@ -90,12 +95,18 @@ class MockInferencePipeline:
         self.checkpoint_dir = checkpoint_dir
         self.storage_dir = storage_dir
         print(f"[MOCK MODE] Using mock inference pipeline (no trained models available)")
+
+    def warm_up(self, iterations: int = 1) -> None:
+        """No models to warm in mock mode."""
+        return None
     
     def run(
         self,
         full_image_path: str,
         roi_paths: Optional[List[Dict]] = None,
         upload_id: Optional[str] = None,
+        batch_full_image: bool = True,
+        progress: Optional[Callable[[str, str], None]] = None,
     ) -> InferenceResult:
         """Generate mock inference results with same interface as real pipeline."""
         
@@ -128,6 +139,9 @@ class MockInferencePipeline:
         ensemble_score = (densenet_score + mobilenet_score) / 2
         severity = classify_severity(ensemble_score, tampering_ratio)
         
+        if progress is not None:
+            progress("heatmaps", "started")
+
         # Create full image heatmap
         heatmap_full_dir = base_heatmap_dir / "full"
         heatmap_full_dir.mkdir(parents=True, exist_ok=True)
@@ -154,7 +168,9 @@ class MockInferencePipeline:
                 roi_heatmap_dir = base_heatmap_dir / f"roi_{i}"
                 roi_heatmap_dir.mkdir(parents=True, exist_ok=True)
                 roi_heatmap_path = str(roi_heatmap_dir / "heatmap.jpg")
-                if os.path.exists(roi_path):
+                if roi.get("image") is not None:
+                    create_mock_heatmap(roi["image"], roi_heatmap_path, roi_scores.ensemble)
+                elif os.path.exists(roi_path):
                     create_mock_heatmap(roi_path, roi_heatmap_path, roi_scores.ensemble)
                 
                 roi_results.append(ROIInferenceResult(
@@ -164,6 +180,9 @@ class MockInferencePipeline:
                     heatmap_path=roi_heatmap_path
                 ))
         
+        if progress is not None:
+            progress("heatmaps", "completed")
+
         return InferenceResult(
             full_image_scores=EnsembleScores(
                 densenet=densenet_score,
@@ -175,3 +194,19 @@ class MockInferencePipeline:
             tampered_ratio=tampering_ratio,
             severity=severity
         )
+
+    def run_batch(
+        self,
+        requests: List[Dict],
+        progress: Optional[Callable[[str, str], None]] = None,
+    ) -> List[InferenceResult]:
+        """Same interface as ForgeryInferencePipeline.run_batch."""
+        return [
+            self.run(
+                full_image_path=request["full_image"],
+                roi_paths=request.get("roi_paths"),
+                upload_id=request.get("upload_id"),
+                progress=progress,
+            )
+            for request in requests
+        ]
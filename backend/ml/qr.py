@@ -1,25 +1,99 @@
-from typing import Optional, Tuple
+from dataclasses import dataclass
+from typing import Optional, Tuple, Union
 
 import cv2
+import numpy as np
 
+from .detectors import get_qr_detector, timed
+from .document import DocumentImage
 
-def decode_qr(image_path: str) -> Tuple[Optional[str], bool]:
+
+@dataclass
+class QRResult:
+    bbox: Optional[Tuple[int, int, int, int]]  # x, y, w, h in source image coords
+    data: Optional[str]
+    is_valid: bool
+    # Which pass produced the payload: full | crop | upscaled (or none)
+    source: str = "none"
+
+    @property
+    def found(self) -> bool:
+        return self.bbox is not None
+
+
+def _is_valid_payload(data: Optional[str]) -> bool:
+    # Minimal heuristic: non-empty, reasonable length
+    return bool(data) and len(data) > 10
+
+
+def _points_to_bbox(points: np.ndarray, shape) -> Optional[Tuple[int, int, int, int]]:
+    if points is None or len(points) == 0:
+        return None
+    x, y, w, h = cv2.boundingRect(points[0].astype(np.int32))
+    height, width = shape[:2]
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(width, x + w), min(height, y + h)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def _expand(bbox: Tuple[int, int, int, int], shape, margin: float) -> Tuple[int, int, int, int]:
+    x, y, w, h = bbox
+    height, width = shape[:2]
+    dx, dy = int(w * margin), int(h * margin)
+    x0, y0 = max(0, x - dx), max(0, y - dy)
+    x1, y1 = min(width, x + w + dx), min(height, y + h + dy)
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def detect_qr(
+    image: Union[str, DocumentImage, np.ndarray],
+    margin: float = 0.1,
+    upscale: float = 2.0,
+) -> QRResult:
     """
-    Decode QR code from an image and perform a basic validity check.
+    Locate and decode the QR code in one pass.
 
-    Returns (data, is_valid). For Aadhaar-like QR, you can extend
-    the validation logic (prefixes, length, checksum, etc.).
+    The full image goes through detectAndDecode once; only if a code is
+    located but its payload cannot be read do we retry on the (slightly
+    padded) crop, then on an upscaled crop. Dense Aadhaar QR codes often
+    only decode at the higher effective resolution.
     """
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Failed to read image at {image_path}")
+    img = image if isinstance(image, np.ndarray) else DocumentImage.coerce(image).bgr
+    detector = get_qr_detector()
 
-    detector = cv2.QRCodeDetector()
-    data, points, _ = detector.detectAndDecode(img)
-    if not data:
-        return None, False
+    with timed("qr_detect"):
+        data, points, _ = detector.detectAndDecode(img)
+    bbox = _points_to_bbox(points, img.shape)
+    if data:
+        return QRResult(bbox=bbox, data=data, is_valid=_is_valid_payload(data), source="full")
+    if bbox is None:
+        return QRResult(bbox=None, data=None, is_valid=False)
+
+    x, y, w, h = _expand(bbox, img.shape, margin)
+    crop = img[y : y + h, x : x + w]
+    with timed("qr_decode_crop"):
+        data, _, _ = detector.detectAndDecode(crop)
+    if data:
+        return QRResult(bbox=bbox, data=data, is_valid=_is_valid_payload(data), source="crop")
+
+    if upscale and upscale > 1.0:
+        enlarged = cv2.resize(crop, None, fx=upscale, fy=upscale, interpolation=cv2.INTER_CUBIC)
+        with timed("qr_decode_upscaled"):
+            data, _, _ = detector.detectAndDecode(enlarged)
+        if data:
+            return QRResult(bbox=bbox, data=data, is_valid=_is_valid_payload(data), source="upscaled")
+
+    return QRResult(bbox=bbox, data=None, is_valid=False)
 
-    # Minimal heuristic: non-empty, reasonable length
-    is_valid = len(data) > 10
-    return data, is_valid
 
+def decode_qr(image: Union[str, DocumentImage, np.ndarray]) -> Tuple[Optional[str], bool]:
+    """
+    Decode QR code from an image and perform a basic validity check.
+
+    Returns (data, is_valid). For Aadhaar-like QR, you can extend
+    the validation logic (prefixes, length, checksum, etc.).
+    """
+    result = detect_qr(image)
+    return result.data, result.is_valid
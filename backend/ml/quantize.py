@@ -0,0 +1,257 @@
+"""
+Post-training int8 quantization of the serving classifiers.
+
+    python -m ml.quantize --data_dir data --checkpoint_dir ml/checkpoints --mode static
+
+``static`` quantizes convolutions and the head (FX graph mode), calibrating
+activation ranges on the ``val/`` split from ``ml.train.build_dataloaders``.
+``dynamic`` only quantizes the ``nn.Linear`` head, which is cheap to produce
+but leaves the convolutional backbone, i.e. nearly all of the CPU time, in
+float.
+
+Each model is evaluated against its float checkpoint on the same split
+(accuracy, F1, per-image latency, file size). A quantized model is only
+published, as a frozen TorchScript ``<name>.int8.pt`` next to the
+checkpoints, if its F1 drop is within ``--f1_tolerance``. The serving
+pipeline loads published variants with ``INFERENCE_BACKEND=int8`` (see
+ml/inference.py); a rejected model keeps scoring in float.
+"""
+import copy
+import io
+import json
+import time
+from itertools import islice
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+
+from .densenet import load_densenet_checkpoint
+from .inference import INPUT_SIZE
+from .mobilenet import load_mobilenet_checkpoint
+from .registry import checkpoint_version
+from .train import build_dataloaders, evaluate_model
+
+
+MANIFEST_NAME = "quantize.json"
+MODES = ("static", "dynamic")
+DEFAULT_F1_TOLERANCE = 0.01
+DEFAULT_CALIBRATION_BATCHES = 32
+
+
+def quantized_path(checkpoint_dir: str, model_name: str) -> Path:
+    return Path(checkpoint_dir) / f"{model_name}.int8.pt"
+
+
+def read_manifest(checkpoint_dir: str) -> Optional[Dict[str, Any]]:
+    path = Path(checkpoint_dir) / MANIFEST_NAME
+    if not path.exists():
+        return None
+    return json.loads(path.read_text())
+
+
+def select_engine() -> str:
+    """Pick the quantized kernel backend for this CPU (x86 or ARM)."""
+    engines = torch.backends.quantized.supported_engines
+    for engine in ("x86", "fbgemm", "qnnpack"):
+        if engine in engines:
+            torch.backends.quantized.engine = engine
+            return engine
+    raise RuntimeError("This PyTorch build has no quantized CPU engine")
+
+
+def published_models(checkpoint_dir: str) -> Dict[str, Path]:
+    """
+    Published int8 artifacts built from the current checkpoints, by model
+    name. Raises if none exist or they were built from other checkpoints.
+    """
+    manifest = read_manifest(checkpoint_dir)
+    if manifest is None:
+        raise RuntimeError(
+            f"No quantized models in {checkpoint_dir}; run `python -m ml.quantize`"
+        )
+    current = checkpoint_version(checkpoint_dir)
+    if manifest.get("checkpointVersion") != current:
+        raise RuntimeError(
+            f"Quantized models in {checkpoint_dir} were built from checkpoint version "
+            f"{manifest.get('checkpointVersion')}, current is {current}; re-run ml.quantize"
+        )
+    if manifest.get("engine") not in torch.backends.quantized.supported_engines:
+        raise RuntimeError(f"Quantized models need the {manifest.get('engine')} engine")
+    published = {
+        name: quantized_path(checkpoint_dir, name)
+        for name, report in manifest.get("models", {}).items()
+        if report.get("published")
+    }
+    if not published:
+        raise RuntimeError("No quantized model passed the accuracy gate")
+    return published
+
+
+def quantize_dynamic(model: nn.Module) -> nn.Module:
+    return torch.ao.quantization.quantize_dynamic(
+        copy.deepcopy(model), {nn.Linear}, dtype=torch.qint8
+    )
+
+
+def quantize_static(
+    model: nn.Module, calibration_loader: DataLoader, engine: str, batches: int
+) -> nn.Module:
+    from torch.ao.quantization import get_default_qconfig_mapping
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    example = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    prepared = prepare_fx(
+        copy.deepcopy(model), get_default_qconfig_mapping(engine), (example,)
+    )
+    with torch.no_grad():
+        for images, _ in islice(calibration_loader, max(1, batches)):
+            prepared(images)
+    return convert_fx(prepared)
+
+
+def _freeze(model: nn.Module) -> torch.jit.ScriptModule:
+    example = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    with torch.no_grad():
+        return torch.jit.freeze(torch.jit.trace(model.eval(), example))
+
+
+def _size_bytes(model: nn.Module) -> int:
+    buffer = io.BytesIO()
+    if isinstance(model, torch.jit.ScriptModule):
+        torch.jit.save(model, buffer)
+    else:
+        torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def measure_latency(model: nn.Module, batch_size: int = 1, iterations: int = 10) -> float:
+    """Mean milliseconds per image on CPU after one warm-up forward."""
+    batch = torch.randn(batch_size, 3, INPUT_SIZE, INPUT_SIZE)
+    with torch.no_grad():
+        model(batch)
+        start = time.perf_counter()
+        for _ in range(iterations):
+            model(batch)
+    return (time.perf_counter() - start) * 1000.0 / (iterations * batch_size)
+
+
+def _evaluate(model: nn.Module, val_loader: DataLoader) -> Dict[str, float]:
+    acc, precision, recall, f1 = evaluate_model(model, val_loader, torch.device("cpu"))
+    return {"acc": acc, "precision": precision, "recall": recall, "f1": f1}
+
+
+def quantize_models(
+    data_dir: str,
+    checkpoint_dir: str,
+    mode: str = "static",
+    f1_tolerance: float = DEFAULT_F1_TOLERANCE,
+    calibration_batches: int = DEFAULT_CALIBRATION_BATCHES,
+    batch_size: int = 16,
+    models: Iterable[str] = ("densenet121_aadhaar", "mobilenetv2_aadhaar"),
+) -> Dict[str, Any]:
+    """
+    Quantize, evaluate and (if within ``f1_tolerance``) publish each model.
+    Returns the manifest, which also holds the full report.
+    """
+    if mode not in MODES:
+        raise ValueError(f"mode must be one of {MODES}")
+    engine = select_engine()
+    cpu = torch.device("cpu")
+    _, val_loader = build_dataloaders(data_dir, batch_size=batch_size)
+    loaders = {
+        "densenet121_aadhaar": load_densenet_checkpoint,
+        "mobilenetv2_aadhaar": load_mobilenet_checkpoint,
+    }
+
+    reports: Dict[str, Dict[str, Any]] = {}
+    for name in models:
+        model = loaders[name](checkpoint_dir, cpu)
+        for param in model.parameters():
+            param.requires_grad_(False)
+
+        if mode == "static":
+            quantized = quantize_static(model, val_loader, engine, calibration_batches)
+        else:
+            quantized = quantize_dynamic(model)
+        quantized = _freeze(quantized)
+        # Latency and size are compared between equally frozen graphs
+        frozen_float = _freeze(model)
+
+        float_metrics = _evaluate(model, val_loader)
+        int8_metrics = _evaluate(quantized, val_loader)
+        f1_drop = float_metrics["f1"] - int8_metrics["f1"]
+        report = {
+            "mode": mode,
+            "float": float_metrics,
+            "int8": int8_metrics,
+            "accDelta": int8_metrics["acc"] - float_metrics["acc"],
+            "f1Delta": -f1_drop,
+            "latencyMs": {"float": measure_latency(frozen_float), "int8": measure_latency(quantized)},
+            "sizeBytes": {"float": _size_bytes(frozen_float), "int8": _size_bytes(quantized)},
+            "published": f1_drop <= f1_tolerance,
+        }
+        reports[name] = report
+
+        path = quantized_path(checkpoint_dir, name)
+        if report["published"]:
+            quantized.save(str(path))
+            verdict = f"published {path}"
+        else:
+            path.unlink(missing_ok=True)
+            verdict = f"REJECTED (F1 drop {f1_drop:.4f} > tolerance {f1_tolerance})"
+        print(
+            f"[QUANTIZE] {name} {mode}: "
+            f"acc {float_metrics['acc']:.4f} -> {int8_metrics['acc']:.4f}, "
+            f"f1 {float_metrics['f1']:.4f} -> {int8_metrics['f1']:.4f}, "
+            f"latency {report['latencyMs']['float']:.1f} -> {report['latencyMs']['int8']:.1f} ms/img, "
+            f"size {report['sizeBytes']['float'] / 2**20:.1f} -> {report['sizeBytes']['int8'] / 2**20:.1f} MiB; "
+            f"{verdict}"
+        )
+
+    # Models quantized earlier from the same checkpoints stay valid
+    version = checkpoint_version(checkpoint_dir)
+    previous = read_manifest(checkpoint_dir) or {}
+    if previous.get("checkpointVersion") != version or previous.get("engine") != engine:
+        previous = {}
+    manifest = {
+        "checkpointVersion": version,
+        "engine": engine,
+        "inputSize": INPUT_SIZE,
+        "f1Tolerance": f1_tolerance,
+        "models": {**previous.get("models", {}), **reports},
+    }
+    (Path(checkpoint_dir) / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+    return manifest
+
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="int8 post-training quantization with an F1 gate")
+    parser.add_argument("--data_dir", type=str, required=True, help="Dataset root (val/ is used)")
+    parser.add_argument("--checkpoint_dir", type=str, default="ml/checkpoints")
+    parser.add_argument("--mode", type=str, default="static", choices=MODES)
+    parser.add_argument("--f1_tolerance", type=float, default=DEFAULT_F1_TOLERANCE)
+    parser.add_argument("--calibration_batches", type=int, default=DEFAULT_CALIBRATION_BATCHES)
+    parser.add_argument("--batch_size", type=int, default=16)
+    parser.add_argument(
+        "--model", type=str, default="all", choices=["densenet121_aadhaar", "mobilenetv2_aadhaar", "all"]
+    )
+    args = parser.parse_args()
+
+    selected = ("densenet121_aadhaar", "mobilenetv2_aadhaar") if args.model == "all" else (args.model,)
+    manifest = quantize_models(
+        args.data_dir,
+        args.checkpoint_dir,
+        mode=args.mode,
+        f1_tolerance=args.f1_tolerance,
+        calibration_batches=args.calibration_batches,
+        batch_size=args.batch_size,
+        models=selected,
+    )
+    rejected = [name for name in selected if not manifest["models"][name]["published"]]
+    sys.exit(1 if rejected else 0)
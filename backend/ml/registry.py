@@ -0,0 +1,180 @@
+"""
+Process-wide model registry.
+
+Loading DenseNet121 + MobileNetV2 (torchvision construction + checkpoint
+restore) takes seconds, so the serving app builds the inference pipeline
+exactly once at startup and shares it between requests. The registry also
+runs warm-up forwards so the first real prediction does not pay for lazy
+allocator / kernel initialisation.
+"""
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+# Try to import real inference, fall back to mock
+try:
+    from .inference import ForgeryInferencePipeline as RealInferencePipeline
+    USE_MOCK_INFERENCE = False
+except Exception as e:
+    print(f"[WARNING] Could not import real inference pipeline: {e}")
+    print("[WARNING] Using mock inference pipeline instead")
+    USE_MOCK_INFERENCE = True
+    from .mock_inference import MockInferencePipeline as RealInferencePipeline
+
+
+MICROBATCH_ENABLED = os.getenv("INFERENCE_MICROBATCH", "true").lower() == "true"
+MICROBATCH_MAX_SIZE = int(os.getenv("MICROBATCH_MAX_SIZE", "32"))
+MICROBATCH_MAX_WAIT_MS = float(os.getenv("MICROBATCH_MAX_WAIT_MS", "5"))
+
+CHECKPOINT_FILES = ("densenet121_aadhaar.pt", "mobilenetv2_aadhaar.pt")
+
+
+def checkpoint_version(checkpoint_dir: str) -> str:
+    """
+    Short content hash of the serving checkpoints, used to key cached
+    predictions. Missing checkpoints hash as such (ImageNet-initialised heads).
+    """
+    digest = hashlib.sha256()
+    for name in CHECKPOINT_FILES:
+        path = Path(checkpoint_dir) / name
+        digest.update(name.encode("utf-8"))
+        if path.exists():
+            with path.open("rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+        else:
+            digest.update(b"<missing>")
+    if USE_MOCK_INFERENCE:
+        digest.update(b"<mock>")
+    return digest.hexdigest()[:16]
+
+
+class ModelRegistry:
+    """
+    Owns the long-lived inference pipeline and tracks its lifecycle:
+    ``loaded`` once checkpoints are restored, ``warm`` once the warm-up
+    forwards have completed. Only a loaded *and* warm registry is ready.
+    """
+
+    def __init__(self, checkpoint_dir: str, storage_dir: str, warmup_iterations: int = 1):
+        self.checkpoint_dir = checkpoint_dir
+        self.storage_dir = storage_dir
+        self.warmup_iterations = warmup_iterations
+
+        self.pipeline: Optional[Any] = None
+        self.batcher: Optional[Any] = None
+        self.model_version: Optional[str] = None
+        self.loaded = False
+        self.warm = False
+        self.error: Optional[str] = None
+        self.load_seconds: Optional[float] = None
+        self.warmup_seconds: Optional[float] = None
+        self._lock = threading.Lock()
+        # Set by shutdown(); guards against initialize() (still running in a
+        # worker thread) starting the batcher after the app has stopped.
+        self._closed = False
+        self._state_lock = threading.Lock()
+
+    @property
+    def ready(self) -> bool:
+        return self.loaded and self.warm
+
+    def load(self) -> None:
+        start = time.perf_counter()
+        self.pipeline = RealInferencePipeline(self.checkpoint_dir, self.storage_dir)
+        self.model_version = checkpoint_version(self.checkpoint_dir)
+        self.load_seconds = time.perf_counter() - start
+        self.loaded = True
+
+    def warm_up(self) -> None:
+        start = time.perf_counter()
+        if hasattr(self.pipeline, "warm_up"):
+            self.pipeline.warm_up(iterations=self.warmup_iterations)
+        self.warmup_seconds = time.perf_counter() - start
+        self.warm = True
+
+    def start_batcher(self) -> None:
+        """Put a cross-request MicroBatcher in front of the pipeline's batched forward."""
+        if not MICROBATCH_ENABLED or not hasattr(self.pipeline, "_forward_batch"):
+            return
+        from .batching import MicroBatcher
+
+        batcher = MicroBatcher(
+            self.pipeline._forward_batch,
+            max_batch_size=MICROBATCH_MAX_SIZE,
+            max_wait_ms=MICROBATCH_MAX_WAIT_MS,
+            name="ensemble",
+        )
+        with self._state_lock:
+            if self._closed:
+                return
+            batcher.start()
+            self.batcher = batcher
+            self.pipeline.batcher = batcher
+
+    def shutdown(self) -> None:
+        with self._state_lock:
+            self._closed = True
+            batcher, self.batcher = self.batcher, None
+            if self.pipeline is not None and hasattr(self.pipeline, "batcher"):
+                self.pipeline.batcher = None
+        if batcher is not None:
+            batcher.stop()
+
+    def initialize(self) -> None:
+        """
+        Load and warm the models. Blocking; call from a worker thread.
+        Safe to call more than once, later calls are no-ops.
+        """
+        with self._lock:
+            if self.ready or self._closed:
+                return
+            try:
+                if not self.loaded:
+                    self.load()
+                if self._closed:
+                    return
+                self.warm_up()
+                self.start_batcher()
+                if self._closed:
+                    return
+                print(
+                    f"[REGISTRY] Models ready (load={self.load_seconds:.2f}s, "
+                    f"warmup={self.warmup_seconds:.2f}s, mock={USE_MOCK_INFERENCE})"
+                )
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                print(f"[REGISTRY ERROR] Model initialization failed: {self.error}")
+                raise
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.ready,
+            "loaded": self.loaded,
+            "warm": self.warm,
+            "mock": USE_MOCK_INFERENCE,
+            "modelVersion": self.model_version,
+            "loadSeconds": self.load_seconds,
+            "warmupSeconds": self.warmup_seconds,
+            "error": self.error,
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+            "runtime": (
+                self.pipeline.runtime_stats() if hasattr(self.pipeline, "runtime_stats") else None
+            ),
+        }
+
+
+_registry: Optional[ModelRegistry] = None
+
+
+def init_registry(checkpoint_dir: str, storage_dir: str, warmup_iterations: int = 1) -> ModelRegistry:
+    global _registry
+    _registry = ModelRegistry(checkpoint_dir, storage_dir, warmup_iterations)
+    return _registry
+
+
+def get_registry() -> Optional[ModelRegistry]:
+    return _registry
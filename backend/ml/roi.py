@@ -1,42 +1,216 @@
-from dataclasses import dataclass
+import json
+import os
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 
 import cv2
 import numpy as np
 
+from .detectors import get_face_cascade, timed
+from .document import DocumentImage
+from .ela import ELAResult
+from .qr import QRResult, detect_qr
+
+
+MANIFEST_NAME = "rois.json"
+
+# Face detection runs on a working copy whose longer side is capped here.
+FACE_DETECT_MAX_SIDE = int(os.getenv("FACE_DETECT_MAX_SIDE", "1024"))
+# Face side as a fraction of the card's shorter side (search-space pruning).
+FACE_MIN_FRACTION = float(os.getenv("FACE_MIN_FRACTION", "0.08"))
+FACE_MAX_FRACTION = float(os.getenv("FACE_MAX_FRACTION", "0.6"))
+# Text boxes closer than this many pixels are merged into one block.
+TEXT_MERGE_PAD = int(os.getenv("TEXT_MERGE_PAD", "8"))
+# Max ROIs per kind sent to the CNNs (negative = unlimited).
+ROI_BUDGETS: Dict[str, int] = {
+    "face": int(os.getenv("ROI_BUDGET_FACE", "2")),
+    "qr": int(os.getenv("ROI_BUDGET_QR", "1")),
+    "text": int(os.getenv("ROI_BUDGET_TEXT", "8")),
+}
+
 
 @dataclass
 class ROIResult:
     kind: str
     bbox: Tuple[int, int, int, int]  # x, y, w, h
-    path: str
+    path: str  # where the crop is (or will be) persisted
+    # Zero-copy BGR view into the source image; crops are only written to
+    # ``path`` when persist() is called.
+    crop: Optional[np.ndarray] = field(default=None, repr=False, compare=False)
+    persisted: bool = False
 
+    @property
+    def document(self) -> DocumentImage:
+        return DocumentImage(self.crop, path=self.path)
 
-def _save_crop(image: np.ndarray, bbox: Tuple[int, int, int, int], path: Path) -> str:
-    x, y, w, h = bbox
-    crop = image[y : y + h, x : x + w]
+    def persist(self) -> str:
+        if not self.persisted and self.crop is not None:
+            _write_crop(self.crop, Path(self.path))
+            self.persisted = True
+        return self.path
+
+
+def _write_crop(crop: np.ndarray, path: Path) -> str:
     path.parent.mkdir(parents=True, exist_ok=True)
     cv2.imwrite(str(path), crop)
     return str(path)
 
 
-def detect_face_rois(image: np.ndarray, base_dir: Path) -> List[ROIResult]:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    face_cascade = cv2.CascadeClassifier(
-        str(Path(cv2.data.haarcascades) / "haarcascade_frontalface_default.xml")
+def _make_roi(image: np.ndarray, kind: str, bbox, path: Path) -> ROIResult:
+    x, y, w, h = (int(v) for v in bbox)
+    return ROIResult(
+        kind=kind, bbox=(x, y, w, h), path=str(path), crop=image[y : y + h, x : x + w]
     )
-    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+
+
+def persist_rois(rois: List[ROIResult]) -> List[str]:
+    """Write any not-yet-persisted crops to disk (safe to run in the background)."""
+    return [roi.persist() for roi in rois]
+
+
+def write_roi_manifest(rois: List[ROIResult], output_dir: Union[str, Path]) -> str:
+    """
+    Record kind/bbox/path of each ROI so a crop can be materialised later
+    from the source image without re-running detection.
+    """
+    entries = [{"kind": r.kind, "bbox": list(r.bbox), "path": r.path} for r in rois]
+    return write_manifest_entries(entries, output_dir)
+
+
+def write_manifest_entries(entries: List[Dict], output_dir: Union[str, Path]) -> str:
+    manifest = Path(output_dir) / MANIFEST_NAME
+    manifest.parent.mkdir(parents=True, exist_ok=True)
+    manifest.write_text(json.dumps(entries))
+    return str(manifest)
+
+
+def read_roi_manifest(output_dir: Union[str, Path]) -> List[Dict]:
+    manifest = Path(output_dir) / MANIFEST_NAME
+    if not manifest.exists():
+        return []
+    return json.loads(manifest.read_text())
+
+
+def materialize_crop(image: Union[str, DocumentImage], entry: Dict) -> str:
+    """Persist the crop described by a manifest entry if it is not on disk yet."""
+    path = Path(entry["path"])
+    if not path.exists():
+        doc = DocumentImage.coerce(image)
+        _write_crop(doc.crop(tuple(entry["bbox"])), path)
+    return str(path)
+
+
+def _face_size_bounds(working_shape: Tuple[int, int]) -> Tuple[int, int]:
+    """
+    Min/max face side in working-image pixels. The Aadhaar photo occupies a
+    roughly fixed fraction of the card, so faces far outside that band are
+    not worth scanning for.
+    """
+    short_side = min(working_shape[:2])
+    min_side = max(24, int(short_side * FACE_MIN_FRACTION))  # 24px = cascade window
+    max_side = max(min_side + 1, int(short_side * FACE_MAX_FRACTION))
+    return min_side, max_side
+
+
+def detect_face_rois(
+    image: np.ndarray,
+    base_dir: Path,
+    gray: Optional[np.ndarray] = None,
+    max_side: int = FACE_DETECT_MAX_SIDE,
+) -> List[ROIResult]:
+    """
+    Run the Haar cascade on a grayscale copy downscaled so its longer side
+    is at most ``max_side`` (0 disables downscaling); boxes are mapped back
+    to full resolution for cropping.
+    """
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    height, width = gray.shape[:2]
+    scale = 1.0
+    working = gray
+    if max_side and max(height, width) > max_side:
+        scale = max_side / float(max(height, width))
+        working = cv2.resize(
+            gray,
+            (max(1, round(width * scale)), max(1, round(height * scale))),
+            interpolation=cv2.INTER_AREA,
+        )
+
+    min_side, max_face = _face_size_bounds(working.shape)
+    face_cascade = get_face_cascade()
+    with timed("face_detect"):
+        faces = face_cascade.detectMultiScale(
+            working,
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=(min_side, min_side),
+            maxSize=(max_face, max_face),
+        )
+
     results: List[ROIResult] = []
     for i, (x, y, w, h) in enumerate(faces):
-        path = base_dir / f"face_{i}.jpg"
-        saved = _save_crop(image, (x, y, w, h), path)
-        results.append(ROIResult(kind="face", bbox=(x, y, w, h), path=saved))
+        x0, y0 = int(x / scale), int(y / scale)
+        x1, y1 = min(width, int(round((x + w) / scale))), min(height, int(round((y + h) / scale)))
+        results.append(
+            _make_roi(image, "face", (x0, y0, x1 - x0, y1 - y0), base_dir / f"face_{i}.jpg")
+        )
     return results
 
 
-def detect_text_block_rois(image: np.ndarray, base_dir: Path) -> List[ROIResult]:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+def merge_boxes(
+    boxes: List[Tuple[int, int, int, int]], pad: int = TEXT_MERGE_PAD
+) -> List[Tuple[int, int, int, int]]:
+    """
+    Union-find merge of (x, y, w, h) boxes that overlap once each is grown
+    by ``pad`` pixels; every connected group becomes its bounding box.
+    """
+    if len(boxes) < 2:
+        return list(boxes)
+    arr = np.asarray(boxes, dtype=np.int64)
+    x0, y0 = arr[:, 0] - pad, arr[:, 1] - pad
+    x1, y1 = arr[:, 0] + arr[:, 2] + pad, arr[:, 1] + arr[:, 3] + pad
+    # Pairwise overlap of the padded boxes in one vectorized pass
+    touch = (
+        (x0[:, None] < x1[None, :])
+        & (x0[None, :] < x1[:, None])
+        & (y0[:, None] < y1[None, :])
+        & (y0[None, :] < y1[:, None])
+    )
+
+    parent = list(range(len(boxes)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, j in zip(*np.nonzero(np.triu(touch, k=1))):
+        ri, rj = find(int(i)), find(int(j))
+        if ri != rj:
+            parent[rj] = ri
+
+    groups: Dict[int, List[int]] = {}
+    for i in range(len(boxes)):
+        groups.setdefault(find(i), []).append(i)
+
+    merged = []
+    for members in groups.values():
+        g = arr[members]
+        gx0, gy0 = int(g[:, 0].min()), int(g[:, 1].min())
+        gx1, gy1 = int((g[:, 0] + g[:, 2]).max()), int((g[:, 1] + g[:, 3]).max())
+        merged.append((gx0, gy0, gx1 - gx0, gy1 - gy0))
+    return merged
+
+
+def detect_text_boxes(
+    image: np.ndarray, gray: Optional[np.ndarray] = None
+) -> List[Tuple[int, int, int, int]]:
+    """Raw (x, y, w, h) text-block candidates, before merging."""
+    if gray is None:
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     blur = cv2.GaussianBlur(gray, (5, 5), 0)
     _, thresh = cv2.threshold(blur, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
     thresh = 255 - thresh
@@ -48,47 +222,129 @@ def detect_text_block_rois(image: np.ndarray, base_dir: Path) -> List[ROIResult]
         dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE
     )
 
-    results: List[ROIResult] = []
-    for i, c in enumerate(contours):
+    boxes: List[Tuple[int, int, int, int]] = []
+    for c in contours:
         x, y, w, h = cv2.boundingRect(c)
         if w * h < 500:
             continue
         aspect = w / float(h)
         if aspect < 1.5:
             continue
-        path = base_dir / f"text_{i}.jpg"
-        saved = _save_crop(image, (x, y, w, h), path)
-        results.append(ROIResult(kind="text", bbox=(x, y, w, h), path=saved))
-    return results
+        boxes.append((x, y, w, h))
+    return boxes
+
+
+def text_block_rois(
+    image: np.ndarray, base_dir: Path, boxes: List[Tuple[int, int, int, int]]
+) -> List[ROIResult]:
+    return [
+        _make_roi(image, "text", box, base_dir / f"text_{i}.jpg")
+        for i, box in enumerate(merge_boxes(boxes))
+    ]
 
 
-def detect_qr_rois(image: np.ndarray, base_dir: Path) -> List[ROIResult]:
-    detector = cv2.QRCodeDetector()
-    data, points, _ = detector.detectAndDecode(image)
+def detect_text_block_rois(
+    image: np.ndarray, base_dir: Path, gray: Optional[np.ndarray] = None
+) -> List[ROIResult]:
+    return text_block_rois(image, base_dir, detect_text_boxes(image, gray))
+
+
+def rank_rois(rois: List[ROIResult], ela: Optional[ELAResult] = None) -> List[ROIResult]:
+    """
+    Order ROIs by area weighted by ELA energy relative to the image mean,
+    so large and suspicious regions are evaluated first.
+    """
+    if ela is None:
+        return sorted(rois, key=lambda r: r.bbox[2] * r.bbox[3], reverse=True)
+    mean_energy = float(ela.energy.mean()) or 1.0
+
+    def score(roi: ROIResult) -> float:
+        area = roi.bbox[2] * roi.bbox[3]
+        return area * (1.0 + ela.bbox_energy(roi.bbox) / mean_energy)
+
+    return sorted(rois, key=score, reverse=True)
+
+
+def select_rois(
+    rois: List[ROIResult],
+    budgets: Optional[Dict[str, int]] = None,
+    ela: Optional[ELAResult] = None,
+) -> List[ROIResult]:
+    """Keep the top-ranked ROIs of each kind within its budget, preserving kind order."""
+    budgets = ROI_BUDGETS if budgets is None else budgets
+    selected: List[ROIResult] = []
+    for kind in dict.fromkeys(r.kind for r in rois):
+        ranked = rank_rois([r for r in rois if r.kind == kind], ela)
+        limit = budgets.get(kind, -1)
+        selected.extend(ranked if limit < 0 else ranked[:limit])
+    return selected
+
+
+def detect_qr_rois(
+    image: np.ndarray, base_dir: Path, qr: Optional[QRResult] = None
+) -> List[ROIResult]:
+    """QR crop from a precomputed QRResult, or a fresh detect_qr pass."""
+    if qr is None:
+        qr = detect_qr(image)
     results: List[ROIResult] = []
-    if points is not None and len(points) > 0:
-        pts = points[0].astype(int)
-        x, y, w, h = cv2.boundingRect(pts)
-        path = base_dir / "qr_0.jpg"
-        saved = _save_crop(image, (x, y, w, h), path)
-        results.append(ROIResult(kind="qr", bbox=(x, y, w, h), path=saved))
+    if qr.found:
+        results.append(_make_roi(image, "qr", qr.bbox, base_dir / "qr_0.jpg"))
     return results
 
 
-def detect_all_rois(image_path: str, output_dir: str) -> List[ROIResult]:
+def detect_and_select_rois(
+    image: Union[str, DocumentImage],
+    output_dir: str,
+    persist: bool = False,
+    qr: Optional[QRResult] = None,
+    ela: Optional[ELAResult] = None,
+    budgets: Optional[Dict[str, int]] = None,
+) -> Tuple[List[ROIResult], int]:
     """
-    Detect ROIs (face, QR, text blocks) and save crops.
+    Detect ROIs (face, QR, text blocks), merge overlapping text boxes, and
+    keep the best-ranked ROIs of each kind within its budget.
+
+    Crops are kept in memory as views into the source image; they are
+    written to disk only when ``persist`` is set (or later via
+    persist_rois / materialize_crop). A small manifest is always written so
+    crops can be materialised on demand. Pass the QRResult from the QR
+    stage as ``qr`` to reuse its bbox instead of detecting again, and the
+    ELAResult as ``ela`` to rank by ELA energy.
+
+    Returns (selected ROIs, number of raw detections, counting each text
+    box before merging).
     """
-    img = cv2.imread(image_path)
-    if img is None:
-        raise ValueError(f"Failed to read image at {image_path}")
+    doc = DocumentImage.coerce(image)
+    img = doc.bgr
 
     base_dir = Path(output_dir)
     base_dir.mkdir(parents=True, exist_ok=True)
 
     rois: List[ROIResult] = []
-    rois.extend(detect_face_rois(img, base_dir / "faces"))
-    rois.extend(detect_qr_rois(img, base_dir / "qr"))
-    rois.extend(detect_text_block_rois(img, base_dir / "text"))
-    return rois
+    rois.extend(detect_face_rois(img, base_dir / "faces", gray=doc.gray))
+    rois.extend(detect_qr_rois(img, base_dir / "qr", qr=qr))
+    text_boxes = detect_text_boxes(img, gray=doc.gray)
+    detected = len(rois) + len(text_boxes)
+    rois.extend(text_block_rois(img, base_dir / "text", text_boxes))
+
+    rois = select_rois(rois, budgets, ela)
+
+    write_roi_manifest(rois, base_dir)
+    if persist:
+        persist_rois(rois)
+    return rois, detected
+
 
+def detect_all_rois(
+    image: Union[str, DocumentImage],
+    output_dir: str,
+    persist: bool = False,
+    qr: Optional[QRResult] = None,
+    ela: Optional[ELAResult] = None,
+    budgets: Optional[Dict[str, int]] = None,
+) -> List[ROIResult]:
+    """
+    Detect ROIs (face, QR, text blocks); see detect_and_select_rois.
+    """
+    rois, _ = detect_and_select_rois(image, output_dir, persist, qr, ela, budgets)
+    return rois
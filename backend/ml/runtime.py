@@ -0,0 +1,168 @@
+"""
+CPU runtime profiles for the eager serving models.
+
+A profile sets the memory format of the models and their inputs
+(channels-last lets oneDNN pick its blocked convolution kernels without
+per-layer reorders) and optionally autocasts to bf16 on CPUs with native
+bf16 support (AVX512-BF16 / AMX). Scoring forwards always run under
+``torch.inference_mode``; the Grad-CAM forward keeps autograd but uses the
+same memory format and autocast.
+
+``INFERENCE_RUNTIME_PROFILE=auto`` benchmarks every supported profile at
+warm-up and keeps the fastest one whose probabilities and heatmaps stay
+within tolerance of fp32. Intra-/inter-op thread counts are process-wide
+and set once when the pipeline is built.
+"""
+import contextlib
+import os
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+
+INFERENCE_RUNTIME_PROFILE = os.getenv("INFERENCE_RUNTIME_PROFILE", "auto").lower()
+# 0 keeps PyTorch's default (one thread per physical core)
+INFERENCE_THREADS = int(os.getenv("INFERENCE_THREADS", "0"))
+INFERENCE_INTEROP_THREADS = int(os.getenv("INFERENCE_INTEROP_THREADS", "0"))
+# Max |probability| / |heatmap| difference vs fp32 for auto selection
+PROFILE_TOLERANCE = float(os.getenv("INFERENCE_PROFILE_TOLERANCE", "0.01"))
+PROFILE_HEATMAP_TOLERANCE = float(os.getenv("INFERENCE_PROFILE_HEATMAP_TOLERANCE", "0.05"))
+PROFILE_BENCH_ITERATIONS = int(os.getenv("INFERENCE_PROFILE_BENCH_ITERATIONS", "3"))
+
+
+@dataclass(frozen=True)
+class RuntimeProfile:
+    name: str
+    channels_last: bool = False
+    bf16: bool = False
+
+    @property
+    def memory_format(self) -> torch.memory_format:
+        return torch.channels_last if self.channels_last else torch.contiguous_format
+
+    def prepare(self, batch: torch.Tensor) -> torch.Tensor:
+        return batch.contiguous(memory_format=self.memory_format)
+
+    def autocast(self, device_type: str):
+        if not self.bf16:
+            return contextlib.nullcontext()
+        return torch.autocast(device_type, dtype=torch.bfloat16)
+
+    @contextlib.contextmanager
+    def scoring(self, device_type: str) -> Iterator[None]:
+        """No-autograd forward context for logits-only scoring."""
+        with torch.inference_mode(), self.autocast(device_type):
+            yield
+
+    def apply(self, models: List[torch.nn.Module]) -> None:
+        for model in models:
+            model.to(memory_format=self.memory_format)
+
+
+PROFILES: Dict[str, RuntimeProfile] = {
+    profile.name: profile
+    for profile in (
+        RuntimeProfile("fp32"),
+        RuntimeProfile("channels_last", channels_last=True),
+        RuntimeProfile("bf16", bf16=True),
+        RuntimeProfile("channels_last_bf16", channels_last=True, bf16=True),
+    )
+}
+FP32 = PROFILES["fp32"]
+
+
+def bf16_supported(device: torch.device) -> bool:
+    if device.type == "cuda":
+        return torch.cuda.is_bf16_supported()
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configure_threads(
+    intra_op: int = INFERENCE_THREADS, inter_op: int = INFERENCE_INTEROP_THREADS
+) -> None:
+    if intra_op > 0:
+        torch.set_num_threads(intra_op)
+    if inter_op > 0:
+        try:
+            torch.set_num_interop_threads(inter_op)
+        except RuntimeError:
+            # Only settable before the first inter-op parallel work
+            print("[RUNTIME] Inter-op threads already initialised; INFERENCE_INTEROP_THREADS ignored")
+
+
+def candidate_profiles(device: torch.device) -> List[RuntimeProfile]:
+    return [p for p in PROFILES.values() if not p.bf16 or bf16_supported(device)]
+
+
+def resolve_profile(name: str, device: torch.device) -> Optional[RuntimeProfile]:
+    """The named profile, or None for ``auto`` (choose by benchmark)."""
+    if name == "auto":
+        return None
+    profile = PROFILES.get(name)
+    if profile is None:
+        print(f"[RUNTIME] Unknown INFERENCE_RUNTIME_PROFILE={name!r}; using fp32")
+        return FP32
+    if profile.bf16 and not bf16_supported(device):
+        print(f"[RUNTIME] {name} needs bf16 support this device lacks; using fp32")
+        return FP32
+    return profile
+
+
+# forward(profile, batch) -> (densenet logits, mobilenet logits, heatmaps)
+ForwardFn = Callable[[RuntimeProfile, torch.Tensor], Tuple[List[float], List[float], np.ndarray]]
+
+
+def select_profile(
+    forward: ForwardFn,
+    apply: Callable[[RuntimeProfile], None],
+    batch: torch.Tensor,
+    candidates: List[RuntimeProfile],
+    tolerance: float = PROFILE_TOLERANCE,
+    heatmap_tolerance: float = PROFILE_HEATMAP_TOLERANCE,
+    iterations: int = PROFILE_BENCH_ITERATIONS,
+) -> Tuple[RuntimeProfile, Dict[str, Dict[str, float]]]:
+    """
+    Time ``forward`` under each candidate profile and return the fastest one
+    that stays within tolerance of fp32, plus the per-profile results.
+    """
+    reference = None
+    results: Dict[str, Dict[str, float]] = {}
+    best, best_ms = FP32, float("inf")
+    for profile in [FP32] + [p for p in candidates if p != FP32]:
+        apply(profile)
+        try:
+            dn, mb, cams = forward(profile, batch)  # warm-up + outputs
+            start = time.perf_counter()
+            for _ in range(max(1, iterations)):
+                forward(profile, batch)
+            ms = (time.perf_counter() - start) * 1000.0 / max(1, iterations)
+        except Exception as e:
+            print(f"[RUNTIME] Profile {profile.name} failed: {e}")
+            continue
+
+        probs = torch.sigmoid(torch.tensor([dn, mb], dtype=torch.float32))
+        if reference is None:
+            reference = (probs, cams)
+        prob_diff = float((probs - reference[0]).abs().max())
+        heatmap_diff = float(np.abs(cams - reference[1]).max())
+        ok = prob_diff <= tolerance and heatmap_diff <= heatmap_tolerance
+        results[profile.name] = {
+            "ms": ms,
+            "probDiff": prob_diff,
+            "heatmapDiff": heatmap_diff,
+            "withinTolerance": ok,
+        }
+        print(
+            f"[RUNTIME] {profile.name}: {ms:.1f} ms/batch, prob diff {prob_diff:.2e}, "
+            f"heatmap diff {heatmap_diff:.2e}{'' if ok else ' (out of tolerance)'}"
+        )
+        if ok and ms < best_ms:
+            best, best_ms = profile, ms
+    apply(best)
+    return best, results
@@ -24,21 +24,44 @@ Labels:
 
 import os
 from pathlib import Path
-from typing import Tuple
+from typing import Optional, Tuple
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
+from PIL import Image
 from torch.utils.data import DataLoader
 from torchvision import datasets, transforms
 
 from .densenet import DenseNet121Binary
+from .inference import fit_input, normalize_input
 from .mobilenet import MobileNetV2Binary
 
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
 
+class FitInput:
+    """
+    PIL image -> PIL image at the serving input size, resized exactly as
+    ``ml.inference.fit_input`` does for inference and calibration.
+    """
+
+    def __init__(self, kind: str = "full"):
+        self.kind = kind
+
+    def __call__(self, image: Image.Image) -> Image.Image:
+        return Image.fromarray(fit_input(np.asarray(image.convert("RGB")), self.kind))
+
+
+class NormalizeInput:
+    """PIL image -> normalised (3, S, S) tensor (``ml.inference.normalize_input``)."""
+
+    def __call__(self, image: Image.Image) -> torch.Tensor:
+        return torch.from_numpy(normalize_input(np.asarray(image)))
+
+
 def build_dataloaders(
     data_dir: str, batch_size: int = 16
 ) -> Tuple[DataLoader, DataLoader]:
@@ -47,27 +70,14 @@ def build_dataloaders(
 
     transform_train = transforms.Compose(
         [
-            transforms.Resize((384, 384)),
+            FitInput("full"),
             transforms.RandomHorizontalFlip(),
             transforms.ColorJitter(brightness=0.2, contrast=0.2),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
+            NormalizeInput(),
         ]
     )
 
-    transform_val = transforms.Compose(
-        [
-            transforms.Resize((384, 384)),
-            transforms.ToTensor(),
-            transforms.Normalize(
-                mean=[0.485, 0.456, 0.406],
-                std=[0.229, 0.224, 0.225],
-            ),
-        ]
-    )
+    transform_val = transforms.Compose([FitInput("full"), NormalizeInput()])
 
     train_ds = datasets.ImageFolder(train_dir, transform=transform_train)
     val_ds = datasets.ImageFolder(val_dir, transform=transform_val)
@@ -77,6 +87,38 @@ def build_dataloaders(
     return train_loader, val_loader
 
 
+def evaluate_model(
+    model: nn.Module, loader: DataLoader, eval_device: Optional[torch.device] = None
+) -> Tuple[float, float, float, float]:
+    """Accuracy, precision, recall and F1 at a 0.5 threshold."""
+    eval_device = eval_device or device
+    model.eval()
+    tp = fp = fn = tn = 0
+    with torch.no_grad():
+        for images, labels in loader:
+            images = images.to(eval_device)
+            labels = labels.float().to(eval_device)
+            logits = model(images)
+            probs = torch.sigmoid(logits)
+            preds = (probs > 0.5).float()
+
+            tp += ((preds == 1) & (labels == 1)).sum().item()
+            tn += ((preds == 0) & (labels == 0)).sum().item()
+            fp += ((preds == 1) & (labels == 0)).sum().item()
+            fn += ((preds == 0) & (labels == 1)).sum().item()
+
+    total = tp + tn + fp + fn
+    acc = (tp + tn) / total if total > 0 else 0
+    precision = tp / (tp + fp) if (tp + fp) > 0 else 0
+    recall = tp / (tp + fn) if (tp + fn) > 0 else 0
+    f1 = (
+        2 * precision * recall / (precision + recall)
+        if (precision + recall) > 0
+        else 0
+    )
+    return acc, precision, recall, f1
+
+
 def train_one_model(
     model: nn.Module,
     train_loader: DataLoader,
@@ -106,30 +148,7 @@ def train_one_model(
             optimizer.step()
 
         # Validation
-        model.eval()
-        tp = fp = fn = tn = 0
-        with torch.no_grad():
-            for images, labels in val_loader:
-                images = images.to(device)
-                labels = labels.float().to(device)
-                logits = model(images)
-                probs = torch.sigmoid(logits)
-                preds = (probs > 0.5).float()
-
-                tp += ((preds == 1) & (labels == 1)).sum().item()
-                tn += ((preds == 0) & (labels == 0)).sum().item()
-                fp += ((preds == 1) & (labels == 0)).sum().item()
-                fn += ((preds == 0) & (labels == 1)).sum().item()
-
-        total = tp + tn + fp + fn
-        acc = (tp + tn) / total if total > 0 else 0
-        precision = tp / (tp + fp) if (tp + fp) > 0 else 0
-        recall = tp / (tp + fn) if (tp + fn) > 0 else 0
-        f1 = (
-            2 * precision * recall / (precision + recall)
-            if (precision + recall) > 0
-            else 0
-        )
+        acc, precision, recall, f1 = evaluate_model(model, val_loader)
 
         if acc > best_val_acc:
             best_val_acc = acc
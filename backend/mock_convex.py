@@ -12,7 +12,7 @@ class MockConvexClient:
         self.api_key = api_key or os.getenv("CONVEX_API_KEY")
         print(f"[MOCK CONVEX] Using mock backend (real URL: {self.deployment_url})")
     
-    async def query(self, path: str, args: Dict[str, Any]) -> Any:
+    async def query(self, path: str, args: Dict[str, Any], timeout: Optional[float] = None) -> Any:
         """Mock query - returns test data."""
         print(f"[MOCK CONVEX] query({path}, {args})")
         
@@ -35,9 +35,12 @@ class MockConvexClient:
                 "isAdmin": False,
             }
         
+        if "getUploadsByIds" in path:
+            return [None for _ in args.get("uploadIds", [])]
+        
         return {"result": "ok"}
     
-    async def mutation(self, path: str, args: Dict[str, Any]) -> Any:
+    async def mutation(self, path: str, args: Dict[str, Any], timeout: Optional[float] = None) -> Any:
         """Mock mutation - returns test data."""
         print(f"[MOCK CONVEX] mutation({path}, {args})")
         
@@ -56,9 +59,18 @@ class MockConvexClient:
                 "userId": args.get("userId"),
                 "imagePath": args.get("imagePath"),
                 "createdAt": args.get("createdAt"),
+                "contentHash": args.get("contentHash"),
                 "_creationTime": 1234567890,
             }
         
+        if "createPredictionsBatch" in path:
+            predictions = args.get("predictions", [])
+            return {
+                "inserted": len(predictions),
+                "skipped": 0,
+                "ids": [f"prediction_{uuid.uuid4().hex[:8]}" for _ in predictions],
+            }
+        
         if "createPrediction" in path:
             return {
                 "_id": f"prediction_{uuid.uuid4().hex[:8]}",
@@ -74,3 +86,6 @@ class MockConvexClient:
             }
         
         return {"_id": f"result_{uuid.uuid4().hex[:8]}", "success": True}
+
+    async def aclose(self) -> None:
+        return None
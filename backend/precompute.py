@@ -0,0 +1,203 @@
+"""
+Speculative analysis of uploads before the prediction is requested.
+
+With ``PRECOMPUTE_ON_UPLOAD=true`` the upload route queues the stored image
+here, and a small pool of background workers runs the full analysis while
+the client is still making its ``POST /predictions/`` call. The prediction
+route then attaches to the running job (or picks the finished payload out
+of the prediction cache) instead of starting over.
+
+Jobs are keyed like the prediction cache (content hash, model version,
+pipeline config), so duplicate uploads of the same bytes share one job. The
+queue is bounded and the worker count small: a burst of uploads drops
+speculative work rather than crowding out live predictions on the stage
+executors, and a prediction that arrives while its job is still waiting in
+the queue claims it and runs in the foreground.
+"""
+import asyncio
+import os
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from analysis import ROI_PERSIST_MODE, analyze_upload, pipeline_config
+from executors import get_executors
+from ml.registry import get_registry
+from ml.roi import persist_rois
+from prediction_cache import PredictionCache, get_prediction_cache
+
+
+PRECOMPUTE_ON_UPLOAD = os.getenv("PRECOMPUTE_ON_UPLOAD", "false").lower() == "true"
+PRECOMPUTE_QUEUE_SIZE = int(os.getenv("PRECOMPUTE_QUEUE_SIZE", "16"))
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", "1"))
+# Finished payloads kept for attachment when the prediction cache is off
+PRECOMPUTE_RESULTS = int(os.getenv("PRECOMPUTE_RESULTS", "256"))
+
+
+def analysis_key(content_hash: str) -> Optional[str]:
+    """Cache / job key for an image, or None until models are warmed up."""
+    registry = get_registry()
+    if registry is None or not registry.ready:
+        return None
+    return PredictionCache.key(
+        content_hash, registry.model_version, pipeline_config(registry.pipeline)
+    )
+
+
+class _Job:
+    def __init__(self, upload_id: str, image_path: str):
+        self.upload_id = upload_id
+        self.image_path = image_path
+        self.state = "queued"  # queued | running | done | claimed
+        self.future: "asyncio.Future[Dict[str, Any]]" = (
+            asyncio.get_running_loop().create_future()
+        )
+
+
+class Precomputer:
+    def __init__(
+        self,
+        queue_size: int = PRECOMPUTE_QUEUE_SIZE,
+        workers: int = PRECOMPUTE_WORKERS,
+        max_results: int = PRECOMPUTE_RESULTS,
+    ):
+        self.workers = max(1, workers)
+        self.max_results = max(0, max_results)
+        self._queue: "asyncio.Queue[Tuple[str, _Job]]" = asyncio.Queue(maxsize=max(1, queue_size))
+        self._jobs: "OrderedDict[str, _Job]" = OrderedDict()
+        self._tasks = []
+
+        self.submitted = 0
+        self.dropped = 0
+        self.completed = 0
+        self.failed = 0
+        self.attached = 0
+        self.claimed = 0
+
+    def start(self) -> None:
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in self._jobs.values():
+            if not job.future.done():
+                job.future.cancel()
+
+    def submit(self, upload_id: str, image_path: str, content_hash: str) -> bool:
+        """Queue speculative analysis; returns False if skipped or dropped."""
+        registry = get_registry()
+        if registry is None or not registry.ready:
+            return False
+        key = analysis_key(content_hash)
+        cache = get_prediction_cache()
+        if key in self._jobs or (cache is not None and cache.contains(key)):
+            return False
+
+        job = _Job(upload_id, image_path)
+        try:
+            self._queue.put_nowait((key, job))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self._jobs[key] = job
+        self.submitted += 1
+        return True
+
+    def attach(self, key: str) -> "Optional[asyncio.Future[Dict[str, Any]]]":
+        """
+        Return the future of a running or finished job for ``key``.
+
+        A job still waiting in the queue is claimed instead: the worker will
+        skip it and the caller computes the result in the foreground.
+        """
+        job = self._jobs.get(key)
+        if job is None:
+            return None
+        if job.state == "queued":
+            job.state = "claimed"
+            del self._jobs[key]
+            self.claimed += 1
+            return None
+        if job.future.cancelled():
+            return None
+        self.attached += 1
+        return job.future
+
+    def _finish(self, key: str) -> None:
+        # With the prediction cache on, the payload is served from there;
+        # otherwise keep a bounded number of finished jobs to attach to.
+        if get_prediction_cache() is not None:
+            self._jobs.pop(key, None)
+            return
+        finished = [k for k, j in self._jobs.items() if j.state == "done"]
+        for k in finished[: max(0, len(finished) - self.max_results)]:
+            del self._jobs[k]
+
+    async def _worker(self) -> None:
+        while True:
+            key, job = await self._queue.get()
+            if job.state == "claimed":
+                continue
+            job.state = "running"
+            try:
+                registry = get_registry()
+                analysis = await analyze_upload(job.upload_id, job.image_path, registry.pipeline)
+                if ROI_PERSIST_MODE == "background":
+                    await get_executors().run("roi", persist_rois, analysis.rois)
+                payload = analysis.payload()
+                cache = get_prediction_cache()
+                if cache is not None:
+                    await cache.aput(key, payload)
+                job.future.set_result(payload)
+                self.completed += 1
+            except asyncio.CancelledError:
+                job.future.cancel()
+                raise
+            except Exception as e:
+                print(f"[PRECOMPUTE] Analysis of upload {job.upload_id} failed: {e}")
+                job.future.set_exception(e)
+                job.future.exception()  # waiters fall back to a live run
+                self.failed += 1
+                self._jobs.pop(key, None)
+                continue
+            job.state = "done"
+            self._finish(key)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "running": sum(1 for j in self._jobs.values() if j.state == "running"),
+            "submitted": self.submitted,
+            "dropped": self.dropped,
+            "completed": self.completed,
+            "failed": self.failed,
+            "attached": self.attached,
+            "claimed": self.claimed,
+            "config": {"queueSize": self._queue.maxsize, "workers": self.workers},
+        }
+
+
+_precomputer: Optional[Precomputer] = None
+
+
+def init_precomputer() -> Optional[Precomputer]:
+    global _precomputer
+    if not PRECOMPUTE_ON_UPLOAD:
+        _precomputer = None
+        return None
+    _precomputer = Precomputer()
+    _precomputer.start()
+    return _precomputer
+
+
+async def stop_precomputer() -> None:
+    global _precomputer
+    if _precomputer is not None:
+        await _precomputer.stop()
+        _precomputer = None
+
+
+def get_precomputer() -> Optional[Precomputer]:
+    return _precomputer
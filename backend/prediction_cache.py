@@ -0,0 +1,195 @@
+"""
+Content-addressed prediction cache.
+
+Resubmitting the same Aadhaar image (a second upload of identical bytes, or
+calling /predictions/ twice on one upload) should not re-run ELA, ROI, QR and
+both CNNs. Results are keyed by (SHA-256 of the image bytes, model checkpoint
+version, pipeline config) and stored in two tiers:
+
+  - a bounded in-memory LRU (hot resubmissions within one worker)
+  - a JSON-file tier under ``<STORAGE_DIR>/cache`` shared across workers and
+    restarts, evicting least-recently-used files beyond a max entry count
+
+The disk tier's LRU order is kept in an in-process index (seeded from file
+mtimes at startup), so eviction is O(1) per insert instead of a directory
+scan. Entries written by other workers join the index when first read.
+Async callers use ``aget`` / ``aput``, which do the file I/O on the
+``cache`` executor stage.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from executors import get_executors
+
+
+CACHE_ENABLED = os.getenv("PREDICTION_CACHE_ENABLED", "true").lower() == "true"
+CACHE_MEMORY_ENTRIES = int(os.getenv("PREDICTION_CACHE_MEMORY_ENTRIES", "256"))
+CACHE_DISK_ENTRIES = int(os.getenv("PREDICTION_CACHE_DISK_ENTRIES", "10000"))
+
+_HASH_CHUNK = 1024 * 1024
+
+
+def sha256_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PredictionCache:
+    def __init__(
+        self,
+        cache_dir: str,
+        memory_entries: int = CACHE_MEMORY_ENTRIES,
+        disk_entries: int = CACHE_DISK_ENTRIES,
+    ):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.memory_entries = max(0, memory_entries)
+        self.disk_entries = max(0, disk_entries)
+
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Disk-tier LRU order (oldest first), keyed by cache key
+        self._disk: "OrderedDict[str, None]" = OrderedDict(
+            (key, None) for key in self._scan_disk()
+        )
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(content_hash: str, model_version: str, config: Dict[str, Any]) -> str:
+        material = json.dumps(
+            {"content": content_hash, "model": model_version, "config": config},
+            sort_keys=True,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+    def _scan_disk(self) -> List[str]:
+        files = []
+        for f in self.cache_dir.glob("*/*.json"):
+            try:
+                files.append((f.stat().st_mtime, f.stem))
+            except OSError:
+                continue
+        return [key for _, key in sorted(files)]
+
+    def _disk_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def _remember(self, key: str, value: Dict[str, Any]) -> None:
+        if self.memory_entries == 0:
+            return
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def contains(self, key: str) -> bool:
+        """Presence check that does not touch hit/miss counters or LRU order."""
+        with self._lock:
+            if key in self._memory or key in self._disk:
+                return True
+        return self._disk_path(key).exists()
+
+    def _get_memory(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            if key not in self._memory:
+                return None
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return dict(self._memory[key])
+
+    def _get_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._disk_path(key)
+        try:
+            value = json.loads(path.read_text())
+            os.utime(path)  # keeps the LRU order across restarts
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+
+        with self._lock:
+            self.disk_hits += 1
+            self._disk[key] = None
+            self._disk.move_to_end(key)
+            self._remember(key, value)
+        return dict(value)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_memory(key)
+        return value if value is not None else self._get_disk(key)
+
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self._get_memory(key)
+        if value is not None:
+            return value
+        return await get_executors().run("cache", self._get_disk, key)
+
+    def _put_disk(self, key: str, value: Dict[str, Any]) -> None:
+        path = self._disk_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(value))
+        os.replace(tmp, path)
+
+        evict = []
+        with self._lock:
+            self._disk[key] = None
+            self._disk.move_to_end(key)
+            while len(self._disk) > self.disk_entries:
+                evict.append(self._disk.popitem(last=False)[0])
+            self.evictions += len(evict)
+        for old in evict:
+            try:
+                self._disk_path(old).unlink()
+            except OSError:
+                continue  # already removed by another worker
+
+    def put(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._remember(key, dict(value))
+        if self.disk_entries > 0:
+            self._put_disk(key, value)
+
+    async def aput(self, key: str, value: Dict[str, Any]) -> None:
+        with self._lock:
+            self._remember(key, dict(value))
+        if self.disk_entries > 0:
+            await get_executors().run("cache", self._put_disk, key, value)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memoryEntries": len(self._memory),
+                "diskEntries": len(self._disk),
+                "memoryHits": self.memory_hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hitRate": ((self.memory_hits + self.disk_hits) / lookups) if lookups else 0.0,
+            }
+
+
+_cache: Optional[PredictionCache] = None
+
+
+def init_prediction_cache(storage_dir: str) -> Optional[PredictionCache]:
+    global _cache
+    _cache = PredictionCache(str(Path(storage_dir) / "cache")) if CACHE_ENABLED else None
+    return _cache
+
+
+def get_prediction_cache() -> Optional[PredictionCache]:
+    return _cache
@@ -0,0 +1,267 @@
+"""
+Write-behind persistence of prediction records to Convex.
+
+``/predictions/`` no longer waits on the Convex mutation: the record is
+appended to a local JSONL spool, queued, and a background task sends queued
+records in batches through ``predictions:createPredictionsBatch``.
+
+Delivery is at-least-once. Every record carries a ``clientId`` that the
+mutation uses to skip records it has already inserted, so retries after a
+timeout or a crash do not create duplicates. Records leave the spool only
+after Convex acknowledges them; whatever is still spooled at startup (from a
+crash, or a shutdown flush that ran out of time) is re-queued.
+
+A batch that still fails after ``PREDICTION_FLUSH_MAX_ATTEMPTS`` is split and
+its records are sent one by one, so a single bad record cannot hold up the
+queue. Records that fail on their own are moved to a dead-letter spool
+(``predictions.dead.jsonl`` next to the spool) for inspection and replay.
+"""
+import asyncio
+import json
+import os
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from convex_client import init_convex_client
+
+
+WRITE_BEHIND_ENABLED = os.getenv("PREDICTION_WRITE_BEHIND", "true").lower() == "true"
+FLUSH_BATCH_SIZE = int(os.getenv("PREDICTION_FLUSH_BATCH_SIZE", "50"))
+FLUSH_INTERVAL_MS = float(os.getenv("PREDICTION_FLUSH_INTERVAL_MS", "200"))
+SPOOL_FSYNC = os.getenv("PREDICTION_SPOOL_FSYNC", "true").lower() == "true"
+SHUTDOWN_FLUSH_SECONDS = float(os.getenv("PREDICTION_SHUTDOWN_FLUSH_SECONDS", "10"))
+FLUSH_MAX_ATTEMPTS = int(os.getenv("PREDICTION_FLUSH_MAX_ATTEMPTS", "5"))
+
+BATCH_MUTATION = "predictions:createPredictionsBatch"
+_MAX_BACKOFF_SECONDS = 30.0
+
+
+class PredictionWriter:
+    def __init__(
+        self,
+        spool_path: str,
+        batch_size: int = FLUSH_BATCH_SIZE,
+        flush_interval_ms: float = FLUSH_INTERVAL_MS,
+        fsync: bool = SPOOL_FSYNC,
+        max_attempts: int = FLUSH_MAX_ATTEMPTS,
+    ):
+        self.spool_path = Path(spool_path)
+        self.spool_path.parent.mkdir(parents=True, exist_ok=True)
+        self.dead_letter_path = self.spool_path.with_name(f"{self.spool_path.stem}.dead.jsonl")
+        self.max_attempts = max(1, max_attempts)
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0.0, flush_interval_ms) / 1000.0
+        self.fsync = fsync
+
+        self._pending: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._queue: "asyncio.Queue[str]" = asyncio.Queue()
+        self._spool_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+        self.enqueued = 0
+        self.recovered = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.dead_lettered = 0
+        self.last_error: Optional[str] = None
+
+    # -- spool -----------------------------------------------------------
+
+    def _append(self, record: Dict[str, Any], path: Optional[Path] = None) -> None:
+        with open(path or self.spool_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+
+    def _rewrite(self, records: List[Dict[str, Any]]) -> None:
+        tmp = self.spool_path.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp, self.spool_path)
+
+    def _read_spool(self) -> List[Dict[str, Any]]:
+        if not self.spool_path.exists():
+            return []
+        records = []
+        with open(self.spool_path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # Torn final line from a crash mid-append
+                    continue
+        return records
+
+    # -- lifecycle -------------------------------------------------------
+
+    async def start(self) -> None:
+        for record in await asyncio.to_thread(self._read_spool):
+            client_id = record.get("clientId")
+            if client_id and client_id not in self._pending:
+                self._pending[client_id] = record
+                self._queue.put_nowait(client_id)
+                self.recovered += 1
+        if self.recovered:
+            print(f"[PREDICTIONS] Re-queued {self.recovered} spooled prediction(s)")
+        self._task = asyncio.create_task(self._run())
+
+    async def close(self, timeout: float = SHUTDOWN_FLUSH_SECONDS) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        # Final best-effort flush; anything left stays spooled for next start.
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+        except Exception as e:
+            print(f"[PREDICTIONS] Shutdown flush incomplete ({len(self._pending)} spooled): {e}")
+
+    # -- queueing --------------------------------------------------------
+
+    async def enqueue(self, record: Dict[str, Any]) -> str:
+        """Durably spool one prediction record and queue it for delivery."""
+        record = dict(record)
+        client_id = record.setdefault("clientId", uuid.uuid4().hex)
+        async with self._spool_lock:
+            await asyncio.to_thread(self._append, record)
+            self._pending[client_id] = record
+        self._queue.put_nowait(client_id)
+        self.enqueued += 1
+        return client_id
+
+    async def _send(self, client_ids: List[str]) -> None:
+        records = [self._pending[c] for c in client_ids if c in self._pending]
+        if not records:
+            return
+        await init_convex_client().mutation(BATCH_MUTATION, {"predictions": records})
+        async with self._spool_lock:
+            for record in records:
+                self._pending.pop(record["clientId"], None)
+            await asyncio.to_thread(self._rewrite, list(self._pending.values()))
+        self.flushed += len(records)
+        self.batches += 1
+
+    async def _attempt(self, client_ids: List[str], attempts: int) -> bool:
+        """Send with exponential backoff; False once ``attempts`` are used up."""
+        for attempt in range(attempts):
+            try:
+                await self._send(client_ids)
+                return True
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                self.last_error = str(e)
+                if attempt + 1 == attempts:
+                    print(f"[PREDICTIONS] Write of {len(client_ids)} record(s) failed ({e}); giving up")
+                    break
+                delay = min(_MAX_BACKOFF_SECONDS, 0.5 * (2 ** attempt))
+                print(f"[PREDICTIONS] Batch write failed ({e}); retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        return False
+
+    async def _dead_letter(self, client_id: str) -> None:
+        async with self._spool_lock:
+            record = self._pending.pop(client_id, None)
+            if record is None:
+                return
+            await asyncio.to_thread(self._append, record, self.dead_letter_path)
+            await asyncio.to_thread(self._rewrite, list(self._pending.values()))
+        self.dead_lettered += 1
+        print(f"[PREDICTIONS] Moved prediction {client_id} to {self.dead_letter_path}")
+
+    async def _deliver(self, client_ids: List[str]) -> None:
+        # clientId makes resends safe; a batch that keeps failing is split so
+        # one bad record does not block the others.
+        if await self._attempt(client_ids, self.max_attempts):
+            return
+        for client_id in client_ids:
+            if client_id not in self._pending:
+                continue
+            if len(client_ids) == 1 or not await self._attempt([client_id], self.max_attempts):
+                await self._dead_letter(client_id)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            # Linger briefly so concurrent predictions share one mutation.
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._deliver(batch)
+
+    async def _drain(self) -> None:
+        # One pass, no backoff: whatever fails stays spooled for the next start.
+        client_ids = list(self._pending.keys())
+        for i in range(0, len(client_ids), self.batch_size):
+            batch = client_ids[i : i + self.batch_size]
+            if await self._attempt(batch, 1):
+                continue
+            sent = 0
+            if len(batch) > 1:
+                for client_id in batch:
+                    sent += await self._attempt([client_id], 1)
+            if not sent:
+                # Nothing got through; do not spend the shutdown budget on timeouts
+                raise RuntimeError(self.last_error or "Convex unreachable")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "pending": len(self._pending),
+            "enqueued": self.enqueued,
+            "recovered": self.recovered,
+            "flushed": self.flushed,
+            "batches": self.batches,
+            "failures": self.failures,
+            "deadLettered": self.dead_lettered,
+            "lastError": self.last_error,
+            "config": {
+                "batchSize": self.batch_size,
+                "flushIntervalMs": self.flush_interval * 1000.0,
+                "fsync": self.fsync,
+                "maxAttempts": self.max_attempts,
+            },
+        }
+
+
+_writer: Optional[PredictionWriter] = None
+
+
+async def init_prediction_writer(storage_dir: str) -> Optional[PredictionWriter]:
+    global _writer
+    if not WRITE_BEHIND_ENABLED:
+        _writer = None
+        return None
+    _writer = PredictionWriter(str(Path(storage_dir) / "spool" / "predictions.jsonl"))
+    await _writer.start()
+    return _writer
+
+
+async def close_prediction_writer() -> None:
+    global _writer
+    if _writer is not None:
+        await _writer.close()
+        _writer = None
+
+
+def get_prediction_writer() -> Optional[PredictionWriter]:
+    return _writer
@@ -1,33 +1,38 @@
+import asyncio
+import json
 import os
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 
-import cv2
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 
+from analysis import (
+    ROI_PERSIST_MODE,
+    STORAGE_DIR,
+    ProgressFn,
+    analyze_upload,
+    analyze_uploads,
+    heatmap_paths,
+    link_roi_manifest,
+)
 from auth.jwt import decode_token
 from convex_client import ConvexClient, get_convex_client
-from ml.ela import compute_ela
-from ml.qr import decode_qr
-from ml.roi import ROIResult, detect_all_rois
-
-# Try to import real inference, fall back to mock
-try:
-    from ml.inference import ForgeryInferencePipeline as RealInferencePipeline
-    USE_MOCK_INFERENCE = False
-except Exception as e:
-    print(f"[WARNING] Could not import real inference pipeline: {e}")
-    print("[WARNING] Using mock inference pipeline instead")
-    USE_MOCK_INFERENCE = True
-    from ml.mock_inference import MockInferencePipeline as RealInferencePipeline
-
-
-STORAGE_DIR = Path(os.getenv("STORAGE_DIR", "storage/uploads"))
-CHECKPOINT_DIR = os.getenv("MODEL_CHECKPOINT_DIR", "ml/checkpoints")
+from executors import get_executors
+from jobs import Job, JobManager, JobQueueFull, get_job_manager
+from ml.registry import get_registry
+from ml.roi import ROIResult, materialize_crop, persist_rois, read_roi_manifest
+from precompute import analysis_key, get_precomputer
+from prediction_cache import get_prediction_cache, sha256_file
+from prediction_writer import get_prediction_writer
+
+
 security = HTTPBearer(auto_error=False)
+MAX_BATCH_UPLOADS = int(os.getenv("PREDICTION_BATCH_MAX_UPLOADS", "500"))
 
 router = APIRouter(prefix="/predictions", tags=["predictions"])
 
@@ -36,9 +41,14 @@ class PredictionRequest(BaseModel):
     uploadId: str
 
 
+class BatchPredictionRequest(BaseModel):
+    uploadIds: List[str]
+
+
 class ROIMetadata(BaseModel):
     kind: str
     path: str
+    bbox: Optional[List[int]] = None
 
 
 class PredictionResponse(BaseModel):
@@ -49,14 +59,35 @@ class PredictionResponse(BaseModel):
     severity: str
     tamperedRatio: float
     elaPath: str
+    # Mean / peak per-block ELA energy (cheap numeric tamper signal)
+    elaEnergy: Optional[float] = None
+    elaPeakEnergy: Optional[float] = None
     roiCrops: List[ROIMetadata]
     heatmapFull: str
     roiHeatmaps: List[ROIMetadata]
     qrData: Optional[str] = None
     qrValid: bool
+    # Raw ROI detections (text boxes counted before merging) vs. ROIs
+    # actually scored after merging and per-kind budgets
+    roiDetected: Optional[int] = None
+    roiEvaluated: Optional[int] = None
     createdAt: float
 
 
+class JobResponse(BaseModel):
+    jobId: str
+    uploadId: str
+    # queued | running | succeeded | failed | cancelled
+    status: str
+    # Most recently started pipeline stage (ela, qr, roi, inference, heatmaps)
+    stage: Optional[str] = None
+    createdAt: float
+    startedAt: Optional[float] = None
+    finishedAt: Optional[float] = None
+    result: Optional[PredictionResponse] = None
+    error: Optional[str] = None
+
+
 def get_user_id_from_auth(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> str:
     """Extract user ID from JWT token. If no token, use demo user."""
     if not credentials:
@@ -69,93 +100,311 @@ def get_user_id_from_auth(credentials: Optional[HTTPAuthorizationCredentials] =
         return "demo_user_123"
 
 
+def get_inference_pipeline():
+    """Return the shared, warmed-up pipeline or 503 while models are loading."""
+    registry = get_registry()
+    if registry is None or not registry.ready:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Models are still loading, retry shortly",
+        )
+    return registry.pipeline
+
+
+def _upload_error(upload: Optional[Dict[str, Any]], user_id: str) -> Optional[Tuple[int, str]]:
+    if not upload:
+        return status.HTTP_404_NOT_FOUND, "Upload not found"
+    if upload["userId"] != user_id:
+        return status.HTTP_403_FORBIDDEN, "Not your upload"
+    if not Path(upload["imagePath"]).exists():
+        return status.HTTP_404_NOT_FOUND, "Uploaded image missing on server"
+    return None
+
+
+async def _get_owned_upload(convex: ConvexClient, upload_id: str, user_id: str) -> Dict[str, Any]:
+    upload = await convex.query(
+        "uploads:getUploadById", {"uploadId": upload_id}
+    )
+    error = _upload_error(upload, user_id)
+    if error is not None:
+        raise HTTPException(status_code=error[0], detail=error[1])
+    return upload
+
+
+async def _compute_payload(
+    upload: Dict[str, Any],
+    pipeline: Any,
+    progress: Optional[ProgressFn] = None,
+) -> Tuple[Dict[str, Any], List[ROIResult]]:
+    """
+    Prediction fields for an upload, plus the ROI crops the caller should
+    persist after responding (empty when served from cache or precompute).
+    """
+    upload_id = str(upload["_id"])
+    image_path = upload["imagePath"]
+
+    # Identical bytes + same checkpoints + same pipeline settings => reuse
+    # the stored scores and artifact paths instead of recomputing.
+    cache = get_prediction_cache()
+    precomputer = get_precomputer()
+    cache_key = None
+    if cache is not None or precomputer is not None:
+        content_hash = upload.get("contentHash") or await get_executors().run(
+            "decode", sha256_file, image_path
+        )
+        cache_key = analysis_key(content_hash)
+    if cache is not None:
+        payload = await cache.aget(cache_key)
+        if payload is not None:
+            return await _reuse_payload(upload_id, payload), []
+
+    # Attach to speculative analysis started at upload time, if any
+    if precomputer is not None:
+        job = precomputer.attach(cache_key)
+        if job is not None:
+            try:
+                payload = dict(await asyncio.shield(job))
+            except Exception:
+                pass  # failed or cancelled: run it live below
+            else:
+                return await _reuse_payload(upload_id, payload), []
+
+    analysis = await analyze_upload(upload_id, image_path, pipeline, progress=progress)
+    payload = analysis.payload()
+    if cache is not None:
+        await cache.aput(cache_key, payload)
+    return payload, analysis.rois if ROI_PERSIST_MODE == "background" else []
+
+
+async def _reuse_payload(upload_id: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """A payload computed for possibly another upload with the same bytes."""
+    await get_executors().run("roi", link_roi_manifest, upload_id, payload)
+    return payload
+
+
+async def _record_prediction(
+    convex: ConvexClient, upload_id: str, payload: Dict[str, Any]
+) -> PredictionResponse:
+    record = {
+        "uploadId": upload_id,
+        "densenetScore": payload["densenetScore"],
+        "mobilenetScore": payload["mobilenetScore"],
+        "ensembleScore": payload["ensembleScore"],
+        "severity": payload["severity"],
+        "tamperedRatio": payload["tamperedRatio"],
+        "heatmapPaths": heatmap_paths(payload),
+        "createdAt": datetime.now(timezone.utc).timestamp(),
+    }
+
+    # Write-behind: spool the record and respond without waiting on Convex.
+    writer = get_prediction_writer()
+    if writer is not None:
+        await writer.enqueue(record)
+        created_at = record["createdAt"]
+    else:
+        prediction = await convex.mutation("predictions:createPrediction", record)
+        created_at = prediction["createdAt"]
+
+    return PredictionResponse(
+        **payload,
+        uploadId=upload_id,
+        createdAt=created_at,
+    )
+
+
 @router.post("/", response_model=PredictionResponse)
 async def run_prediction(
     body: PredictionRequest,
+    background_tasks: BackgroundTasks,
     user_id: str = Depends(get_user_id_from_auth),
     convex: ConvexClient = Depends(get_convex_client),
+    pipeline=Depends(get_inference_pipeline),
 ):
-    upload = await convex.query(
-        "uploads:getUploadById", {"uploadId": body.uploadId}
-    )
-    if not upload:
+    upload = await _get_owned_upload(convex, body.uploadId, user_id)
+    payload, unpersisted = await _compute_payload(upload, pipeline)
+    if unpersisted:
+        background_tasks.add_task(persist_rois, unpersisted)
+    return await _record_prediction(convex, body.uploadId, payload)
+
+
+@router.post("/batch")
+async def run_batch_prediction(
+    body: BatchPredictionRequest,
+    user_id: str = Depends(get_user_id_from_auth),
+    convex: ConvexClient = Depends(get_convex_client),
+    pipeline=Depends(get_inference_pipeline),
+):
+    """
+    Predict many uploads in one call, streaming one NDJSON line per upload
+    as it completes (not in request order). Successful lines carry
+    ``{"uploadId", "ok": true, "result": <PredictionResponse>}``, failures
+    ``{"uploadId", "ok": false, "status", "detail"}``.
+    """
+    upload_ids = list(dict.fromkeys(body.uploadIds))
+    if len(upload_ids) > MAX_BATCH_UPLOADS:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Upload not found"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {MAX_BATCH_UPLOADS} uploads per batch",
         )
-    if upload["userId"] != user_id:
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN, detail="Not your upload"
+    found = await convex.query("uploads:getUploadsByIds", {"uploadIds": upload_ids})
+    uploads = dict(zip(upload_ids, found))
+    cache = get_prediction_cache()
+
+    def line(upload_id: str, **fields: Any) -> str:
+        return json.dumps({"uploadId": upload_id, **fields}) + "\n"
+
+    def failure(upload_id: str, detail: str) -> str:
+        return line(
+            upload_id, ok=False, status=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=detail
         )
 
-    image_path = upload["imagePath"]
-    if not Path(image_path).exists():
+    async def success(
+        upload_id: str, payload: Dict[str, Any], cache_key: Optional[str] = None
+    ) -> str:
+        # One upload failing to be cached or recorded must not end the stream
+        try:
+            if cache_key is not None:
+                await cache.aput(cache_key, payload)
+            response = await _record_prediction(convex, upload_id, payload)
+        except Exception as e:
+            print(f"[PREDICTIONS] Recording batch prediction for {upload_id} failed: {e}")
+            return failure(upload_id, f"Recording prediction failed: {e}")
+        return line(upload_id, ok=True, result=jsonable_encoder(response))
+
+    async def stream():
+        pending: List[Tuple[str, str]] = []
+        cache_keys: Dict[str, str] = {}
+        for upload_id in upload_ids:
+            upload = uploads.get(upload_id)
+            error = _upload_error(upload, user_id)
+            if error is not None:
+                yield line(upload_id, ok=False, status=error[0], detail=error[1])
+                continue
+            if cache is not None:
+                try:
+                    content_hash = upload.get("contentHash") or await get_executors().run(
+                        "decode", sha256_file, upload["imagePath"]
+                    )
+                    cache_keys[upload_id] = analysis_key(content_hash)
+                    payload = await cache.aget(cache_keys[upload_id])
+                    if payload is not None:
+                        payload = await _reuse_payload(upload_id, payload)
+                except Exception as e:
+                    yield failure(upload_id, f"Analysis failed: {e}")
+                    continue
+                if payload is not None:
+                    yield await success(upload_id, payload)
+                    continue
+            pending.append((upload_id, upload["imagePath"]))
+
+        async for upload_id, outcome in analyze_uploads(pending, pipeline):
+            if isinstance(outcome, Exception):
+                yield failure(upload_id, f"Analysis failed: {outcome}")
+                continue
+            if ROI_PERSIST_MODE == "background":
+                get_executors().spawn("roi", persist_rois, outcome.rois)
+            yield await success(upload_id, outcome.payload(), cache_keys.get(upload_id))
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+def _get_job_manager() -> JobManager:
+    manager = get_job_manager()
+    if manager is None:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="Uploaded image missing on server"
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Job queue is not running"
         )
+    return manager
 
-    # ELA
-    ela_dir = STORAGE_DIR / "ela" / body.uploadId
-    ela_dir.mkdir(parents=True, exist_ok=True)
-    ela_path, _ = compute_ela(
-        image_path, str(ela_dir / "ela.jpg")
-    )
 
-    # ROI detection
-    roi_dir = STORAGE_DIR / "rois" / body.uploadId
-    rois: List[ROIResult] = detect_all_rois(image_path, str(roi_dir))
+def _get_owned_job(job_id: str, user_id: str, manager: JobManager) -> Job:
+    job = manager.get(job_id)
+    # Other users' jobs are reported as missing rather than forbidden
+    if job is None or job.user_id != user_id:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
 
-    roi_for_inference = [{"kind": r.kind, "path": r.path} for r in rois]
 
-    # QR validation on full image or QR ROI if exists
-    qr_data, qr_valid = decode_qr(image_path)
-    if not qr_data:
-        # try QR ROI
-        qr_rois = [r for r in rois if r.kind == "qr"]
-        if qr_rois:
-            qr_data, qr_valid = decode_qr(qr_rois[0].path)
+@router.post("/jobs", response_model=JobResponse, status_code=status.HTTP_202_ACCEPTED)
+async def submit_prediction_job(
+    body: PredictionRequest,
+    user_id: str = Depends(get_user_id_from_auth),
+    convex: ConvexClient = Depends(get_convex_client),
+    pipeline=Depends(get_inference_pipeline),
+    manager: JobManager = Depends(_get_job_manager),
+):
+    """Queue a prediction and return immediately with a job id to poll."""
+    upload = await _get_owned_upload(convex, body.uploadId, user_id)
 
-    # Inference
-    pipeline = RealInferencePipeline(
-        CHECKPOINT_DIR, str(STORAGE_DIR)
-    )
-    result = pipeline.run(
-        full_image_path=image_path,
-        roi_paths=roi_for_inference,
-        upload_id=body.uploadId,
-    )
+    async def runner(job: Job, progress: ProgressFn) -> Dict[str, Any]:
+        payload, unpersisted = await _compute_payload(upload, pipeline, progress=progress)
+        response = await _record_prediction(convex, body.uploadId, payload)
+        if unpersisted:
+            # Not awaited: the job result should not wait on crop writes
+            get_executors().spawn("roi", persist_rois, unpersisted)
+        return jsonable_encoder(response)
 
-    created_at = datetime.now(timezone.utc).timestamp()
-
-    prediction = await convex.mutation(
-        "predictions:createPrediction",
-        {
-            "uploadId": body.uploadId,
-            "densenetScore": result.full_image_scores.densenet,
-            "mobilenetScore": result.full_image_scores.mobilenet,
-            "ensembleScore": result.full_image_scores.ensemble,
-            "severity": result.severity,
-            "tamperedRatio": result.tampered_ratio,
-            "heatmapPaths": [result.full_image_heatmap]
-            + [r.heatmap_path for r in result.roi_results],
-            "createdAt": created_at,
-        },
-    )
+    try:
+        job = manager.submit(body.uploadId, user_id, runner)
+    except JobQueueFull as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    return JobResponse(**job.snapshot())
 
-    return PredictionResponse(
-        uploadId=body.uploadId,
-        densenetScore=prediction["densenetScore"],
-        mobilenetScore=prediction["mobilenetScore"],
-        ensembleScore=prediction["ensembleScore"],
-        severity=prediction["severity"],
-        tamperedRatio=prediction["tamperedRatio"],
-        elaPath=str(ela_path),
-        roiCrops=[ROIMetadata(kind=r.kind, path=r.path) for r in rois],
-        heatmapFull=result.full_image_heatmap,
-        roiHeatmaps=[
-            ROIMetadata(kind=r.kind, path=r.heatmap_path) for r in result.roi_results
-        ],
-        qrData=qr_data,
-        qrValid=qr_valid,
-        createdAt=prediction["createdAt"],
+
+@router.get("/jobs/{job_id}", response_model=JobResponse)
+async def get_prediction_job(
+    job_id: str,
+    user_id: str = Depends(get_user_id_from_auth),
+    manager: JobManager = Depends(_get_job_manager),
+):
+    return JobResponse(**_get_owned_job(job_id, user_id, manager).snapshot())
+
+
+@router.get("/jobs/{job_id}/events")
+async def stream_prediction_job(
+    job_id: str,
+    user_id: str = Depends(get_user_id_from_auth),
+    manager: JobManager = Depends(_get_job_manager),
+):
+    """Server-Sent Events: status, per-stage progress, then result or error."""
+    job = _get_owned_job(job_id, user_id, manager)
+    return StreamingResponse(
+        job.stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
 
+
+@router.delete("/jobs/{job_id}", response_model=JobResponse)
+async def cancel_prediction_job(
+    job_id: str,
+    user_id: str = Depends(get_user_id_from_auth),
+    manager: JobManager = Depends(_get_job_manager),
+):
+    """Cancel a queued or running job; finished jobs are returned unchanged."""
+    job = _get_owned_job(job_id, user_id, manager)
+    manager.cancel(job)
+    return JobResponse(**job.snapshot())
+
+
+@router.get("/{upload_id}/rois/{index}")
+async def get_roi_crop(
+    upload_id: str,
+    index: int,
+    user_id: str = Depends(get_user_id_from_auth),
+    convex: ConvexClient = Depends(get_convex_client),
+):
+    """
+    Serve an ROI crop file, writing it from the source image first if it
+    has not been persisted yet.
+    """
+    upload = await _get_owned_upload(convex, upload_id, user_id)
+    entries = read_roi_manifest(STORAGE_DIR / "rois" / upload_id)
+    if index < 0 or index >= len(entries):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="ROI not found"
+        )
+    path = await get_executors().run(
+        "roi", materialize_crop, upload["imagePath"], entries[index]
+    )
+    return FileResponse(path, media_type="image/jpeg")
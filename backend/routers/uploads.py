@@ -1,18 +1,36 @@
+import asyncio
+import hashlib
 import os
+import uuid
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple
 
-from fastapi import APIRouter, Depends, File, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, File, HTTPException, Request, UploadFile
 from fastapi import status
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from pydantic import BaseModel
 
 from auth.jwt import decode_token
 from convex_client import ConvexClient, get_convex_client
+from precompute import get_precomputer
 
 
 STORAGE_DIR = Path(os.getenv("STORAGE_DIR", "storage/uploads"))
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(1024 * 1024)))
+# Allowance for multipart boundaries and part headers in Content-Length
+_MULTIPART_OVERHEAD = 64 * 1024
+
+# Leading bytes of the image formats OpenCV can decode for us
+_IMAGE_SIGNATURES = (
+    b"\xff\xd8\xff",  # JPEG
+    b"\x89PNG\r\n\x1a\n",  # PNG
+    b"BM",  # BMP
+    b"II*\x00",  # TIFF (little-endian)
+    b"MM\x00*",  # TIFF (big-endian)
+)
 security = HTTPBearer(auto_error=False)
 
 router = APIRouter(prefix="/uploads", tags=["uploads"])
@@ -22,6 +40,7 @@ class UploadResponse(BaseModel):
     uploadId: str
     imagePath: str
     createdAt: float
+    contentHash: Optional[str] = None
 
 
 def get_user_id_from_auth(credentials: Optional[HTTPAuthorizationCredentials] = Depends(security)) -> str:
@@ -36,8 +55,128 @@ def get_user_id_from_auth(credentials: Optional[HTTPAuthorizationCredentials] =
         return "demo_user_123"
 
 
+def _is_image_header(head: bytes) -> bool:
+    if head.startswith(_IMAGE_SIGNATURES):
+        return True
+    return head[:4] == b"RIFF" and head[8:12] == b"WEBP"
+
+
+def _declared_too_large(content_length: Optional[str]) -> bool:
+    try:
+        length = int(content_length or "0")
+    except ValueError:
+        return False
+    return length > MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD
+
+
+def upload_too_large(request: Request) -> bool:
+    """Cheap pre-check on the declared body size, before anything is read."""
+    return _declared_too_large(request.headers.get("content-length"))
+
+
+class UploadSizeLimitMiddleware:
+    """
+    ASGI middleware bounding request bodies under ``/uploads``.
+
+    A declared ``Content-Length`` over the limit is rejected before anything
+    is read. Bodies without one (chunked transfer encoding) are counted as
+    they arrive and the request fails with 413 as soon as the limit is
+    crossed, before Starlette's multipart parser spools the rest to disk.
+    """
+
+    def __init__(self, app, prefix: str = "/uploads"):
+        self.app = app
+        self.prefix = prefix
+        self.limit = MAX_UPLOAD_BYTES + _MULTIPART_OVERHEAD
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        too_large = JSONResponse(
+            status_code=413, content={"detail": f"Upload exceeds {MAX_UPLOAD_BYTES} bytes"}
+        )
+        headers = dict(scope["headers"])
+        if _declared_too_large(headers.get(b"content-length", b"").decode("latin-1")):
+            await too_large(scope, receive, send)
+            return
+
+        received = 0
+        started = False
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    # FastAPI re-raises HTTPExceptions from body parsing
+                    raise HTTPException(
+                        status_code=413, detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes"
+                    )
+            return message
+
+        async def tracking_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, tracking_send)
+        except HTTPException as e:
+            # Raised outside a route's exception handling (e.g. by middleware)
+            if e.status_code != 413 or started:
+                raise
+            await too_large(scope, receive, send)
+
+
+async def _stream_to_file(file: UploadFile, dest: Path) -> Tuple[str, int]:
+    """
+    Copy the upload to ``dest`` in fixed-size chunks, hashing as it goes.
+
+    Data is written to a temporary file next to ``dest`` and renamed into
+    place only once the whole body passed the type and size checks, so a
+    rejected or interrupted upload never leaves a partial image behind.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    tmp = dest.with_name(f".{dest.name}.{uuid.uuid4().hex}.part")
+    out = await asyncio.to_thread(tmp.open, "wb")
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            if size == 0 and not _is_image_header(chunk[:16]):
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST, detail="File must be an image"
+                )
+            size += len(chunk)
+            if size > MAX_UPLOAD_BYTES:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes",
+                )
+            digest.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+        if size == 0:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST, detail="Uploaded file is empty"
+            )
+        await asyncio.to_thread(out.close)
+        await asyncio.to_thread(os.replace, tmp, dest)
+    except BaseException:
+        out.close()
+        tmp.unlink(missing_ok=True)
+        raise
+    return digest.hexdigest(), size
+
+
 @router.post("/", response_model=UploadResponse)
 async def upload_aadhaar(
+    request: Request,
     file: UploadFile = File(...),
     user_id: str = Depends(get_user_id_from_auth),
     convex: ConvexClient = Depends(get_convex_client),
@@ -45,6 +184,11 @@ async def upload_aadhaar(
     try:
         print(f"[UPLOAD] Starting upload for user {user_id}")
         
+        if upload_too_large(request):
+            raise HTTPException(
+                status_code=413,
+                detail=f"Upload exceeds {MAX_UPLOAD_BYTES} bytes",
+            )
         if not file.content_type.startswith("image/"):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST, detail="File must be an image"
@@ -54,13 +198,12 @@ async def upload_aadhaar(
         user_dir = STORAGE_DIR / str(user_id)
         user_dir.mkdir(parents=True, exist_ok=True)
 
-        filename = f"{int(timestamp)}_{file.filename}"
+        filename = f"{int(timestamp)}_{Path(file.filename or 'upload').name}"
         file_path = user_dir / filename
-        with file_path.open("wb") as f:
-            content = await file.read()
-            f.write(content)
+        # Content address for the prediction cache, computed while streaming
+        content_hash, size = await _stream_to_file(file, file_path)
         
-        print(f"[UPLOAD] File saved to {file_path}")
+        print(f"[UPLOAD] File saved to {file_path} ({size} bytes)")
 
         upload = await convex.mutation(
             "uploads:createUpload",
@@ -68,15 +211,22 @@ async def upload_aadhaar(
                 "userId": user_id,
                 "imagePath": str(file_path),
                 "createdAt": timestamp,
+                "contentHash": content_hash,
             },
         )
         
         print(f"[UPLOAD] Convex response: {upload}")
 
+        # Optionally start the analysis now so /predictions/ can attach to it
+        precomputer = get_precomputer()
+        if precomputer is not None:
+            precomputer.submit(str(upload["_id"]), str(file_path), content_hash)
+
         return UploadResponse(
             uploadId=str(upload["_id"]),
             imagePath=upload["imagePath"],
             createdAt=upload["createdAt"],
+            contentHash=upload.get("contentHash", content_hash),
         )
     except HTTPException:
         raise
@@ -28,6 +28,43 @@ export const createPrediction = mutation({
   },
 });
 
+// Batched insert used by the backend's write-behind queue. Delivery is
+// at-least-once, so records whose clientId is already stored are skipped.
+export const createPredictionsBatch = mutation({
+  args: {
+    predictions: v.array(
+      v.object({
+        uploadId: v.id("uploads"),
+        densenetScore: v.float64(),
+        mobilenetScore: v.float64(),
+        ensembleScore: v.float64(),
+        severity: v.string(),
+        tamperedRatio: v.float64(),
+        heatmapPaths: v.array(v.string()),
+        createdAt: v.float64(),
+        clientId: v.string(),
+      })
+    ),
+  },
+  handler: async (ctx, args) => {
+    const ids = [];
+    let skipped = 0;
+    for (const prediction of args.predictions) {
+      const existing = await ctx.db
+        .query("predictions")
+        .withIndex("by_client_id", (q) => q.eq("clientId", prediction.clientId))
+        .first();
+      if (existing) {
+        ids.push(existing._id);
+        skipped++;
+        continue;
+      }
+      ids.push(await ctx.db.insert("predictions", prediction));
+    }
+    return { inserted: args.predictions.length - skipped, skipped, ids };
+  },
+});
+
 export const getPredictionsByUpload = query({
   args: { uploadId: v.id("uploads") },
   handler: async (ctx, args) => {
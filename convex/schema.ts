@@ -12,6 +12,7 @@ export default defineSchema({
     userId: v.id("users"),
     imagePath: v.string(),
     createdAt: v.float64(),
+    contentHash: v.optional(v.string()),
   }).index("by_user", ["userId"]),
 
   predictions: defineTable({
@@ -23,7 +24,11 @@ export default defineSchema({
     tamperedRatio: v.float64(),
     heatmapPaths: v.array(v.string()),
     createdAt: v.float64(),
-  }).index("by_upload", ["uploadId"]),
+    // Idempotency key set by the backend's write-behind queue
+    clientId: v.optional(v.string()),
+  })
+    .index("by_upload", ["uploadId"])
+    .index("by_client_id", ["clientId"]),
 
   models: defineTable({
     name: v.string(),
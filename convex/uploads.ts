@@ -6,12 +6,14 @@ export const createUpload = mutation({
     userId: v.id("users"),
     imagePath: v.string(),
     createdAt: v.float64(),
+    contentHash: v.optional(v.string()),
   },
   handler: async (ctx, args) => {
     const id = await ctx.db.insert("uploads", {
       userId: args.userId,
       imagePath: args.imagePath,
       createdAt: args.createdAt,
+      contentHash: args.contentHash,
     });
     const upload = await ctx.db.get(id);
     return upload!;
@@ -26,6 +28,19 @@ export const getUploadById = query({
   },
 });
 
+// Bulk lookup for batch predictions; preserves order, null for unknown ids
+export const getUploadsByIds = query({
+  args: { uploadIds: v.array(v.string()) },
+  handler: async (ctx, args) => {
+    return await Promise.all(
+      args.uploadIds.map(async (uploadId) => {
+        const id = ctx.db.normalizeId("uploads", uploadId);
+        return id ? await ctx.db.get(id) : null;
+      })
+    );
+  },
+});
+
 export const getUploadsByUser = query({
   args: { userId: v.id("users") },
   handler: async (ctx, args) => {